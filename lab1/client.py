@@ -2,59 +2,425 @@
 import socket
 import sys
 import os
+import posixpath
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from urllib.parse import quote, unquote, urljoin, urlsplit
+
+# the HTTP parser is shared with the servers in lab2
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "lab2"))
+from httpparse import BadMessage, parse_response_head
 
 DEFAULT_SAVE_DIR = "./downloads"
 
 def parse_response(response_data):
-    parts = response_data.split(b"\r\n\r\n", 1)
-    if len(parts) != 2:
+    """(status, headers, body) of a raw response; headers is a case-insensitive view"""
+    head, sep, body = response_data.partition(b"\r\n\r\n")
+    if not sep:
         return None, None, None
-
-    headers_text = parts[0].decode("utf-8", errors="ignore")
-    body = parts[1]
-
-    lines = headers_text.split("\r\n")
-    status_line = lines[0].split(" ")
     try:
-        status_code = int(status_line[1])
-    except:
+        status_code, headers = parse_response_head(head)
+    except BadMessage:
         return None, None, None
-
-    headers = {}
-    for line in lines[1:]:
-        if ":" in line:
-            k, v = line.split(":", 1)
-            headers[k.lower().strip()] = v.strip()
-
     return status_code, headers, body
 
 
-def send_request(host, port, path):
+def normalize_path(path):
     if not path.startswith("/"):
         path = "/" + path
 
     if "." not in os.path.basename(path) and not path.endswith("/"):
         path += "/"
+    return path
+
+
+class ConnectionPool:
+    """Keep-alive connections to one server, shared by all threads of the client"""
+
+    def __init__(self, host, port, size=8, timeout=30):
+        self.host = host
+        self.port = port
+        self.size = size            # idle connections kept open at most
+        self.timeout = timeout
+        self.idle = []
+        self.lock = threading.Lock()
+        self.opened = 0
+
+    def acquire(self):
+        """(socket, buffered reader, reused?) for one request"""
+        with self.lock:
+            if self.idle:
+                return (*self.idle.pop(), True)
+            self.opened += 1
+        s = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        return s, s.makefile("rb", buffering=65536), False
+
+    def release(self, s, reader):
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append((s, reader))
+                return
+        close_connection(s, reader)
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for s, reader in idle:
+            close_connection(s, reader)
+
+
+def close_connection(s, reader):
+    reader.close()
+    s.close()
+
 
+class Response:
+    """Status and headers of a response whose body is still on the socket"""
+
+    def __init__(self, pool, s, reader, status, headers, has_body):
+        self.pool = pool
+        self.s = s
+        self.reader = reader
+        self.status = status
+        self.headers = headers
+        self.has_body = has_body
+
+    def stream(self, write):
+        """Pass the body to write() piece by piece (never all of it in memory);
+        returns its length. Handles Content-Length, chunked and read-until-close."""
+        received = 0
+        reusable = "close" not in self.headers.get("connection", "").lower()
+        try:
+            if not self.has_body:
+                pass
+            elif "chunked" in self.headers.get("transfer-encoding", "").lower():
+                received = self._stream_chunked(write)
+            elif "content-length" in self.headers:
+                received = self._stream_exact(write, int(self.headers["content-length"]))
+            else:
+                reusable = False
+                while True:
+                    data = self.reader.read1(65536)
+                    if not data:
+                        break
+                    write(data)
+                    received += len(data)
+        except BaseException:
+            close_connection(self.s, self.reader)
+            raise
+        if reusable:
+            self.pool.release(self.s, self.reader)
+        else:
+            close_connection(self.s, self.reader)
+        return received
+
+    def _stream_exact(self, write, length):
+        received = 0
+        while received < length:
+            data = self.reader.read1(min(65536, length - received))
+            if not data:
+                raise ConnectionError(f"connection closed after {received} of {length} bytes")
+            write(data)
+            received += len(data)
+        return received
+
+    def _stream_chunked(self, write):
+        received = 0
+        while True:
+            line = self.reader.readline(1024)
+            if not line.endswith(b"\n"):
+                raise ConnectionError("bad chunk size line")
+            try:
+                size = int(line.split(b";")[0].strip() or b"0", 16)
+            except ValueError:
+                raise ConnectionError(f"bad chunk size line: {line[:40]!r}") from None
+            if size == 0:
+                break
+            received += self._stream_exact(write, size)
+            self.reader.readline(8)     # CRLF after the chunk data
+        # optional trailer fields, then a blank line
+        while self.reader.readline(65536) not in (b"\r\n", b"\n", b""):
+            pass
+        return received
+
+    def read(self):
+        """The whole body (for small responses such as listings)"""
+        parts = []
+        self.stream(parts.append)
+        return b"".join(parts)
+
+    def discard(self):
+        self.stream(lambda data: None)
+
+
+def request_target(path):
+    """Percent-encode a path for the request line (lab1 listings contain raw spaces)"""
+    return quote(path, safe="/%?=&:@+,;~")
+
+
+def fetch(pool, path, extra_headers=(), method="GET"):
+    """Send one request on a pooled connection; the body is left for Response.stream()"""
     request = (
-        f"GET {path} HTTP/1.1\r\n"
-        f"Host: {host}:{port}\r\n"
-        "Connection: close\r\n"
+        f"{method} {request_target(path)} HTTP/1.1\r\n"
+        f"Host: {pool.host}:{pool.port}\r\n"
+        + "".join(f"{h}\r\n" for h in extra_headers) +
         "\r\n"
-    )
-
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.connect((host, port))
-    s.sendall(request.encode("utf-8"))
+    ).encode("utf-8")
 
-    response = b""
     while True:
-        chunk = s.recv(4096)
-        if not chunk:
-            break
-        response += chunk
-    s.close()
-    return response
+        s, reader, reused = pool.acquire()
+        try:
+            s.sendall(request)
+            head = bytearray()
+            while not head.endswith(b"\r\n\r\n"):
+                line = reader.readline(65536)
+                if not line:
+                    raise ConnectionError("connection closed before the response")
+                head += line
+        except OSError:
+            close_connection(s, reader)
+            if reused:
+                continue    # the server dropped this idle connection; retry on a new one
+            raise
+        status, headers, _ = parse_response(bytes(head))
+        if status is None:
+            close_connection(s, reader)
+            raise ConnectionError("invalid HTTP response")
+        has_body = method != "HEAD" and status not in (204, 304) and status >= 200
+        return Response(pool, s, reader, status, headers, has_body)
+
+
+def save_body(response, path):
+    """Stream a response body into a file; returns the number of bytes"""
+    tmp = path + ".part"
+    with open(tmp, "wb") as f:
+        n = response.stream(f.write)
+    os.replace(tmp, path)
+    return n
+
+
+def local_path(save_dir, relative):
+    """Where a mirrored URL path (relative to the mirrored root, unquoted) is
+    saved, or None if it would land outside save_dir"""
+    relative = posixpath.normpath(relative)
+    parts = relative.split("/")
+    if relative.startswith("/") or ".." in parts or any(os.path.isabs(p) or os.sep in p for p in parts):
+        return None
+    local = os.path.join(save_dir, *parts)
+    base = os.path.realpath(save_dir)
+    if os.path.commonpath([base, os.path.realpath(local)]) != base:
+        return None     # e.g. through a symlink already in save_dir
+    return local
+
+
+def parse_links(html):
+    """href targets of a directory listing page"""
+    return [href for href in re.findall(r'href="([^"]*)"', html) if href]
+
+
+def content_range(headers):
+    """(first byte, total size) from a 206's Content-Range header"""
+    spec = headers.get("content-range", "")
+    try:
+        first = int(spec.split()[1].split("-")[0])
+        total = int(spec.rsplit("/", 1)[1])
+    except (IndexError, ValueError):
+        return None, None
+    return first, total
+
+
+def resume_download(pool, url_path, dest):
+    """Download to dest + '.part', continuing from where an earlier attempt stopped.
+    If-Range makes the server send the whole file again if it changed meanwhile."""
+    part = dest + ".part"
+    meta = part + ".validator"
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    extra = []
+    if offset and os.path.exists(meta):
+        with open(meta) as f:
+            validator = f.read().strip()
+        extra = [f"Range: bytes={offset}-", f"If-Range: {validator}"]
+        print(f"Resuming at byte {offset}")
+
+    response = fetch(pool, normalize_path(url_path), extra)
+    headers = response.headers
+    if response.status == 416 and extra:
+        # nothing left to fetch: the part file already holds the whole file
+        mode = "ab"
+    elif response.status == 206 and content_range(headers)[0] == offset:
+        mode = "ab"
+    elif response.status == 200:
+        if extra:
+            print("File changed on the server (or no range support), starting over")
+        offset = 0
+        mode = "wb"
+    else:
+        response.discard()
+        print(f"✘ Unexpected response: {response.status}")
+        sys.exit(1)
+
+    validator = headers.get("etag") or headers.get("last-modified")
+    if validator:
+        with open(meta, "w") as f:
+            f.write(validator)
+
+    received = 0
+    with open(part, mode) as f:
+        if response.status == 416:
+            response.discard()
+        else:
+            try:
+                received = response.stream(f.write)
+            except OSError:
+                f.flush()
+                print(f"✘ Connection lost after {os.path.getsize(part)} bytes; run again with --resume to continue")
+                sys.exit(1)
+
+    os.replace(part, dest)
+    if os.path.exists(meta):
+        os.remove(meta)
+    print(f"✔ Saved: {dest}")
+    print(f"Bytes: {offset + received} ({received} transferred)")
+
+
+def parallel_download(pool, url_path, dest, n):
+    """Fetch n byte ranges of the file over n connections at once, each written
+    at its own offset of a preallocated file."""
+    url_path = normalize_path(url_path)
+    # a one-byte range tells us the size, the validator and whether ranges work at all
+    probe = fetch(pool, url_path, ["Range: bytes=0-0"])
+    probe.discard()
+    first, total = content_range(probe.headers)
+    if probe.status != 206 or total is None:
+        print("Server does not support ranges, downloading in one piece")
+        return resume_download(pool, url_path, dest)
+    validator = probe.headers.get("etag") or probe.headers.get("last-modified")
+
+    n = max(1, min(n, total))
+    bounds = [total * i // n for i in range(n + 1)]
+    part = dest + ".part"
+    with open(part, "wb") as f:
+        f.truncate(total)
+    fd = os.open(part, os.O_WRONLY)
+    errors = []
+
+    def fetch_segment(start, end):
+        extra = [f"Range: bytes={start}-{end - 1}"]
+        if validator:
+            extra.append(f"If-Range: {validator}")
+        try:
+            response = fetch(pool, url_path, extra)
+            if response.status != 206 or content_range(response.headers)[0] != start:
+                close_connection(response.s, response.reader)
+                errors.append(f"bytes {start}-{end - 1}: got {response.status} (file changed?)")
+                return
+            pos = [start]
+            def write(data):
+                os.pwrite(fd, data, pos[0])
+                pos[0] += len(data)
+            response.stream(write)
+        except OSError as e:
+            errors.append(f"bytes {start}-{end - 1}: {e}")
+
+    threads = [threading.Thread(target=fetch_segment, args=(bounds[i], bounds[i + 1])) for i in range(n) if bounds[i] < bounds[i + 1]]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    os.close(fd)
+
+    if errors:
+        for e in errors:
+            print(f"✘ {e}")
+        sys.exit(1)
+    os.replace(part, dest)
+    print(f"✔ Saved: {dest}")
+    print(f"Bytes: {total} in {len(threads)} segments")
+
+
+def mirror(pool, url_path, save_dir, jobs):
+    """Download a whole directory tree: listings are walked and every entry is
+    fetched, at most `jobs` requests at a time over pooled keep-alive connections."""
+    root = normalize_path(url_path)
+    if not root.endswith("/"):
+        root += "/"
+    root = request_target(unquote(root))
+    seen = {root}
+    totals = {"files": 0, "bytes": 0, "errors": 0}
+    totals_lock = threading.Lock()
+
+    def count(key, n=1):
+        with totals_lock:
+            totals[key] += n
+
+    def visit(path):
+        """Fetch one URL; returns the new URLs found if it was a listing"""
+        for attempt in range(5):
+            response = fetch(pool, path)
+            if response.status not in (429, 503):
+                break
+            # rate limited / overloaded: wait as told and try again
+            response.discard()
+            time.sleep(float(response.headers.get("retry-after", 1)))
+        if response.status != 200:
+            response.discard()
+            print(f"✘ {path}: {response.status}")
+            count("errors")
+            return []
+
+        listing = urlsplit(path).path.endswith("/")
+        if listing and "text/html" in response.headers.get("content-type", ""):
+            html = response.read().decode("utf-8", errors="ignore")
+            found = []
+            for href in parse_links(html):
+                target = unquote(urljoin(path, href))
+                if "#" in target:
+                    continue
+                # resolve dot segments after unquoting: "%2e%2e/" is ".." once decoded
+                target_path, sep, query = target.partition("?")
+                resolved = posixpath.normpath(target_path)
+                if target_path.endswith("/") and not resolved.endswith("/"):
+                    resolved += "/"
+                target = request_target(resolved + sep + query)
+                if target.startswith(root):
+                    found.append(target)
+            return found
+
+        local = local_path(save_dir, unquote(urlsplit(path).path[len(root):]))
+        if local is None:
+            response.discard()
+            print(f"✘ {path}: outside {save_dir}, skipped")
+            count("errors")
+            return []
+        os.makedirs(os.path.dirname(local), exist_ok=True)
+        n = save_body(response, local)
+        count("files")
+        count("bytes", n)
+        print(f"✔ {local} ({n} bytes)")
+        return []
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=jobs) as pool_executor:
+        pending = {pool_executor.submit(visit, root)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    found = future.result()
+                except OSError as e:
+                    print(f"✘ {e}")
+                    count("errors")
+                    continue
+                for target in found:
+                    if target not in seen:
+                        seen.add(target)
+                        pending.add(pool_executor.submit(visit, target))
+    elapsed = time.perf_counter() - start
+    print(f"Mirrored {totals['files']} files, {totals['bytes']} bytes in {elapsed:.2f}s "
+          f"({pool.opened} connections, {totals['errors']} errors)")
 
 
 def ensure_dir(path):
@@ -63,65 +429,72 @@ def ensure_dir(path):
 
 def main():
     if len(sys.argv) < 4:
-        print("Usage: python client.py <server_host> <server_port> <url_path> [save_directory]")
+        print("Usage: python client.py <server_host> <server_port> <url_path> [save_directory] "
+              "[--resume | --parallel N | --mirror [--jobs N]]")
         print("Example: python client.py localhost 8000 /extra")
+        print("         python client.py localhost 8000 /big.pdf --parallel 4")
+        print("         python client.py localhost 8080 / --mirror --jobs 8")
         sys.exit(1)
 
     host = sys.argv[1]
     port = int(sys.argv[2])
     url_path = sys.argv[3]
-    save_dir = sys.argv[4] if len(sys.argv) > 4 else DEFAULT_SAVE_DIR
+    save_dir = sys.argv[4] if len(sys.argv) > 4 and not sys.argv[4].startswith("--") else DEFAULT_SAVE_DIR
+    parallel = int(sys.argv[sys.argv.index("--parallel") + 1]) if "--parallel" in sys.argv else 0
+    jobs = int(sys.argv[sys.argv.index("--jobs") + 1]) if "--jobs" in sys.argv else 8
 
     ensure_dir(save_dir)
+    pool = ConnectionPool(host, port, size=max(jobs, parallel))
 
     print(f"Requesting http://{host}:{port}{url_path}")
 
-    response = send_request(host, port, url_path)
-    status, headers, body = parse_response(response)
-
-    if status is None:
-        print("✘ Invalid HTTP response")
-        sys.exit(1)
-
-    print(f"Status: {status}")
-
-    if status != 200:
-        print(body.decode(errors="ignore"))
-        sys.exit(1)
-
-    content_type = headers.get("content-type", "")
-
-    if "text/html" in content_type:
-        html = body.decode("utf-8", errors="ignore")
-
-        items = []
-        for line in html.splitlines():
-            line = line.strip()
-            if "<a " in line and "href=" in line:
-                start = line.find("href=") + 6  
-                end = line.find('"', start)
-                href = line[start:end]
-                if href:
-                    items.append(href)
-
-        print("Directory contents:")
-        for item in items:
-            print(item)
-        return
-
-
-    filename = os.path.basename(url_path.rstrip("/")) or "download"
-    if "pdf" in content_type and not filename.endswith(".pdf"):
-        filename += ".pdf"
-    elif "png" in content_type and not filename.endswith(".png"):
-        filename += ".png"
-
-    path = os.path.join(save_dir, filename)
-    with open(path, "wb") as f:
-        f.write(body)
-
-    print(f"✔ Saved: {path}")
-    print(f"Bytes: {len(body)}")
+    try:
+        # recursive download of a whole directory tree
+        if "--mirror" in sys.argv:
+            mirror(pool, url_path, save_dir, jobs)
+            return
+
+        # file downloads that survive dropped connections / use several connections
+        if parallel or "--resume" in sys.argv:
+            dest = os.path.join(save_dir, os.path.basename(url_path.rstrip("/")) or "download")
+            if parallel:
+                parallel_download(pool, url_path, dest, parallel)
+            else:
+                resume_download(pool, url_path, dest)
+            return
+
+        url_path = normalize_path(url_path)
+        response = fetch(pool, url_path)
+        print(f"Status: {response.status}")
+
+        if response.status != 200:
+            print(response.read().decode(errors="ignore"))
+            sys.exit(1)
+
+        content_type = response.headers.get("content-type", "")
+
+        if "text/html" in content_type and url_path.endswith("/"):
+            html = response.read().decode("utf-8", errors="ignore")
+
+            print("Directory contents:")
+            for item in parse_links(html):
+                print(item)
+            return
+
+        filename = os.path.basename(url_path.rstrip("/")) or "download"
+        if "pdf" in content_type and not filename.endswith(".pdf"):
+            filename += ".pdf"
+        elif "png" in content_type and not filename.endswith(".png"):
+            filename += ".png"
+
+        # streamed straight to disk, never held in memory
+        path = os.path.join(save_dir, filename)
+        n = save_body(response, path)
+
+        print(f"✔ Saved: {path}")
+        print(f"Bytes: {n}")
+    finally:
+        pool.close()
 
 
 if __name__ == "__main__":
@@ -1,12 +1,69 @@
 import socket
+import ssl
 import os
 import sys
-import mimetypes
+import time
+import threading
 from pathlib import Path
 from urllib.parse import unquote
 
-def generate_directory_listing(directory_path, url_path):
-    """Generate HTML directory listing"""
+# shared server helpers (prefork, ...) live next to the lab2 servers
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "lab2"))
+import prefork
+import tls
+from access_log import AccessLog, MeteredSocket
+from byteranges import Partial, requested_ranges, unsatisfiable_headers
+from conn_guard import ConnectionGuard
+from connection import serve_connection
+from encoding import Encoder, compressible, content_type
+from file_cache import CacheEntry, FileCache
+from filesend import FileResponse, write_response
+from headers import HeadBuilder
+from listing_cache import ListingCache, page_bounds, page_param
+from mmap_pool import MmapPool
+from validators import CachePolicy, not_modified, validator_headers
+
+# Keep-alive: one connection is served at a time, so an idle client is let go as
+# soon as another connects (serve_connection's yield_to), or after this long
+KEEPALIVE_TIMEOUT = 2.0
+MAX_REQUESTS = 100
+
+# Status lines, the Date line (reformatted once a second) and the connection headers, prebuilt
+HEADS = HeadBuilder(KEEPALIVE_TIMEOUT, MAX_REQUESTS)
+
+# Slow clients: a request must arrive within HEADER_TIMEOUT (without stalling for
+# READ_TIMEOUT), and a client that stops reading our response is dropped after WRITE_TIMEOUT
+HEADER_TIMEOUT = 2.0
+READ_TIMEOUT = 1.0
+WRITE_TIMEOUT = 5.0
+
+# Clients that keep timing out or sending garbage are refused on accept for a while
+GUARD = ConnectionGuard(strikes=5, ban_seconds=60.0)
+
+# Hot-file cache (small files kept in memory, headers prebuilt); set up in main()
+FILE_CACHE = None
+
+# Read-only mmaps of mid-sized files, sent without copying (--mmap-mb); set up in main()
+MMAPS = None
+
+# Sorted directory contents, rescanned only when the directory's mtime changes
+DIR_LISTINGS = ListingCache()
+PAGE_SIZE = 1000
+
+# gzip/br variants of text files (precompressed .gz/.br siblings, or compressed once); set up in main()
+ENCODER = None
+
+# Requests are queued here and written in batches by a background thread; set up in main()
+ACCESS_LOG = AccessLog()
+
+# HTTPS (--tls-cert/--tls-key or --tls-self-signed); made in main() before workers fork, so they share ticket keys
+TLS_CONTEXT = None
+
+# Cache-Control per MIME type (ETag/Last-Modified let browsers revalidate with a 304)
+CACHE_POLICY = CachePolicy.parse([])
+
+def generate_directory_listing(directory_path, url_path, page=1):
+    """Generate HTML directory listing (one page of it for huge directories)"""
     html = f"""<!DOCTYPE html>
 <html>
 <head>
@@ -35,32 +92,40 @@ def generate_directory_listing(directory_path, url_path):
 <ul>
 """
     
+    parts = [html]
+    
     # Add parent directory link if not root
     if url_path != '/':
         parent = '/'.join(url_path.rstrip('/').split('/')[:-1]) or '/'
-        html += f'<li><a href="{parent}">Parent Directory</a></li>\n'
+        parts.append(f'<li><a href="{parent}">Parent Directory</a></li>\n')
     
-    # List directory contents
+    # List directory contents (cached, only one page of it)
+    nav = ''
     try:
-        items = sorted(os.listdir(directory_path))
-        for item in items:
-            item_path = os.path.join(directory_path, item)
-            if os.path.isdir(item_path):
-                html += f'<li>📁 <a href="{url_path.rstrip("/")}/{item}/">{item}/</a></li>\n'
+        items = DIR_LISTINGS.get(directory_path)
+        start, end, page, pages = page_bounds(len(items), page, PAGE_SIZE)
+        base = url_path.rstrip("/")
+        for item, is_dir, _ in items[start:end]:
+            if is_dir:
+                parts.append(f'<li>📁 <a href="{base}/{item}/">{item}/</a></li>\n')
             else:
-                html += f'<li>📄 <a href="{url_path.rstrip("/")}/{item}">{item}</a></li>\n'
+                parts.append(f'<li>📄 <a href="{base}/{item}">{item}</a></li>\n')
+        if pages > 1:
+            prev = f'<a href="?page={page - 1}">&laquo; prev</a> ' if page > 1 else ''
+            nxt = f' <a href="?page={page + 1}">next &raquo;</a>' if page < pages else ''
+            nav = f'<p>{prev}items {start + 1}-{end} of {len(items)} (page {page}/{pages}){nxt}</p>\n'
     except Exception as e:
-        html += f'<li>Error reading directory: {e}</li>\n'
+        parts.append(f'<li>Error reading directory: {e}</li>\n')
     
-    html += """</ul>
-<hr>
+    parts.append("""</ul>
+""" + nav + """<hr>
 </body>
-</html>"""
-    return html
+</html>""")
+    return ''.join(parts)
 
 def get_content_type(file_path):
     """Determine content type based on file extension"""
-    mime_type, _ = mimetypes.guess_type(file_path)
+    mime_type = content_type(os.path.basename(file_path), None)
     if mime_type:
         return mime_type
     
@@ -79,32 +144,44 @@ def get_content_type(file_path):
     }
     return content_types.get(ext, 'application/octet-stream')
 
-def handle_request(client_socket, base_directory):
-    """Handle a single HTTP request"""
+def handle_connection(client_socket, base_directory, address=None, listener=None):
+    """Serve every request sent on one connection (keep-alive, pipelining); returns how it ended"""
+    client_socket = MeteredSocket(client_socket)
+    client = address[0] if address else '-'
+    
+    def on_bad_request(err):
+        print(f"Bad request: {err}")
+        client_socket.sent = 0
+        send_response(client_socket, 400, b"Bad Request")
+        ACCESS_LOG.log(client, '-', '-', client_socket.status, client_socket.sent)
+    
+    def on_request(request, keep_alive):
+        started = time.perf_counter()
+        client_socket.sent = 0
+        client_socket.status = '-'
+        result = handle_request(client_socket, base_directory, request, keep_alive)
+        ACCESS_LOG.log(client, request.method, request.target, client_socket.status,
+                       client_socket.sent, time.perf_counter() - started)
+        return result
+    
     try:
-        # Receive the request
-        request = client_socket.recv(4096).decode('utf-8')
-        
-        if not request:
-            return
-        
-        # Parse the request line
-        lines = request.split('\r\n')
-        request_line = lines[0]
-        print(f"Request: {request_line}")
-        
-        # Extract method and path
-        parts = request_line.split()
-        if len(parts) < 2:
-            send_response(client_socket, 400, b"Bad Request")
-            return
-        
-        method = parts[0]
-        url_path = unquote(parts[1])
+        return serve_connection(client_socket, on_request, on_bad_request, KEEPALIVE_TIMEOUT, MAX_REQUESTS,
+                                header_timeout=HEADER_TIMEOUT, read_timeout=READ_TIMEOUT,
+                                write_timeout=WRITE_TIMEOUT, yield_to=listener)
+    except (ConnectionError, ssl.SSLError) as e:
+        print(f"Connection error: {e}")
+        return "closed"
+
+def handle_request(client_socket, base_directory, request, keep_alive=False):
+    """Handle a single HTTP request; returns False if the connection must close"""
+    try:
+        method = request.method
+        target, _, query = request.target.partition('?')
+        url_path = unquote(target)
         
         # Only handle GET requests
         if method != 'GET':
-            send_response(client_socket, 405, b"Method Not Allowed")
+            send_response(client_socket, 405, b"Method Not Allowed", keep_alive=keep_alive)
             return
         
         # Remove leading slash and resolve path
@@ -113,99 +190,251 @@ def handle_request(client_socket, base_directory):
         
         # Security check: ensure path is within base directory
         if not file_path.startswith(os.path.abspath(base_directory)):
-            send_response(client_socket, 403, b"Forbidden")
+            send_response(client_socket, 403, b"Forbidden", keep_alive=keep_alive)
+            return
+        
+        # Cached file: one stat() to check it is unchanged, no other lookups
+        entry = FILE_CACHE.get(file_path) if FILE_CACHE else None
+        if entry is not None:
+            send_file_entry(client_socket, entry, None, keep_alive, request.headers)
             return
         
         # Check if path exists
         if os.path.exists(file_path):
             if os.path.isdir(file_path):
-                html_content = generate_directory_listing(file_path, url_path)
-                send_response(client_socket, 200, html_content.encode('utf-8'), 'text/html')
+                html_content = generate_directory_listing(file_path, url_path, page_param(query))
+                send_response(client_socket, 200, html_content.encode('utf-8'), 'text/html', keep_alive)
             else:
-                # Read and send file
+                # Open the file; small ones are cached, big ones streamed by sendfile
                 try:
-                    with open(file_path, 'rb') as f:
-                        content = f.read()
-                    content_type = get_content_type(file_path)
-                    send_response(client_socket, 200, content, content_type)
+                    f = open(file_path, 'rb')
+                    st = os.fstat(f.fileno())
+                    keep = FILE_CACHE is not None and FILE_CACHE.keep_body(st.st_size)
+                    keep = keep and not (MMAPS and MMAPS.fits(st.st_size))
+                    body = f.read() if keep else None
                 except Exception as e:
                     print(f"Error reading file: {e}")
                     send_response(client_socket, 500, b"Internal Server Error")
+                    return False
+                content_type = get_content_type(file_path)
+                validators = validator_headers(st, content_type, CACHE_POLICY)
+                if compressible(content_type):
+                    validators.append("Vary: Accept-Encoding")
+                entry = CacheEntry(file_path, st, content_type,
+                                   header_block(st.st_size, content_type, validators + ["Accept-Ranges: bytes"]), body,
+                                   ''.join(f"{h}\r\n" for h in validators).encode('utf-8'))
+                if FILE_CACHE:
+                    FILE_CACHE.put(file_path, entry)
+                send_file_entry(client_socket, entry, f, keep_alive, request.headers)
         else:
-            send_response(client_socket, 404, b"404 Not Found")
+            send_response(client_socket, 404, b"404 Not Found", keep_alive=keep_alive)
 
     
+    except socket.timeout:
+        # The client stopped reading; the connection loop drops it
+        raise
     except Exception as e:
         print(f"Error handling request: {e}")
         try:
             send_response(client_socket, 500, b"Internal Server Error")
         except:
             pass
+        return False
 
-def send_response(client_socket, status_code, body, content_type=None):
-    """Send HTTP response"""
-    status_messages = {
-        200: 'OK',
-        400: 'Bad Request',
-        403: 'Forbidden',
-        404: 'Not Found',
-        405: 'Method Not Allowed',
-        500: 'Internal Server Error'
-    }
-    
-    status_message = status_messages.get(status_code, 'Unknown')
-    
+def header_block(content_length, content_type, extra_headers=()):
+    """Headers that only depend on the body (cached together with it)"""
+    lines = [f"Content-Type: {content_type}", f"Content-Length: {content_length}", *extra_headers]
+    return ''.join(f"{line}\r\n" for line in lines).encode('utf-8')
+
+def build_headers(status_code, content_length, content_type=None, keep_alive=False, block=None):
+    """Build the status line and headers of a response"""
     # If content type not specified, try to detect
     if content_type is None:
         content_type = 'text/html' if status_code != 200 else 'application/octet-stream'
     
-    response = f"HTTP/1.1 {status_code} {status_message}\r\n"
-    response += f"Content-Type: {content_type}\r\n"
-    response += f"Content-Length: {len(body)}\r\n"
-    response += "Connection: close\r\n"
-    response += "\r\n"
+    if block is None:
+        block = header_block(content_length, content_type)
     
-    client_socket.send(response.encode('utf-8'))
-    client_socket.send(body)
+    return HEADS.head(status_code, block, keep_alive)
+
+def send_response(client_socket, status_code, body, content_type=None, keep_alive=False):
+    """Send HTTP response (headers and body in one sendmsg, so one segment for small pages)"""
+    write_response(client_socket, [build_headers(status_code, len(body), content_type, keep_alive), body])
+
+def send_file_entry(client_socket, entry, f, keep_alive=False, request_headers=None):
+    """Send a file from its cache entry: body from memory, or streamed from disk"""
+    variant = ENCODER.negotiate(entry, request_headers.get('accept-encoding')) if ENCODER and request_headers else None
+    if variant is not None:
+        # Send the gzip/br version instead (no ranges of it)
+        if f:
+            f.close()
+        entry, f = variant, None
+    if request_headers and not_modified(request_headers, entry.etag, entry.mtime_ns):
+        # Client already has this version: headers only
+        if f:
+            f.close()
+        client_socket.sendall(build_headers(304, 0, keep_alive=keep_alive, block=entry.validators))
+        return
+    ranges = None
+    if request_headers and entry.coding is None:
+        ranges = requested_ranges(request_headers, entry.etag, entry.mtime_ns, entry.size)
+    if ranges is not None:
+        send_ranges(client_socket, entry, f, keep_alive, ranges)
+        return
+    head = build_headers(200, entry.size, keep_alive=keep_alive, block=entry.headers)
+    if entry.body is not None:
+        if f:
+            f.close()
+        write_response(client_socket, [head, entry.body])
+    elif (view := mapped(entry)) is not None:
+        # Mid-sized file: headers and mapping go out in one sendmsg()
+        if f:
+            f.close()
+        write_response(client_socket, [head, view])
+    else:
+        write_response(client_socket, FileResponse(head, f or open(entry.path, 'rb'), 0, entry.size))
+
+def send_ranges(client_socket, entry, f, keep_alive, ranges):
+    """Send only the requested byte ranges (206), or 416 if none exist"""
+    if not ranges:
+        if f:
+            f.close()
+        block = header_block(0, 'text/html', unsatisfiable_headers(entry.size))
+        client_socket.sendall(build_headers(416, 0, keep_alive=keep_alive, block=block))
+        return
+    part = Partial(ranges, entry.size, entry.ctype)
+    block = header_block(part.length, part.ctype, part.headers) + entry.validators
+    head = build_headers(206, part.length, keep_alive=keep_alive, block=block)
+    if entry.body is not None:
+        if f:
+            f.close()
+        write_response(client_socket, [head, *part.buffers(memoryview(entry.body))])
+    elif (view := mapped(entry)) is not None:
+        if f:
+            f.close()
+        write_response(client_socket, [head, *part.buffers(view)])
+    else:
+        write_response(client_socket, FileResponse(head, f or open(entry.path, 'rb'), parts=part.parts, tail=part.tail))
+
+def mapped(entry):
+    """The file as a memoryview from the mmap pool, or None if it is not served that way"""
+    if MMAPS and entry.body is None and MMAPS.fits(entry.size):
+        return MMAPS.get(entry)
+    return None
+
+def serve(server_socket, base_directory):
+    """Accept loop: one connection at a time"""
+    while True:
+        # Accept connection
+        client_socket, address = server_socket.accept()
+        
+        # Banned clients are closed straight away
+        if GUARD.admit(address[0]):
+            client_socket.close()
+            continue
+        
+        # HTTPS: the handshake gets as long as a request would
+        if TLS_CONTEXT:
+            try:
+                client_socket, _ = tls.handshake(TLS_CONTEXT, client_socket, HEADER_TIMEOUT)
+            except OSError as e:
+                print(f"TLS handshake failed: {e}")
+                GUARD.release(address[0], "header_timeout" if isinstance(e, socket.timeout) else "closed")
+                continue
+        
+        # Handle requests until the client closes, goes idle or is too slow
+        ended = handle_connection(client_socket, base_directory, address, server_socket)
+        if GUARD.release(address[0], ended):
+            print(f"Banned {address[0]} for 60s ({ended})")
+        
+        # Close connection
+        client_socket.close()
+
+def report_stats_every(interval):
+    """Print the cache counters every interval seconds from a background thread"""
+    def loop():
+        while True:
+            time.sleep(interval)
+            if FILE_CACHE:
+                print(f"[cache] {FILE_CACHE.describe()}", flush=True)
+            if MMAPS:
+                print(f"[mmap] {MMAPS.describe()}", flush=True)
+            if ENCODER:
+                print(f"[encoding] {ENCODER.describe()}", flush=True)
+    threading.Thread(target=loop, name="cache-stats", daemon=True).start()
 
 def main():
-    if len(sys.argv) != 2:
-        print("Usage: python server.py <directory>")
+    if len(sys.argv) < 2:
+        print("Usage: python server.py <directory> [--workers N] [--cache-mb MB] [--cache-control TYPE=VALUE ...] [--compress-cache-mb MB] [--mmap-mb MB] [--access-log PATH] [--log-format text|json] [--tls-cert PEM [--tls-key PEM] | --tls-self-signed] [--tls-tickets N] [--stats-interval SEC]")
         sys.exit(1)
     
     base_directory = sys.argv[1]
+    workers = int(sys.argv[sys.argv.index("--workers") + 1]) if "--workers" in sys.argv else 1
+    cache_mb = float(sys.argv[sys.argv.index("--cache-mb") + 1]) if "--cache-mb" in sys.argv else 64
+    
+    global FILE_CACHE, CACHE_POLICY, ENCODER, ACCESS_LOG, MMAPS, TLS_CONTEXT
+    CACHE_POLICY = CachePolicy.parse(v for a, v in zip(sys.argv, sys.argv[1:]) if a == "--cache-control")
+    if cache_mb > 0:
+        FILE_CACHE = FileCache(int(cache_mb * 2**20))
+    compress_mb = float(sys.argv[sys.argv.index("--compress-cache-mb") + 1]) if "--compress-cache-mb" in sys.argv else 16
+    if compress_mb > 0:
+        ENCODER = Encoder(header_block, int(compress_mb * 2**20))
+    mmap_mb = float(sys.argv[sys.argv.index("--mmap-mb") + 1]) if "--mmap-mb" in sys.argv else 0
+    if mmap_mb > 0:
+        MMAPS = MmapPool(int(mmap_mb * 2**20))
+    
+    log_path = sys.argv[sys.argv.index("--access-log") + 1] if "--access-log" in sys.argv else None
+    log_format = sys.argv[sys.argv.index("--log-format") + 1] if "--log-format" in sys.argv else "text"
+    ACCESS_LOG = AccessLog(log_path, log_format)
+    
+    tls_cert = sys.argv[sys.argv.index("--tls-cert") + 1] if "--tls-cert" in sys.argv else None
+    tls_key = sys.argv[sys.argv.index("--tls-key") + 1] if "--tls-key" in sys.argv else None
+    if "--tls-self-signed" in sys.argv:
+        tls_cert, tls_key = tls.self_signed()
+    if tls_cert:
+        tls_tickets = int(sys.argv[sys.argv.index("--tls-tickets") + 1]) if "--tls-tickets" in sys.argv else 2
+        TLS_CONTEXT = tls.server_context(tls_cert, tls_key, tls_tickets)
     
     if not os.path.isdir(base_directory):
         print(f"Error: {base_directory} is not a valid directory")
         sys.exit(1)
     
     base_directory = os.path.abspath(base_directory)
-    
-    # Create socket
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    
-    # Bind to port
     port = 8000
-    server_socket.bind(('0.0.0.0', port))
-    server_socket.listen(5)
     
-    print(f"Server listening on port {port}")
+    print(f"Server listening on port {port}" + (" (https)" if TLS_CONTEXT else ""))
     print(f"Serving directory: {base_directory}")
     
+    # Cache hit ratio and evictions every N seconds (each worker prints its own)
+    stats_interval = float(sys.argv[sys.argv.index("--stats-interval") + 1]) if "--stats-interval" in sys.argv else 0
+    
+    if workers > 1:
+        # Each worker binds its own SO_REUSEPORT socket; the kernel balances between them
+        def worker():
+            ACCESS_LOG.start()
+            if stats_interval:
+                report_stats_every(stats_interval)
+            with prefork.bind_listener(port, 5, reuse_port=True) as server_socket:
+                serve(server_socket, base_directory)
+        prefork.run_workers(workers, worker)
+        return
+    
+    # Create socket and bind to port
+    server_socket = prefork.bind_listener(port, 5)
+    ACCESS_LOG.start()
+    if stats_interval:
+        report_stats_every(stats_interval)
+    
     try:
-        while True:
-            # Accept connection
-            client_socket, address = server_socket.accept()
-            print(f"\nConnection from {address}")
-            
-            # Handle request
-            handle_request(client_socket, base_directory)
-            
-            # Close connection
-            client_socket.close()
+        serve(server_socket, base_directory)
     except KeyboardInterrupt:
         print("\nShutting down server...")
+        if FILE_CACHE:
+            print(f"Cache: {FILE_CACHE.describe()}")
+        if ENCODER:
+            print(f"Encoding: {ENCODER.describe()}")
+        if MMAPS:
+            print(f"Mmap: {MMAPS.describe()}")
     finally:
         server_socket.close()
 
@@ -0,0 +1,172 @@
+# access_log.py
+# Access log that stays off the request path. A handler only appends a tuple
+# to a deque (append/popleft are atomic, no lock) and returns; a background
+# thread wakes every `flush_interval` seconds, formats everything queued and
+# writes it with a single write(). When more than `capacity` lines are
+# waiting the new line is dropped and counted instead of blocking.
+#
+#   format   "text"  [12:00:01] 10.0.0.5 GET /kernel.html 200 OK (cached) 18090B 1001.2ms
+#            "json"  {"ts": ..., "client": ..., "method": ..., "path": ..., "status": 200, ...}
+#   rotation when the file passes `max_bytes` and/or every `rotate_seconds`:
+#            access.log -> access.log.1 -> ... -> access.log.<keep>
+#   sampling `sample` < 1 keeps that fraction of successful requests; 4xx/5xx
+#            lines are always kept.
+#
+# Forked workers may share one file: writes use O_APPEND, and a worker that
+# finds the file rotated by another one just reopens it.
+import atexit, json, os, random, sys, threading, time
+from collections import deque
+from datetime import datetime
+
+
+class AccessLog:
+    def __init__(self, path=None, fmt="text", max_bytes=0, rotate_seconds=0, keep=5,
+                 sample=1.0, capacity=65536, flush_interval=0.2):
+        self.path = path                # None: stdout
+        self.fmt = fmt
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.keep = keep
+        self.sample = sample
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.pending = deque()
+        self.written = 0
+        self.dropped = 0
+        self.sampled_out = 0
+        self.drop_lock = threading.Lock()   # only taken when a line is dropped
+        self.write_lock = threading.Lock()
+        self.fd = None
+        self.rotate_at = 0.0
+        self.thread = None
+
+    def start(self):
+        """Start the writer thread (after fork, in every process that logs)."""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="access-log", daemon=True)
+            self.thread.start()
+            atexit.register(self.flush)
+
+    def log(self, client, method, path, status, sent=0, latency=None):
+        """Queue one line. status is the status text ("200 OK (cached)")."""
+        if self.sample < 1.0 and status[:1] in "123" and random.random() >= self.sample:
+            self.sampled_out += 1
+            return
+        if len(self.pending) >= self.capacity:
+            with self.drop_lock:
+                self.dropped += 1
+            return
+        self.pending.append((time.time(), client, method, path, status, sent, latency, os.getpid()))
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"[access-log] write failed: {e}", file=sys.stderr, flush=True)
+
+    def flush(self):
+        with self.write_lock:
+            records = []
+            while self.pending:
+                records.append(self.pending.popleft())
+            if not records:
+                return
+            data = "".join(map(self._format, records)).encode("utf-8", "replace")
+            if self.path is None:
+                sys.stdout.buffer.write(data)
+                sys.stdout.flush()
+            else:
+                self._write_file(data)
+            self.written += len(records)
+
+    def _format(self, rec):
+        ts, client, method, path, status, sent, latency, pid = rec
+        if self.fmt == "json":
+            return json.dumps({
+                "ts": datetime.fromtimestamp(ts).isoformat(timespec="milliseconds"),
+                "client": client, "method": method, "path": path,
+                "status": int(status[:3]) if status[:3].isdigit() else 0, "detail": status,
+                "bytes": sent, "latency_ms": round(latency * 1000, 3) if latency is not None else None,
+                "pid": pid,
+            }) + "\n"
+        line = f"[{datetime.fromtimestamp(ts):%H:%M:%S}] {client} {method} {path} {status}"
+        if sent:
+            line += f" {sent}B"
+        if latency is not None:
+            line += f" {latency * 1000:.1f}ms"
+        return line + "\n"
+
+    # --- file output and rotation (writer thread only) ---
+    def _open(self):
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        if self.rotate_seconds:
+            self.rotate_at = time.time() + self.rotate_seconds
+
+    def _write_file(self, data):
+        if self.fd is not None and self._rotated_elsewhere():
+            os.close(self.fd)
+            self.fd = None
+        if self.fd is None:
+            self._open()
+        os.write(self.fd, data)
+        size = os.fstat(self.fd).st_size
+        if (self.max_bytes and size >= self.max_bytes) or (self.rotate_seconds and time.time() >= self.rotate_at):
+            self._rotate()
+
+    def _rotated_elsewhere(self):
+        try:
+            return os.stat(self.path).st_ino != os.fstat(self.fd).st_ino
+        except FileNotFoundError:
+            return True
+
+    def _rotate(self):
+        if not self._rotated_elsewhere():
+            for i in range(self.keep - 1, 0, -1):
+                if os.path.exists(f"{self.path}.{i}"):
+                    os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        os.close(self.fd)
+        self._open()
+
+    def describe(self):
+        return (f"written={self.written} queued={len(self.pending)} dropped={self.dropped} "
+                f"sampled_out={self.sampled_out}")
+
+
+class MeteredSocket:
+    """Socket wrapper counting the bytes sent through it, for the access log.
+    Reset `sent` before each response; `status` is then taken from its status line."""
+    def __init__(self, sock):
+        self.sock = sock
+        self.sent = 0
+        self.status = "-"
+
+    def sendall(self, data):
+        if self.sent == 0 and data[:5] == b"HTTP/":
+            self.status = bytes(data[9:data.find(b"\r\n")]).decode("latin-1")
+        self.sock.sendall(data)
+        self.sent += len(data)
+
+    def sendmsg(self, buffers, *args):
+        line = bytes(buffers[0][:128]) if self.sent == 0 else b""
+        if line[:5] == b"HTTP/":
+            self.status = line[9:line.find(b"\r\n")].decode("latin-1")
+        n = self.sock.sendmsg(buffers, *args)
+        self.sent += n
+        return n
+
+    def sendfile(self, file, offset=0, count=None):
+        n = self.sock.sendfile(file, offset, count)
+        self.sent += n
+        return n
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.sock.close()
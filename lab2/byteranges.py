@@ -0,0 +1,109 @@
+# byteranges.py
+# Range requests (RFC 9110 section 14): "Range: bytes=0-499,1000-,-200" asks
+# for parts of a file, answered with 206 Partial Content. One range is sent as
+# is with a Content-Range header; several become a multipart/byteranges body
+# whose parts are still streamed straight from the file. If-Range makes the
+# range conditional: when the client's validator is stale the whole file is
+# sent instead, so a resumed download never mixes two versions.
+#
+# Anything we do not understand (other units, bad syntax, too many ranges)
+# is ignored and the full 200 is sent, which the RFC allows.
+import email.utils, secrets
+
+MAX_RANGES = 32     # more (after merging) looks like abuse; send the file once instead
+
+
+def parse_range(value, size):
+    """
+    Byte ranges of a Range header as sorted, merged (start, end) pairs with
+    end exclusive. None means "ignore the header", [] means nothing in it is
+    satisfiable (416).
+    """
+    unit, sep, specs = value.partition("=")
+    if not sep or unit.strip().lower() != "bytes":
+        return None
+    ranges = []
+    for spec in specs.split(","):
+        first, dash, last = spec.strip().partition("-")
+        if not dash or not (first or last) or not all(p.isdigit() for p in (first, last) if p):
+            return None
+        if not first:
+            # suffix range: the last N bytes
+            n = int(last)
+            if n and size:
+                ranges.append((max(size - n, 0), size))
+            continue
+        start = int(first)
+        end = min(int(last) + 1, size) if last else size
+        if last and int(last) < start:
+            return None
+        if start < size:
+            ranges.append((start, end))
+
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged if len(merged) <= MAX_RANGES else None
+
+
+def if_range_ok(value, etag, mtime_ns):
+    """If-Range needs an exact (strong) match of the ETag or of Last-Modified."""
+    value = value.strip()
+    if value.startswith(('"', "W/")):
+        return value == etag
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp() == mtime_ns // 10**9
+    except (TypeError, ValueError):
+        return False
+
+
+def requested_ranges(headers, etag, mtime_ns, size):
+    """parse_range() of the request's Range header, honouring If-Range."""
+    value = headers.get("range")
+    if not value:
+        return None
+    cond = headers.get("if-range")
+    if cond is not None and not if_range_ok(cond, etag, mtime_ns):
+        return None
+    return parse_range(value, size)
+
+
+class Partial:
+    """Layout of a 206 body: extra header lines, (prefix, offset, length) parts and a tail."""
+    def __init__(self, ranges, size, ctype):
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            self.ctype = ctype
+            self.headers = [f"Content-Range: bytes {start}-{end - 1}/{size}"]
+            self.parts = [(b"", start, end - start)]
+            self.tail = b""
+        else:
+            boundary = secrets.token_hex(16)
+            self.ctype = f"multipart/byteranges; boundary={boundary}"
+            self.headers = []
+            self.parts = []
+            for start, end in ranges:
+                delimiter = "\r\n" if self.parts else ""
+                prefix = (f"{delimiter}--{boundary}\r\nContent-Type: {ctype}\r\n"
+                          f"Content-Range: bytes {start}-{end - 1}/{size}\r\n\r\n")
+                self.parts.append((prefix.encode(), start, end - start))
+            self.tail = f"\r\n--{boundary}--\r\n".encode()
+        self.length = sum(len(prefix) + n for prefix, _, n in self.parts) + len(self.tail)
+
+    def buffers(self, view):
+        """The 206 body as a list of buffers, slicing a memoryview of the file without copying."""
+        out = []
+        for prefix, off, n in self.parts:
+            if prefix:
+                out.append(prefix)
+            out.append(view[off:off + n])
+        if self.tail:
+            out.append(self.tail)
+        return out
+
+
+def unsatisfiable_headers(size):
+    return [f"Content-Range: bytes */{size}"]
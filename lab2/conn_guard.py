@@ -0,0 +1,92 @@
+# conn_guard.py
+# Admission control for connections, checked right after accept() and before
+# a thread, pool slot or coroutine is spent on the client:
+#
+#   max_connections   connections open in this process (0: no cap)
+#   max_per_ip        connections open from one client address (0: no cap)
+#   strikes           a client whose connections end badly this many times
+#                     within ban_seconds (too slow to send a request or to
+#                     read a response, or garbage instead of HTTP) is refused
+#                     without a word for the next ban_seconds (0: never)
+#
+# admit() returns None or why the connection is refused; every admitted
+# connection must be release()d exactly once, with how it ended (what
+# serve_connection returned). With --workers every process keeps its own
+# counts, so the caps apply per worker.
+import threading, time
+
+OFFENCES = frozenset({"bad_request", "header_timeout", "read_timeout", "write_timeout"})
+
+
+class ConnectionGuard:
+    def __init__(self, max_connections=0, max_per_ip=0, strikes=5, ban_seconds=60.0):
+        self.max_connections = max_connections
+        self.max_per_ip = max_per_ip
+        self.max_strikes = strikes
+        self.ban_seconds = ban_seconds
+        self.lock = threading.Lock()
+        self.open = 0
+        self.per_ip = {}            # ip -> connections open
+        self.strikes = {}           # ip -> (offences, end of the window they count in)
+        self.banned = {}            # ip -> end of the ban
+        self.next_sweep = 0.0
+
+    def admit(self, ip):
+        """None if the connection may be served (and is now counted), else the reason."""
+        with self.lock:
+            if self.banned:
+                until = self.banned.get(ip)
+                if until is not None:
+                    if time.monotonic() < until:
+                        return "banned"
+                    del self.banned[ip]
+            if self.max_connections and self.open >= self.max_connections:
+                return "server_full"
+            n = self.per_ip.get(ip, 0)
+            if self.max_per_ip and n >= self.max_per_ip:
+                return "per_ip_limit"
+            self.per_ip[ip] = n + 1
+            self.open += 1
+        return None
+
+    def release(self, ip, ended=None):
+        """Forget an admitted connection. True if the way it ended got the client banned."""
+        with self.lock:
+            self.open -= 1
+            n = self.per_ip[ip] - 1
+            if n:
+                self.per_ip[ip] = n
+            else:
+                del self.per_ip[ip]
+            if ended not in OFFENCES or not self.max_strikes:
+                return False
+            now = time.monotonic()
+            if now >= self.next_sweep:
+                self._sweep(now)
+            if self.banned.get(ip, 0.0) > now:
+                return False    # connections it already had open when banned
+            count, until = self.strikes.get(ip, (0, 0.0))
+            if now >= until:
+                count, until = 0, now + self.ban_seconds
+            count += 1
+            if count < self.max_strikes:
+                self.strikes[ip] = (count, until)
+                return False
+            self.strikes.pop(ip, None)
+            self.banned[ip] = now + self.ban_seconds
+            return True
+
+    def _sweep(self, now):
+        # expired strikes and bans of clients that never came back
+        self.strikes = {ip: s for ip, s in self.strikes.items() if s[1] > now}
+        self.banned = {ip: t for ip, t in self.banned.items() if t > now}
+        self.next_sweep = now + self.ban_seconds
+
+    def banned_count(self):
+        now = time.monotonic()
+        with self.lock:
+            return sum(1 for t in self.banned.values() if t > now)
+
+    def describe(self):
+        return (f"open={self.open} clients={len(self.per_ip)} "
+                f"banned={self.banned_count()} on_probation={len(self.strikes)}")
@@ -0,0 +1,180 @@
+# connection.py
+# Persistent (keep-alive) connection loops shared by the servers. They read
+# whatever arrives, run it through the incremental parser and answer every
+# complete request in order, which also covers pipelined requests.
+#
+# A client only gets as much patience as it needs to be served:
+#   idle_timeout    between requests on a kept-alive connection
+#   header_timeout  for a whole request to arrive once it has started, so
+#                   trickling a header byte by byte (slowloris) does not help
+#   read_timeout    for the next bytes of a request that has started
+#   write_timeout   for a client that stopped reading our response
+# Servers that handle one connection at a time pass their listening socket as
+# yield_to: a kept-alive client idle after a response is then let go as soon
+# as another connection is waiting, instead of holding everyone up for
+# idle_timeout. A connection that has not sent its first request yet is
+# waited for as usual.
+import asyncio, select, socket, time
+
+from httpparse import BadRequest, RequestParser
+
+RECV_SIZE = 65536
+IDLE_TIMEOUT = 5.0      # seconds a kept-alive connection may sit without a request
+HEADER_TIMEOUT = 10.0   # seconds for a request to arrive in full
+READ_TIMEOUT = 5.0      # seconds a request may stall halfway
+WRITE_TIMEOUT = 30.0    # seconds a send may wait on a client that does not read
+MAX_REQUESTS = 100      # requests served on one connection before we close it
+
+# how serve_connection ended, for the caller (the ones after "done" are the client's fault)
+ENDINGS = ("closed", "idle", "done", "bad_request", "header_timeout", "read_timeout", "write_timeout")
+
+
+def keep_alive_headers(idle_timeout=IDLE_TIMEOUT, max_requests=MAX_REQUESTS):
+    return ("Connection: keep-alive", f"Keep-Alive: timeout={int(idle_timeout)}, max={max_requests}")
+
+
+def no_delay(sock):
+    # responses leave in as few writes as can be gathered (head + body,
+    # STREAM_BUFFER pieces of a listing); one that still needs several must not
+    # have its last write held back by Nagle until the client's delayed ACK (~40 ms)
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except OSError:
+        pass                # not TCP
+
+
+def buffered(conn):
+    """Whether a TLS socket holds decrypted bytes that select() cannot see."""
+    pending = getattr(conn, "pending", None)
+    return bool(pending and pending())
+
+
+def stamp_parse_time(requests, started):
+    """Share the time one feed() took among the requests it completed."""
+    if requests:
+        each = (time.perf_counter() - started) / len(requests)
+        for req in requests:
+            req.parse_time = each
+
+
+def next_read(parser, deadline, idle_timeout, read_timeout):
+    """(seconds the next read may wait, how the connection ends if nothing arrives)."""
+    if not parser.pending():
+        return idle_timeout, "idle"
+    left = deadline - time.monotonic()
+    if left < read_timeout:
+        return left, "header_timeout"
+    return read_timeout, "read_timeout"
+
+
+def request_deadline(parser, deadline, completed, header_timeout):
+    """When the request now being received must be complete (None: none started)."""
+    if not parser.pending():
+        return None
+    if deadline is None or completed:
+        return time.monotonic() + header_timeout
+    return deadline
+
+
+def serve_connection(conn, handle, bad_request,
+                     idle_timeout=IDLE_TIMEOUT, max_requests=MAX_REQUESTS,
+                     header_timeout=HEADER_TIMEOUT, read_timeout=READ_TIMEOUT,
+                     write_timeout=WRITE_TIMEOUT, yield_to=None):
+    """
+    Blocking-socket loop. handle(request, keep_alive) sends one response and
+    may return False to close the connection anyway (e.g. after an error);
+    bad_request(error) answers a request that failed to parse.
+    Returns how it ended (one of ENDINGS): the client closed, stayed idle,
+    was done (Connection: close, max_requests), sent garbage, or was too
+    slow sending a request or reading a response. With yield_to (a listening
+    socket), waiting for the next request after one was served ends as
+    "idle" once a new connection is pending there.
+    """
+    no_delay(conn)
+    parser = RequestParser()
+    served = 0
+    deadline = None
+    while True:
+        wait, ending = next_read(parser, deadline, idle_timeout, read_timeout)
+        if wait <= 0:
+            return ending
+        # only between requests: a new connection's first request may still be on its way
+        if yield_to is not None and served and ending == "idle" and not buffered(conn):
+            ready, _, _ = select.select([conn, yield_to], [], [], wait)
+            if conn not in ready:
+                return "idle"       # timed out, or someone else is waiting
+        conn.settimeout(wait)
+        try:
+            data = conn.recv(RECV_SIZE)
+        except socket.timeout:
+            return ending
+        except ConnectionError:
+            return "closed"
+        if not data:
+            return "closed"
+        # responses may take longer than the read timeouts to send, but must make progress
+        conn.settimeout(write_timeout)
+        started = time.perf_counter()
+        try:
+            try:
+                requests = parser.feed(data)
+            except BadRequest as e:
+                bad_request(e)
+                return "bad_request"
+            stamp_parse_time(requests, started)
+            for req in requests:
+                served += 1
+                keep = req.keep_alive() and served < max_requests
+                if handle(req, keep) is False or not keep:
+                    return "done"
+        except socket.timeout:
+            return "write_timeout"
+        deadline = request_deadline(parser, deadline, requests, header_timeout)
+
+
+async def serve_connection_async(reader, writer, handle, bad_request,
+                                 idle_timeout=IDLE_TIMEOUT, max_requests=MAX_REQUESTS,
+                                 header_timeout=HEADER_TIMEOUT, read_timeout=READ_TIMEOUT,
+                                 write_timeout=WRITE_TIMEOUT):
+    """
+    asyncio version of serve_connection; handle is a coroutine function.
+    Its writes are bounded by filesend.write_timeout, which raises
+    asyncio.TimeoutError here.
+    """
+    sock = writer.get_extra_info("socket")
+    if sock is not None:
+        # asyncio only does this for sockets created with proto=IPPROTO_TCP,
+        # and prefork's listener is not one
+        no_delay(sock)
+    parser = RequestParser()
+    served = 0
+    deadline = None
+    while True:
+        wait, ending = next_read(parser, deadline, idle_timeout, read_timeout)
+        if wait <= 0:
+            return ending
+        try:
+            data = await asyncio.wait_for(reader.read(RECV_SIZE), wait)
+        except asyncio.TimeoutError:
+            return ending
+        except ConnectionError:
+            return "closed"
+        if not data:
+            return "closed"
+        started = time.perf_counter()
+        try:
+            try:
+                requests = parser.feed(data)
+            except BadRequest as e:
+                bad_request(e)
+                await asyncio.wait_for(writer.drain(), write_timeout)
+                return "bad_request"
+            stamp_parse_time(requests, started)
+            for req in requests:
+                served += 1
+                keep = req.keep_alive() and served < max_requests
+                if await handle(req, keep) is False or not keep:
+                    return "done"
+        except asyncio.TimeoutError:
+            return "write_timeout"
+        deadline = request_deadline(parser, deadline, requests, header_timeout)
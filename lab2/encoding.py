@@ -0,0 +1,139 @@
+# encoding.py
+# Content-Encoding negotiation for static files. For a compressible type the
+# client's Accept-Encoding picks a coding (br preferred over gzip), then:
+#   1. a precompressed sibling (kernel.html.br / kernel.html.gz) that is at
+#      least as new as the file is served as is, streamed like any file;
+#   2. otherwise the file is compressed on the fly, once: the result is kept
+#      in a bounded LRU (a FileCache) keyed by path, ETag and coding.
+# Encoded variants get their own ETag ("...-gzip") and every response for a
+# compressible type says "Vary: Accept-Encoding", so shared caches keep the
+# variants apart. Formats that are already compressed (PNG, JPEG, PDF, ...)
+# are never touched. brotli is optional: without the module, .br siblings
+# are still served, only on-the-fly brotli is skipped.
+#
+# A sibling asked for by name (GET /kernel.html.gz) is just a file: it goes
+# out as application/gzip with no Content-Encoding, see content_type().
+import gzip, mimetypes, os
+
+from file_cache import CacheEntry, FileCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+PREFERENCE = ("br", "gzip")
+SUFFIXES = {"br": ".br", "gzip": ".gz"}
+COMPRESSIBLE = {"application/javascript", "application/json", "application/xml", "image/svg+xml"}
+# what a file with a compression suffix is, as a file of its own
+ENCODED_TYPES = {"gzip": "application/gzip", "br": "application/x-brotli", "bzip2": "application/x-bzip2",
+                 "xz": "application/x-xz", "compress": "application/x-compress"}
+
+
+def content_type(name, default="application/octet-stream"):
+    """
+    Content-Type for a file name. mimetypes reads kernel.html.gz as text/html
+    with encoding gzip; sent as text/html without Content-Encoding, a browser
+    would show the compressed bytes as a page.
+    """
+    ctype, coding = mimetypes.guess_type(name)
+    if coding:
+        return ENCODED_TYPES.get(coding, "application/octet-stream")
+    return ctype or default
+
+
+def compressible(ctype):
+    return ctype.startswith("text/") or ctype in COMPRESSIBLE
+
+
+def accepted(value):
+    """Codings from PREFERENCE the Accept-Encoding header allows (q > 0), best first."""
+    weights = {}
+    for item in value.split(","):
+        name, _, params = item.partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, v = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(v)
+                except ValueError:
+                    q = 0.0
+        weights[name.strip().lower()] = q
+    star = weights.get("*", 0.0)
+    # "x-gzip" is an old alias browsers may still send
+    if "gzip" not in weights and "x-gzip" in weights:
+        weights["gzip"] = weights["x-gzip"]
+    return [c for c in PREFERENCE if weights.get(c, star) > 0]
+
+
+def variant_tag(etag, coding):
+    return f'{etag[:-1]}-{coding}"'
+
+
+class Encoder:
+    def __init__(self, header_block, cache_bytes=16 * 2**20, max_compress_bytes=8 * 2**20, level=6):
+        self.header_block = header_block        # the server's (length, ctype, extra_headers) -> bytes
+        self.cache = FileCache(cache_bytes, max_entry_bytes=cache_bytes // 4)
+        self.max_compress_bytes = max_compress_bytes  # bigger files go out uncompressed
+        self.level = level
+        self.compressed = 0                     # files compressed on the fly
+        self.siblings = 0                       # precompressed files picked up
+
+    def negotiate(self, entry, accept):
+        """Encoded variant (a CacheEntry) of a file entry for this Accept-Encoding, or None."""
+        if not accept or not compressible(entry.ctype):
+            return None
+        for coding in accepted(accept):
+            key = f"{entry.path}\0{entry.etag}\0{coding}"
+            variant = self.cache.get(key)
+            if variant is None:
+                variant = self._sibling(entry, coding) or self._compress(entry, coding)
+                if variant is None:
+                    continue
+                self.cache.put(key, variant)
+            return variant
+        return None
+
+    def _variant(self, entry, coding, path, st, body):
+        etag = variant_tag(entry.etag, coding)
+        validators = entry.validators.replace(entry.etag.encode(), etag.encode())
+        length = len(body) if body is not None else st.st_size
+        headers = self.header_block(length, entry.ctype, [f"Content-Encoding: {coding}"]) + validators
+        variant = CacheEntry(path, st, entry.ctype, headers, body, validators)
+        variant.etag = etag
+        variant.coding = coding
+        return variant
+
+    def _sibling(self, entry, coding):
+        path = entry.path + SUFFIXES[coding]
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if st.st_mtime_ns < entry.mtime_ns:
+            return None             # left over from an older version of the file
+        body = None
+        if self.cache.keep_body(st.st_size):
+            with open(path, "rb") as f:
+                body = f.read()
+        self.siblings += 1
+        return self._variant(entry, coding, path, st, body)
+
+    def _compress(self, entry, coding):
+        if entry.size > self.max_compress_bytes or (coding == "br" and brotli is None):
+            return None
+        with open(entry.path, "rb") as f:
+            st = os.fstat(f.fileno())
+            if st.st_mtime_ns != entry.mtime_ns or st.st_size != entry.size:
+                return None     # changed since the entry was made; the next request retries
+            data = entry.body if entry.body is not None else f.read()
+        if coding == "br":
+            body = brotli.compress(data, quality=min(self.level, 11))
+        else:
+            body = gzip.compress(data, self.level, mtime=0)
+        self.compressed += 1
+        return self._variant(entry, coding, entry.path, st, body)
+
+    def describe(self):
+        return f"siblings={self.siblings} compressed={self.compressed} {self.cache.describe()}"
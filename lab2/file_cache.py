@@ -0,0 +1,109 @@
+# file_cache.py
+# Hot-file cache shared by all threads of a server. An entry remembers what a
+# request for a path resolved to: the real file, its content type, the static
+# part of the response headers and, for small files, the body itself. A hit
+# costs one os.stat() (to notice edits through mtime/size) instead of
+# resolve() + is_dir() + is_file() + guess_type() + open() + read().
+import os, threading
+from collections import OrderedDict
+
+from validators import entity_tag
+
+
+class CacheEntry:
+    __slots__ = ("path", "ino", "mtime_ns", "size", "ctype", "etag", "headers", "validators", "body", "coding")
+
+    def __init__(self, path, st, ctype, headers, body=None, validators=b""):
+        self.path = path            # resolved file path (str)
+        self.ino = st.st_ino
+        self.mtime_ns = st.st_mtime_ns
+        self.size = st.st_size
+        self.ctype = ctype
+        self.etag = entity_tag(st.st_size, st.st_mtime_ns)
+        self.headers = headers      # prebuilt header lines (bytes, CRLF-terminated)
+        self.validators = validators    # the subset of headers repeated in a 304
+        self.body = body            # file contents, or None if too big to keep
+        self.coding = None          # Content-Encoding of body/path ("gzip", "br") if not identity
+
+    def cost(self):
+        return (len(self.headers) + len(self.validators)
+                + (len(self.body) if self.body is not None else 0) + 256)
+
+
+class FileCache:
+    def __init__(self, max_bytes=64 * 2**20, max_entry_bytes=2**20):
+        self.max_bytes = max_bytes              # budget for all entries together
+        self.max_entry_bytes = max_entry_bytes  # bigger files keep metadata only
+        self.entries = OrderedDict()            # key -> CacheEntry, least recently used first
+        self.lock = threading.Lock()
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Entry for key if it is still valid (same mtime and size on disk), else None."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+        try:
+            st = os.stat(entry.path)
+            fresh = st.st_mtime_ns == entry.mtime_ns and st.st_size == entry.size
+        except OSError:
+            fresh = False
+        with self.lock:
+            if not fresh:
+                self.misses += 1
+                self.invalidations += 1
+                self._remove(key, entry)
+                return None
+            self.hits += 1
+            if key in self.entries:
+                self.entries.move_to_end(key)
+            return entry
+
+    def keep_body(self, size):
+        return size <= self.max_entry_bytes
+
+    def put(self, key, entry):
+        cost = entry.cost()
+        if cost > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.used -= old.cost()
+            self.entries[key] = entry
+            self.used += cost
+            while self.used > self.max_bytes:
+                _, victim = self.entries.popitem(last=False)
+                self.used -= victim.cost()
+                self.evictions += 1
+
+    def _remove(self, key, entry):
+        if self.entries.get(key) is entry:
+            del self.entries[key]
+            self.used -= entry.cost()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.used,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def describe(self):
+        st = self.stats()
+        return (f"entries={st['entries']} {st['bytes'] / 2**20:.1f}/{st['max_bytes'] / 2**20:.0f}MiB "
+                f"hit_ratio={st['hit_ratio']:.2%} hits={st['hits']} misses={st['misses']} "
+                f"evictions={st['evictions']} invalidations={st['invalidations']}")
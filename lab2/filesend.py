@@ -0,0 +1,258 @@
+# filesend.py
+# Streaming file bodies: headers go out first, then the file is copied to the
+# socket by the kernel (os.sendfile via socket.sendfile), or, when that is not
+# possible, through one fixed-size buffer. Memory per download stays constant
+# no matter how big the file is. A response may stream several regions of the
+# file, each preceded by a few bytes of its own (multipart/byteranges).
+# A list of buffers (head + cached body, or head + a memoryview of a mapped
+# file) goes out as one gathered sendmsg(), without being joined first. A
+# StreamResponse is a body generated while it is sent, framed with
+# Transfer-Encoding: chunked; its head and chunks are gathered up to
+# STREAM_BUFFER per send, so a small page (head, chunks and terminator) is
+# one write instead of several small ones stalled by Nagle and delayed ACKs.
+#
+# Blocking sockets bound a stalled client with their own timeout (set by the
+# connection loop). On asyncio streams every drain, and every CHUNK_SIZE piece
+# handed to loop.sendfile, is bounded by write_timeout instead; a client that
+# stops reading gets asyncio.TimeoutError.
+import asyncio, os
+
+CHUNK_SIZE = 256 * 1024
+STREAM_BUFFER = 16 * 1024   # StreamResponse bytes gathered before a send
+zero_copy = True        # servers switch this off with --no-sendfile (benchmarks)
+write_timeout = None    # asyncio only: seconds a send may wait on the client (servers: --write-timeout)
+
+
+class FileResponse:
+    """Response headers plus regions of an open file to stream after them."""
+    __slots__ = ("head", "file", "parts", "tail")
+
+    def __init__(self, head, file, offset=0, length=None, parts=None, tail=b""):
+        self.head = head
+        self.file = file
+        if parts is None:
+            if length is None:
+                length = os.fstat(file.fileno()).st_size - offset
+            parts = [(b"", offset, length)]
+        self.parts = parts          # (bytes sent before the region, offset, length)
+        self.tail = tail            # bytes sent after the last region
+
+    def close(self):
+        self.file.close()
+
+
+class StreamResponse:
+    """
+    Response headers plus an iterable of body pieces, produced while sending.
+    With chunked=True (HTTP/1.1) every piece is sent as one chunk and the
+    head must say Transfer-Encoding: chunked; otherwise (HTTP/1.0) the body
+    is sent as is and ends when the connection closes.
+    """
+    __slots__ = ("head", "body", "chunked")
+
+    def __init__(self, head, body, chunked=True):
+        self.head = head
+        self.body = body
+        self.chunked = chunked
+
+    def frame(self, piece):
+        return b"%x\r\n%s\r\n" % (len(piece), piece) if self.chunked else piece
+
+    def end(self):
+        return b"0\r\n\r\n" if self.chunked else b""
+
+    def close(self):
+        if hasattr(self.body, "close"):
+            self.body.close()       # a generator abandoned halfway runs its finally blocks
+
+
+def send_chunks(sock, f, offset, count, chunk_size=CHUNK_SIZE):
+    """Fallback copy loop reusing a single buffer. Returns bytes sent."""
+    buf = memoryview(bytearray(min(chunk_size, max(count, 1))))
+    f.seek(offset)
+    sent = 0
+    while sent < count:
+        n = f.readinto(buf[:min(len(buf), count - sent)])
+        if not n:
+            break           # file shrank under us; the client sees a short body
+        sock.sendall(buf[:n])
+        sent += n
+    return sent
+
+
+def send_file(sock, f, offset=0, count=None):
+    if count is None:
+        count = os.fstat(f.fileno()).st_size - offset
+    if count <= 0:
+        return 0
+    if zero_copy:
+        # socket.sendfile drops to plain send() by itself where os.sendfile
+        # cannot be used (TLS sockets, non-regular files)
+        return sock.sendfile(f, offset, count)
+    return send_chunks(sock, f, offset, count)
+
+
+def send_buffers(sock, buffers):
+    """sendall() for a list of buffers, gathered by sendmsg() instead of concatenated."""
+    total = sum(map(len, buffers))
+    try:
+        n = sock.sendmsg(buffers)
+    except NotImplementedError:
+        # TLS sockets have no sendmsg(): a small response as one record, a big one buffer by buffer
+        if total <= CHUNK_SIZE:
+            sock.sendall(b"".join(buffers))
+        else:
+            for buf in buffers:
+                sock.sendall(buf)
+        return total
+    if n == total:
+        return total        # the usual case: the socket buffer took all of it
+    views = [memoryview(b) for b in buffers]
+    while True:
+        # drop what was sent, then send the rest
+        while n:
+            if n < len(views[0]):
+                views[0] = views[0][n:]
+                break
+            n -= len(views.pop(0))
+        if not views:
+            return total
+        n = sock.sendmsg(views)
+
+
+def write_response(sock, data):
+    """Send bytes, a list of buffers, or a FileResponse's headers followed by its file region."""
+    if isinstance(data, list):
+        return send_buffers(sock, data)
+    if isinstance(data, StreamResponse):
+        return send_stream(sock, data)
+    if not isinstance(data, FileResponse):
+        sock.sendall(data)
+        return len(data)
+    try:
+        sock.sendall(data.head)
+        sent = len(data.head)
+        for prefix, offset, length in data.parts:
+            if prefix:
+                sock.sendall(prefix)
+            sent += len(prefix) + send_file(sock, data.file, offset, length)
+        if data.tail:
+            sock.sendall(data.tail)
+        return sent + len(data.tail)
+    finally:
+        data.close()
+
+
+async def drain(writer):
+    await asyncio.wait_for(writer.drain(), write_timeout)
+
+
+def send_stream(sock, data):
+    try:
+        pending, size, sent = [data.head], len(data.head), 0
+        for piece in data.body:
+            if piece:
+                framed = data.frame(piece)
+                pending.append(framed)
+                size += len(framed)
+                if size >= STREAM_BUFFER:
+                    sent += send_buffers(sock, pending)
+                    pending, size = [], 0
+        # the last chunk and the terminator leave together
+        pending.append(data.end())
+        return sent + send_buffers(sock, pending)
+    finally:
+        data.close()
+
+
+async def send_chunks_async(writer, f, offset, count, chunk_size=CHUNK_SIZE):
+    loop = asyncio.get_running_loop()
+    buf = memoryview(bytearray(min(chunk_size, max(count, 1))))
+    f.seek(offset)
+    sent = 0
+    while sent < count:
+        n = await loop.run_in_executor(None, f.readinto, buf[:min(len(buf), count - sent)])
+        if not n:
+            break
+        writer.write(buf[:n])     # the transport copies whatever it cannot send right away
+        await drain(writer)
+        sent += n
+    return sent
+
+
+async def send_file_async(writer, f, offset, count):
+    if count <= 0:
+        return 0
+    if zero_copy:
+        # os.sendfile when the transport allows it, otherwise asyncio reads chunks itself
+        loop = asyncio.get_running_loop()
+        if write_timeout is None:
+            return await loop.sendfile(writer.transport, f, offset, count)
+        # piecewise, so the timeout bounds a stall rather than the whole download
+        sent = 0
+        while sent < count:
+            n = await asyncio.wait_for(
+                loop.sendfile(writer.transport, f, offset + sent, min(CHUNK_SIZE, count - sent)),
+                write_timeout)
+            if not n:
+                break
+            sent += n
+        return sent
+    return await send_chunks_async(writer, f, offset, count)
+
+
+async def write_response_async(writer, data):
+    if isinstance(data, StreamResponse):
+        return await send_stream_async(writer, data)
+    if isinstance(data, list):
+        total = sum(map(len, data))
+        if total <= CHUNK_SIZE:
+            # one send for head + body (writelines() gathers them with sendmsg on
+            # Python 3.12+, joins them before that: cheap at this size)
+            writer.writelines(data)
+        else:
+            # a big mapped body is not joined; the transport copies only what the kernel does not take
+            for buf in data:
+                writer.write(buf)
+        await drain(writer)
+        return total
+    if not isinstance(data, FileResponse):
+        writer.write(data)
+        await drain(writer)
+        return len(data)
+    try:
+        writer.write(data.head)
+        sent = len(data.head)
+        for prefix, offset, length in data.parts:
+            writer.write(prefix)
+            await drain(writer)
+            sent += len(prefix) + await send_file_async(writer, data.file, offset, length)
+        writer.write(data.tail)
+        await drain(writer)
+        return sent + len(data.tail)
+    finally:
+        data.close()
+
+
+async def send_stream_async(writer, data):
+    # the body may do blocking work (scandir, lock round-trips), so it advances in a thread
+    loop = asyncio.get_running_loop()
+    try:
+        pending, size, sent = [data.head], len(data.head), 0
+        pieces = iter(data.body)
+        while (piece := await loop.run_in_executor(None, next, pieces, None)) is not None:
+            if piece:
+                framed = data.frame(piece)
+                pending.append(framed)
+                size += len(framed)
+                if size >= STREAM_BUFFER:
+                    writer.writelines(pending)
+                    await drain(writer)
+                    sent += size
+                    pending, size = [], 0
+        pending.append(data.end())
+        writer.writelines(pending)
+        await drain(writer)
+        return sent + size + len(data.end())
+    finally:
+        data.close()
@@ -0,0 +1,61 @@
+# headers.py
+# Response heads assembled from prebuilt bytes instead of formatted per request.
+# A head is four pieces joined once:
+#   status line   "HTTP/1.1 404 Not Found\r\n", built the first time a status is used
+#   Date          formatted at most once a second and shared by every thread
+#   block         the body's own headers (Content-Type, Content-Length, validators),
+#                 which the file cache already keeps prebuilt next to the body
+#   connection    "Connection: close" or the keep-alive pair, built once per server
+# The body is not appended: callers hand [head, body] to filesend.write_response,
+# which gathers both into one sendmsg(), so a response is one send and one TCP
+# segment where it fits, with no copy of the body to glue the head on.
+import time
+from http import HTTPStatus
+
+from connection import keep_alive_headers
+
+# RFC 9110 names; HTTPStatus still has the RFC 7233 one on older Pythons
+REASONS = {status.value: status.phrase for status in HTTPStatus}
+REASONS[416] = "Range Not Satisfiable"
+
+_status_lines = {}
+
+
+def status_line(status):
+    """b"HTTP/1.1 <status>\\r\\n" for a code (404) or a code with its reason ("404 Not Found")."""
+    line = _status_lines.get(status)
+    if line is None:
+        if isinstance(status, int):
+            status = f"{status} {REASONS.get(status, 'Unknown')}"
+        line = _status_lines[status] = f"HTTP/1.1 {status}\r\n".encode()
+    return line
+
+
+class DateHeader:
+    """b"Date: ...\\r\\n" for the current second, reformatted only when the second changes."""
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.cached = (None, b"")       # (second, line), replaced as a whole so threads never see half of it
+
+    def __call__(self):
+        now = int(self.clock())
+        second, line = self.cached
+        if second != now:
+            line = time.strftime("Date: %a, %d %b %Y %H:%M:%S GMT\r\n", time.gmtime(now)).encode()
+            self.cached = (now, line)
+        return line
+
+
+date_header = DateHeader()
+
+
+class HeadBuilder:
+    def __init__(self, idle_timeout, max_requests, date=date_header):
+        self.date = date
+        self.keep = "".join(f"{h}\r\n" for h in keep_alive_headers(idle_timeout, max_requests)).encode() + b"\r\n"
+        self.close = b"Connection: close\r\n\r\n"
+
+    def head(self, status, block=b"", keep_alive=False):
+        """Status line + Date + block + connection headers + the blank line."""
+        return b"".join((status_line(status), self.date(), block, self.keep if keep_alive else self.close))
@@ -0,0 +1,161 @@
+# hit_counter.py
+# Hit counters for the threaded server.
+#
+# LockedCounter is the original design: one dict behind one lock, so every
+# request and every listing row queue up on the same lock.
+# ShardedCounter gives every thread its own dict. Increments touch only the
+# calling thread's shard and take no lock; reads add up all shards. Shards of
+# threads that have exited are folded into a base dict whenever a new shard
+# takes the list past twice the live ones, so thread-per-connection servers
+# keep about as many shards as they have threads.
+#
+# HitLog persists counts as an append-only file of "delta<TAB>path" lines.
+# Replaying it at startup (and compacting it to one line per path) restores
+# the counts after a restart.
+import os, threading, time, weakref
+from collections import defaultdict
+
+
+class LockedCounter:
+    def __init__(self):
+        self.counts = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def incr(self, key, n=1):
+        with self.lock:
+            self.counts[key] += n
+
+    def get_many(self, keys):
+        with self.lock:
+            return [self.counts.get(k, 0) for k in keys]
+
+    def get(self, key):
+        return self.get_many([key])[0]
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counts)
+
+    def seed(self, counts):
+        with self.lock:
+            for key, n in counts.items():
+                self.counts[key] += n
+
+
+class ShardedCounter:
+    FOLD_AT = 64                    # shards before dead ones are first folded
+
+    def __init__(self):
+        self.base = {}              # folded counts of finished threads
+        self.shards = []            # (weakref to thread, dict) for live threads
+        self.lock = threading.Lock()    # guards base/shards membership, not increments
+        self.local = threading.local()
+        self.fold_at = self.FOLD_AT
+
+    def _shard(self):
+        shard = {}
+        with self.lock:
+            self.shards.append((weakref.ref(threading.current_thread()), shard))
+            if len(self.shards) > self.fold_at:
+                self._fold_dead()
+        self.local.shard = shard
+        return shard
+
+    def incr(self, key, n=1):
+        # only this thread ever writes its shard, so no lock is needed
+        try:
+            shard = self.local.shard
+        except AttributeError:
+            shard = self._shard()
+        shard[key] = shard.get(key, 0) + n
+
+    def _fold_dead(self):
+        # caller holds self.lock
+        alive = []
+        for ref, shard in self.shards:
+            t = ref()
+            if t is not None and t.is_alive():
+                alive.append((ref, shard))
+                continue
+            for key, n in shard.copy().items():
+                self.base[key] = self.base.get(key, 0) + n
+        self.shards = alive
+        # next fold once as many new shards have come: amortized O(1) per thread
+        self.fold_at = max(self.FOLD_AT, 2 * len(alive))
+
+    def get_many(self, keys):
+        with self.lock:
+            dicts = [self.base] + [shard for _, shard in self.shards]
+        return [sum(d.get(k, 0) for d in dicts) for k in keys]
+
+    def get(self, key):
+        return self.get_many([key])[0]
+
+    def snapshot(self):
+        with self.lock:
+            self._fold_dead()
+            total = dict(self.base)
+            shards = [shard.copy() for _, shard in self.shards]
+        for shard in shards:
+            for key, n in shard.items():
+                total[key] = total.get(key, 0) + n
+        return total
+
+    def seed(self, counts):
+        with self.lock:
+            for key, n in counts.items():
+                self.base[key] = self.base.get(key, 0) + n
+
+
+class HitLog:
+    def __init__(self, path):
+        self.path = path
+        self.flushed = {}           # counts already written to the file
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Replay the log, rewrite it compacted and return the counts."""
+        counts = defaultdict(int)
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    delta, sep, key = line.rstrip("\n").partition("\t")
+                    if sep and delta.lstrip("-").isdigit():
+                        counts[key] += int(delta)
+        except FileNotFoundError:
+            pass
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(f"{n}\t{key}\n" for key, n in counts.items() if n)
+        os.replace(tmp, self.path)
+        self.flushed = dict(counts)
+        return dict(counts)
+
+    def flush(self, counter):
+        """Append what changed in counter since the last flush."""
+        with self.lock:
+            current = counter.snapshot()
+            lines = []
+            for key, n in current.items():
+                delta = n - self.flushed.get(key, 0)
+                if delta and "\n" not in key:
+                    lines.append(f"{delta}\t{key}\n")
+            if lines:
+                # a single write() on an O_APPEND fd, so lines from several
+                # worker processes sharing the file never interleave
+                fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, "".join(lines).encode("utf-8"))
+                finally:
+                    os.close(fd)
+            self.flushed = current
+
+    def flush_every(self, counter, interval):
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.flush(counter)
+                except OSError as e:
+                    print(f"[hits] could not write {self.path}: {e}", flush=True)
+        threading.Thread(target=loop, name="hit-log", daemon=True).start()
@@ -0,0 +1,237 @@
+# httpparse.py
+# Incremental HTTP/1.x parser shared by the servers (and by the lab1 client for
+# response heads). Bytes are fed in as they arrive from recv(); complete
+# requests come out in order, so headers split across reads and several
+# pipelined requests in one read are both handled.
+#
+# The hot path allocates little: the receive buffer is consumed by moving an
+# offset and compacted once per feed() instead of once per request, the
+# search for the blank line resumes where the previous read left off, and
+# each request head is copied out exactly once. Only the request line is
+# decoded up front; header lines are checked (names, count) with C-level
+# find/count calls and one regex on the raw bytes, and a value is decoded
+# only when a handler asks for it.
+import re
+
+MAX_HEADER_BYTES = 16384
+MAX_HEADERS = 100
+
+# an LF that is not part of a CRLF, or not followed by "token:", starts a
+# malformed header line (whitespace before the colon, no colon, obsolete
+# line folding, ...)
+BAD_LINE = re.compile(rb"\n(?:(?<!\r\n)|(?![-!#$%&'*+.^_`|~0-9A-Za-z]+:))")
+
+
+class BadMessage(Exception):
+    pass
+
+
+class BadRequest(BadMessage):
+    pass
+
+
+_keys = {}          # header name -> b"\r\nname:" as searched for in the lower-cased head
+
+
+class Headers:
+    """
+    Read-only, case-insensitive view of the header lines of a message head
+    (head[start:], every line preceded by CRLF). Nothing is split or decoded
+    up front: a lookup is a find() on a lower-cased copy of the head, made
+    on the first lookup. Repeated headers are folded into one
+    comma-separated value.
+    """
+    __slots__ = ("head", "start", "lower")
+
+    def __init__(self, head=b"", start=0):
+        self.head = head
+        self.start = start
+        self.lower = None
+
+    def get(self, name, default=None):
+        lower = self.lower
+        if lower is None:
+            lower = self.lower = self.head.lower()
+        key = _keys.get(name)
+        if key is None:
+            key = _keys[name] = b"\r\n" + name.lower().encode("latin-1") + b":"
+        i = lower.find(key, self.start)
+        if i < 0:
+            return default
+        i += len(key)
+        end = lower.find(b"\r\n", i)
+        if end < 0:
+            end = len(lower)
+        value = self.head[i:end].strip().decode("latin-1")
+        i = lower.find(key, end)
+        if i < 0:
+            return value
+        # repeated header: fold every occurrence
+        values = [value]
+        while i >= 0:
+            i += len(key)
+            end = lower.find(b"\r\n", i)
+            if end < 0:
+                end = len(lower)
+            values.append(self.head[i:end].strip().decode("latin-1"))
+            i = lower.find(key, end)
+        return ", ".join(values)
+
+    def __getitem__(self, name):
+        value = self.get(name)
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def items(self):
+        """Every header as (lower-cased name, value), folded like get()."""
+        folded = {}
+        for line in self.head[self.start:].decode("latin-1").split("\r\n")[1:]:
+            name, _, value = line.partition(":")
+            name, value = name.lower(), value.strip()
+            folded[name] = f"{folded[name]}, {value}" if name in folded else value
+        return folded.items()
+
+    def __repr__(self):
+        return f"Headers({dict(self.items())!r})"
+
+
+class Request:
+    __slots__ = ("method", "target", "version", "headers", "parse_time")
+
+    def __init__(self, method, target, version, headers):
+        self.method = method
+        self.target = target        # raw request-target, still percent-encoded
+        self.version = version
+        self.headers = headers      # Headers: lower-cased name -> value
+        self.parse_time = 0.0       # seconds spent parsing it (set by the connection loop)
+
+    def keep_alive(self):
+        """HTTP/1.1 keeps the connection open unless told otherwise; 1.0 must ask."""
+        conn = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.1":
+            return "close" not in conn
+        return "keep-alive" in conn
+
+
+def check_header_lines(head, start, max_headers=MAX_HEADERS, error=BadMessage):
+    """Validate head[start:] as header lines, without splitting or decoding it."""
+    lines = head.count(b"\n", start)
+    if lines > max_headers:
+        raise error("too many header lines")
+    bad = BAD_LINE.search(head, start)
+    if bad:
+        line = head[bad.end():].split(b"\n", 1)[0].rstrip(b"\r")
+        raise error(f"bad header line: {bytes(line)!r}")
+    if head.count(b"\r", start) != lines:
+        raise error("bare CR in the header")
+
+
+def parse_head(head, max_headers=MAX_HEADERS):
+    """Parse a request head: request line + header lines, without the blank line."""
+    line_end = head.find(b"\r\n")
+    if line_end < 0:
+        line_end = len(head)
+    parts = head[:line_end].decode("latin-1").split()
+    if len(parts) == 3:
+        method, target, version = parts
+        if not version.startswith("HTTP/1."):
+            raise BadRequest(f"unsupported version: {version}")
+    elif len(parts) == 2:
+        method, target = parts
+        version = "HTTP/1.0"
+    else:
+        raise BadRequest(f"bad request line: {bytes(head[:line_end])!r}")
+    if line_end < len(head):
+        check_header_lines(head, line_end, max_headers, BadRequest)
+    return Request(method, target, version, Headers(head, line_end))
+
+
+def parse_response_head(head, max_headers=MAX_HEADERS):
+    """(status code, Headers) of a response head (status line + header lines)."""
+    line_end = head.find(b"\r\n")
+    if line_end < 0:
+        line_end = len(head)
+    parts = head[:line_end].split(None, 2)
+    if len(parts) < 2 or not parts[0].startswith(b"HTTP/") or not parts[1].isdigit():
+        raise BadMessage(f"bad status line: {bytes(head[:line_end])!r}")
+    if line_end < len(head):
+        check_header_lines(head, line_end, max_headers)
+    return int(parts[1]), Headers(head, line_end)
+
+
+def body_length(headers):
+    """Length of the request body after the head (we only ever skip it)."""
+    lower = headers.lower
+    if lower is None:
+        lower = headers.lower = headers.head.lower()     # kept for the lookups that follow
+    if b"\r\ncontent-length:" not in lower and b"\r\ntransfer-encoding:" not in lower:
+        return 0        # the usual GET
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        raise BadRequest("chunked request bodies are not supported")
+    length = headers.get("content-length", "0")
+    if not length.isdigit():
+        raise BadRequest(f"bad Content-Length: {length!r}")
+    return int(length)
+
+
+class RequestParser:
+    def __init__(self, max_header_bytes=MAX_HEADER_BYTES, max_headers=MAX_HEADERS):
+        self.buf = bytearray()
+        self.scanned = 0            # buf[:scanned] is known to hold no blank line
+        self.max_header_bytes = max_header_bytes
+        self.max_headers = max_headers
+        self.body_left = 0          # bytes of a request body still to skip
+
+    def pending(self):
+        """True while part of a request (head or skipped body) is buffered."""
+        return bool(self.buf) or self.body_left > 0
+
+    def feed(self, data):
+        """Add received bytes; returns the list of requests completed by them."""
+        buf = self.buf
+        buf += data
+        pos = 0                     # start of the unparsed data
+        done = []
+        while True:
+            if self.body_left:
+                # we serve GET/HEAD only, so request bodies are read and dropped
+                n = min(self.body_left, len(buf) - pos)
+                pos += n
+                self.body_left -= n
+                if self.body_left:
+                    break
+
+            # tolerate stray CRLFs between pipelined requests
+            while buf.startswith(b"\r\n", pos):
+                pos += 2
+
+            end = buf.find(b"\r\n\r\n", self.scanned if self.scanned > pos else pos)
+            if end < 0:
+                if len(buf) - pos > self.max_header_bytes:
+                    raise BadRequest("request header too large")
+                # next time, only look at what arrives (and the 3 bytes before it)
+                self.scanned = max(0, len(buf) - pos - 3)
+                break
+            if end - pos > self.max_header_bytes:
+                raise BadRequest("request header too large")
+            self.scanned = 0
+            if pos == 0 and end + 4 == len(buf):
+                # the usual case, one whole request per read: hand the buffer over, no copy
+                del buf[end:]
+                head, buf = buf, bytearray()
+                self.buf = buf
+            else:
+                head = buf[pos:end]
+                pos = end + 4
+            req = parse_head(head, self.max_headers)
+            self.body_left = body_length(req.headers)
+            done.append(req)
+
+        # drop what was consumed, once per read
+        if pos:
+            del buf[:pos]
+        return done
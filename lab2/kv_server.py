@@ -0,0 +1,129 @@
+# kv_server.py
+# Stand-in for the shared store (think Redis) that lets several server
+# instances behind a balancer share hit counts and rate limits (--state kv).
+# One asyncio process; every command runs to completion before the next, so
+# each one is atomic without locks.
+#
+# Protocol: one JSON array per line, one JSON reply per line, in order.
+# Clients pipeline: many commands in one write, the replies to all of them in
+# one read.
+#   ["INCRBY", key, n]                   -> new count        (Redis INCRBY)
+#   ["MGET", [key, ...]]                 -> [count, ...]     (Redis MGET)
+#   ["TAKE", key, limit, window, n]      -> [granted, retry_after]
+#   ["STATS"]                            -> {...}
+# TAKE hands out up to n tokens of key's GCRA bucket (limit per window,
+# bursts up to limit) in one step; retry_after is how long until the next
+# token exists if none were granted. All bucket times are this process's
+# clock, so the clocks of the servers asking do not matter. (With Redis
+# this would be a small Lua script.)
+#
+#   python kv_server.py [--port 7070] [--hits-file PATH] [--latency-ms N]
+import asyncio, json, sys, time
+
+from hit_counter import HitLog, LockedCounter
+from rate_limiter import gcra
+
+def arg(name, default, cast=int):
+    return cast(sys.argv[sys.argv.index(name) + 1]) if name in sys.argv else default
+
+host = arg("--host", "0.0.0.0", str)
+port = arg("--port", 7070)
+hits_file = arg("--hits-file", None, str)   # keep counts across restarts, like the servers' own --hits-file
+sweep_interval = arg("--sweep", 5.0, float)  # seconds between dropping refilled buckets
+latency = arg("--latency-ms", 0.0, float) / 1000  # added before every reply: a store across the network
+
+counts = LockedCounter()        # the event loop writes, the --hits-file thread snapshots
+tats = {}                       # bucket key -> theoretical arrival time
+stats = {"commands": 0, "batches": 0, "connections": 0, "granted": 0, "denied": 0}
+
+
+def take(key, limit, window, n):
+    """Up to n requests' worth of key's bucket: [granted, seconds until the next token if 0]."""
+    now = time.monotonic()
+    interval = window / limit
+    tolerance = interval * (limit - 1)
+    tat = tats.get(key, now)
+    granted = 0
+    while granted < n:
+        allowed, next_tat = gcra(tat, now, interval, tolerance)
+        if not allowed:
+            break
+        tat = next_tat
+        granted += 1
+    if granted:
+        tats[key] = tat
+        stats["granted"] += granted
+        return [granted, 0.0]
+    stats["denied"] += 1
+    return [0, max(tat, now) - now - tolerance]
+
+
+def execute(cmd):
+    op = cmd[0]
+    if op == "INCRBY":
+        counts.incr(cmd[1], cmd[2])
+        return counts.get(cmd[1])
+    if op == "MGET":
+        return counts.get_many(cmd[1])
+    if op == "TAKE":
+        return take(*cmd[1:])
+    if op == "STATS":
+        return dict(stats, keys=len(counts.counts), buckets=len(tats))
+    raise ValueError(f"unknown command {op!r}")
+
+
+async def handle(reader, writer):
+    stats["connections"] += 1
+    pending = b""
+    try:
+        while data := await reader.read(65536):
+            *lines, pending = (pending + data).split(b"\n")
+            replies = []
+            for line in lines:
+                try:
+                    reply = execute(json.loads(line))
+                except (ValueError, TypeError, IndexError, KeyError, ArithmeticError) as e:
+                    # e.g. a TAKE with limit 0: an error reply, the connection stays up
+                    reply = {"error": str(e)}
+                replies.append(json.dumps(reply, separators=(",", ":")))
+            if replies:
+                stats["commands"] += len(replies)
+                stats["batches"] += 1
+                if latency:
+                    await asyncio.sleep(latency)
+                # every reply to this read in one write
+                writer.write(("\n".join(replies) + "\n").encode())
+                await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def sweep():
+    # a bucket whose TAT has passed is full again: nothing worth keeping
+    while True:
+        await asyncio.sleep(sweep_interval)
+        now = time.monotonic()
+        for key in [k for k, tat in tats.items() if tat <= now]:
+            del tats[key]
+
+
+async def main():
+    if hits_file:
+        log = HitLog(hits_file)
+        counts.seed(log.load())
+        log.flush_every(counts, 5.0)
+    # the loop keeps only a weak reference to tasks: hold on to it
+    sweeper = asyncio.create_task(sweep())
+    server = await asyncio.start_server(handle, host, port)
+    print(f"[kv] listening on {host}:{port}", flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        sweeper.cancel()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,271 @@
+# kv_state.py
+# Hit counts and rate limits kept in a key-value server (kv_server.py, a
+# stand-in for Redis) so that several server instances share them. The point
+# is to keep the network off the request path:
+#
+# RemoteHitCounter gathers increments in a local dict and sends them every
+# flush_interval as one pipelined batch of INCRBYs: one round trip per batch,
+# not per request. Reads ask the server and add what is still pending here.
+#
+# LeasedRateLimiter takes tokens from the shared GCRA bucket a few at a time
+# (a lease) and spends them locally. When a lease runs low a background
+# thread tops it up, batching every key that needs it into one round trip, so
+# a client that keeps sending rarely waits on the kv server. A refusal comes
+# with the time until the next token, and the client is refused locally until
+# then. Every admitted request was charged to the shared bucket, so the
+# cluster-wide limit holds; a lease is only valid for one window, which bounds
+# how far a node can shift its share in time. If the kv server is unreachable
+# the limiter falls back to a per-process GCRALimiter instead of blocking or
+# letting everything through, and so does it when the kv server rejects a
+# command (KVError: a bug or a protocol mismatch, not a decision).
+import json, socket, threading, time
+from collections import defaultdict
+
+from rate_limiter import GCRALimiter
+
+
+class KVError(Exception):
+    """The kv server answered a command with an error (the connection is fine)."""
+
+
+class KVClient:
+    """One connection to the kv server; call() pipelines several commands in one write."""
+    def __init__(self, addr, timeout=0.5, retry_after=1.0):
+        host, _, port = addr.rpartition(":")
+        self.addr = (host or "127.0.0.1", int(port))
+        self.timeout = timeout
+        self.retry_after = retry_after    # after a failure, fail fast this long before reconnecting
+        self.lock = threading.Lock()
+        self.sock = self.rfile = None
+        self.down_until = 0.0
+        self.round_trips = 0
+        self.commands = 0
+        self.errors = 0
+
+    def _close(self):
+        for f in (self.rfile, self.sock):
+            if f is not None:
+                f.close()
+        self.sock = self.rfile = None
+
+    def call(self, *commands):
+        """
+        Replies to commands, in order. Raises ConnectionError if the server
+        cannot be reached, KVError if it rejected any of the commands.
+        """
+        payload = "".join(json.dumps(c, separators=(",", ":")) + "\n" for c in commands).encode()
+        with self.lock:
+            if self.sock is None and time.monotonic() < self.down_until:
+                raise ConnectionError("kv server unavailable")
+            try:
+                if self.sock is None:
+                    self.sock = socket.create_connection(self.addr, self.timeout)
+                    self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    self.rfile = self.sock.makefile("rb")
+                self.sock.sendall(payload)
+                replies = []
+                for _ in commands:
+                    line = self.rfile.readline()
+                    if not line:
+                        raise ConnectionError("kv server closed the connection")
+                    replies.append(json.loads(line))
+            except (OSError, ValueError) as e:
+                self.errors += 1
+                self._close()
+                self.down_until = time.monotonic() + self.retry_after
+                raise ConnectionError(f"kv server {self.addr[0]}:{self.addr[1]}: {e}") from e
+            self.round_trips += 1
+            self.commands += len(commands)
+        # every reply has been read, so the connection stays usable
+        errors = [r["error"] for r in replies if isinstance(r, dict) and "error" in r]
+        if errors:
+            self.errors += 1
+            raise KVError(f"kv server rejected {len(errors)} of {len(commands)} commands: {errors[0]}")
+        return replies
+
+
+class RemoteHitCounter:
+    """path -> hit count on the kv server, written in batches."""
+    def __init__(self, client, flush_interval=0.2):
+        self.client = client
+        self.flush_interval = flush_interval
+        self.pending = defaultdict(int)
+        self.lock = threading.Lock()
+        self.dropped = 0                # increments the kv server rejected
+
+    def incr(self, key, n=1):
+        with self.lock:
+            self.pending[key] += n
+
+    def flush(self):
+        with self.lock:
+            batch, self.pending = self.pending, defaultdict(int)
+        if not batch:
+            return
+        try:
+            self.client.call(*(["INCRBY", key, n] for key, n in batch.items()))
+        except ConnectionError:
+            # keep them for the next flush
+            with self.lock:
+                for key, n in batch.items():
+                    self.pending[key] += n
+        except KVError as e:
+            # sending the same batch again would only be rejected again
+            self.dropped += sum(batch.values())
+            print(f"[state] hit counts dropped: {e}", flush=True)
+
+    def flush_every(self):
+        def loop():
+            while True:
+                time.sleep(self.flush_interval)
+                self.flush()
+        threading.Thread(target=loop, name="kv-hits", daemon=True).start()
+
+    def get_many(self, keys):
+        """Counts for several keys in one round trip (0 plus local pending ones if the server fails)."""
+        keys = list(keys)
+        try:
+            counts = self.client.call(["MGET", keys])[0]
+        except (ConnectionError, KVError):
+            counts = [0] * len(keys)
+        with self.lock:
+            return [n + self.pending.get(k, 0) for n, k in zip(counts, keys)]
+
+    def get(self, key):
+        return self.get_many([key])[0]
+
+    def seed(self, counts):
+        # the kv server owns the totals (and persists them with its own
+        # --hits-file); replaying a node's log into it would count them twice
+        pass
+
+
+class Lease:
+    __slots__ = ("tokens", "until", "refused", "refilling")
+
+    def __init__(self, tokens, until, refused=False):
+        self.tokens = tokens        # requests this process may admit without asking
+        self.until = until          # leftover tokens are dropped at this time
+        self.refused = refused      # the bucket is empty: refuse locally until `until`
+        self.refilling = False
+
+
+class LeasedRateLimiter:
+    """
+    rate_limiter.GCRALimiter with the buckets on the kv server. A lease is
+    `fraction` of a rule's limit (at least one token).
+    """
+    def __init__(self, client, policy, fraction=0.1, housekeeping=5.0):
+        self.client = client
+        self.policy = policy
+        self.fraction = fraction
+        self.housekeeping = housekeeping
+        self.leases = {}                # bucket key -> Lease
+        self.lock = threading.Lock()
+        self.wanted = {}                # bucket key -> limit, leases the refill thread should top up
+        self.wake = threading.Condition(self.lock)
+        self.fallback = GCRALimiter(policy, evict_interval=0)
+        self.local = 0                  # decided from a lease, no round trip
+        self.remote = 0                 # waited for the kv server
+        self.fallbacks = 0              # decided by the fallback limiter
+
+    def batch(self, limit):
+        return max(1, int(limit * self.fraction))
+
+    def start(self):
+        # after forking: threads do not survive fork
+        threading.Thread(target=self._refill_loop, name="kv-leases", daemon=True).start()
+
+    def too_many_requests(self, ip, path="/", wait=True):
+        """
+        True if this request should get a 429; otherwise it is counted. With
+        wait=False, returns None instead of waiting on the kv server.
+        """
+        key, limit = self.policy.rule(ip, path)
+        if not limit:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            lease = self.leases.get(key)
+            if lease is not None and now < lease.until:
+                if lease.refused:
+                    self.local += 1
+                    return True
+                if lease.tokens:
+                    lease.tokens -= 1
+                    self.local += 1
+                    self._top_up(key, lease, limit)
+                    return False
+            if not wait:
+                return None
+        try:
+            granted, retry_after = self.client.call(
+                ["TAKE", key, limit, self.policy.window, self.batch(limit)])[0]
+        except (ConnectionError, KVError):
+            self.fallbacks += 1
+            return self.fallback.too_many_requests(ip, path)
+        now = time.monotonic()
+        with self.lock:
+            self.remote += 1
+            if granted:
+                # a client that came once is likely to come again: have the
+                # next tokens ready before it does
+                lease = self.leases[key] = Lease(granted - 1, now + self.policy.window)
+                self._top_up(key, lease, limit)
+            else:
+                self.leases[key] = Lease(0, now + retry_after, refused=True)
+        return not granted
+
+    def _top_up(self, key, lease, limit):
+        # caller holds self.lock
+        if lease.tokens <= self.batch(limit) // 2 and not lease.refilling:
+            lease.refilling = True
+            self.wanted[key] = limit
+            self.wake.notify()
+
+    def _refill(self):
+        with self.lock:
+            while not self.wanted:
+                if not self.wake.wait(self.housekeeping):
+                    return
+            wanted, self.wanted = self.wanted, {}
+        keys = list(wanted)
+        try:
+            replies = self.client.call(
+                *(["TAKE", k, wanted[k], self.policy.window, self.batch(wanted[k])] for k in keys))
+        except (ConnectionError, KVError):
+            # nothing granted: the leases run out and the foreground asks (or falls back)
+            replies = [[0, 0.0]] * len(keys)
+        now = time.monotonic()
+        with self.lock:
+            for key, (granted, retry_after) in zip(keys, replies):
+                lease = self.leases.get(key)
+                if lease is None:
+                    continue
+                lease.refilling = False
+                if granted:
+                    # the new tokens are good for a window; leftovers go along
+                    lease.tokens += granted
+                    lease.until = now + self.policy.window
+                elif not lease.tokens and retry_after:
+                    lease.refused = True
+                    lease.until = now + retry_after
+                # otherwise spend what is left, then ask again in the foreground
+
+    def _expire(self):
+        now = time.monotonic()
+        with self.lock:
+            for key in [k for k, lease in self.leases.items() if lease.until <= now and not lease.refilling]:
+                del self.leases[key]
+        self.fallback.evict_idle()
+
+    def _refill_loop(self):
+        last = time.monotonic()
+        while True:
+            self._refill()
+            if time.monotonic() - last >= self.housekeeping:
+                self._expire()
+                last = time.monotonic()
+
+    def __len__(self):
+        return len(self.leases)
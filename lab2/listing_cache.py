@@ -0,0 +1,79 @@
+# listing_cache.py
+# Sorted directory contents, cached per directory and revalidated with a single
+# stat() of the directory: adding, removing or renaming an entry changes the
+# directory's mtime, and only that directory is rescanned. A rescan uses
+# os.scandir, which reports entry types without a stat() per entry; only
+# symlinks are resolved. Hit counts are NOT stored here; servers merge them
+# in when rendering.
+import os, threading, time
+from collections import OrderedDict
+
+
+class Snapshot:
+    __slots__ = ("mtime_ns", "scanned_ns", "entries")
+
+    def __init__(self, mtime_ns, scanned_ns, entries):
+        self.mtime_ns = mtime_ns
+        self.scanned_ns = scanned_ns
+        self.entries = entries      # sorted list of (name, is_dir, resolved path)
+
+
+class ListingCache:
+    def __init__(self, max_dirs=256):
+        self.max_dirs = max_dirs
+        self.snapshots = OrderedDict()  # resolved dir path -> Snapshot, LRU order
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.rescans = 0
+
+    def get(self, directory):
+        """Sorted (name, is_dir, resolved path) tuples for a resolved directory path."""
+        st = os.stat(directory)
+        with self.lock:
+            snap = self.snapshots.get(directory)
+            # a change within the same second as the scan might share its mtime, so rescan
+            if snap and snap.mtime_ns == st.st_mtime_ns and snap.scanned_ns - st.st_mtime_ns > 1e9:
+                self.snapshots.move_to_end(directory)
+                self.hits += 1
+                return snap.entries
+            self.rescans += 1
+
+        scanned_ns = time.time_ns()
+        entries = []
+        with os.scandir(directory) as it:
+            for d in it:
+                if d.is_symlink():
+                    entries.append((d.name, d.is_dir(), os.path.realpath(d.path)))
+                else:
+                    entries.append((d.name, d.is_dir(follow_symlinks=False), d.path))
+        entries.sort()
+
+        with self.lock:
+            self.snapshots[directory] = Snapshot(st.st_mtime_ns, scanned_ns, entries)
+            self.snapshots.move_to_end(directory)
+            while len(self.snapshots) > self.max_dirs:
+                self.snapshots.popitem(last=False)
+        return entries
+
+    def describe(self):
+        with self.lock:
+            return f"dirs={len(self.snapshots)} hits={self.hits} rescans={self.rescans}"
+
+
+def page_bounds(total, page, page_size):
+    """(first index, last index, page, page count) with page clamped to range (page_size 0: one page)."""
+    if page_size <= 0:
+        return 0, total, 1, 1
+    pages = max(1, -(-total // page_size))
+    page = min(max(page, 1), pages)
+    start = (page - 1) * page_size
+    return start, min(start + page_size, total), page, pages
+
+
+def page_param(query):
+    """The ?page=N value of a query string, 1 if absent or malformed."""
+    for part in query.split("&"):
+        name, _, value = part.partition("=")
+        if name == "page" and value.isdigit():
+            return int(value)
+    return 1
@@ -1,91 +1,484 @@
-import threading
-import time
-import socket
+# load_test.py
+# Load generator for the lab servers.
+#
+#   closed loop  --connections C: C keep-alive connections, each sends its next
+#                request as soon as the previous response has arrived (optionally
+#                after --think seconds). Measures what C busy clients get.
+#   open loop    --rate R: requests are *scheduled* at a constant R per second,
+#                no matter how slow the server is, on up to --connections
+#                keep-alive connections. Latency is measured from the scheduled
+#                time, so a stalled server shows up as queueing delay instead of
+#                silently lowering the load (coordinated omission).
+#
+# Requests are driven by asyncio; --procs P runs P such processes, each with
+# 1/P of the connections and rate, so the generator is not the bottleneck.
+# Latencies go into a log-linear (HDR-style) histogram: constant relative
+# precision (< 0.4%) from microseconds to minutes in a few hundred buckets,
+# cheap to merge across processes.
+#
+#   python load_test.py --url http://127.0.0.1:8081/ --connections 50 --duration 10
+#   python load_test.py --url http://127.0.0.1:8082/kernel.html --rate 500 --connections 200 --procs 4
+#   ... --label async --json run.json --csv runs.csv   (csv rows are appended, one per target)
+#
+# https:// URLs connect with TLS (the certificate is not checked). Every new
+# connection then costs a handshake: a full one, or with --tls-resume a
+# resumed one offering the last session ticket the process received. Connect
+# times are reported per kind, and --server-pid PID adds the CPU time the
+# server (and its worker processes) used during the run; with --no-keepalive
+# that is the per-handshake budget:
+#
+#   python load_test.py --url https://127.0.0.1:8443/kernel.html --no-keepalive --connections 20 [--tls-resume] --server-pid 1234
+#
+# Without --url it compares the docker-compose services "single" and "threaded".
+import asyncio, csv, json, math, os, ssl, subprocess, sys, time
+from multiprocessing import Pool
+from urllib.parse import urlsplit
 
-def fetch(host, port, path="/", results=None, index=None):
-    try:
-        req = (
-            f"GET {path} HTTP/1.1\r\n"
-            f"Host: {host}\r\n"
-            "Connection: close\r\n"
-            "\r\n"
-        )
-
-        with socket.create_connection((host, port)) as s:
-            s.sendall(req.encode())
-
-            data = b""
-            while True:
-                chunk = s.recv(4096)
-                if not chunk:
-                    break
-                data += chunk
+from httpparse import BadMessage, parse_response_head
 
-        # split headers/body
-        sep = data.find(b"\r\n\r\n")
-        if sep == -1:
-            results[index] = "ERR(no headers)"
-            return
+def arg(name, default, cast=int):
+    return cast(sys.argv[sys.argv.index(name) + 1]) if name in sys.argv else default
 
-        headers = data[:sep].decode(errors="ignore")
-        status_line = headers.split("\r\n", 1)[0]
-        parts = status_line.split()
+def arg_all(name):
+    return [sys.argv[i + 1] for i, a in enumerate(sys.argv[:-1]) if a == name]
 
-        if len(parts) >= 2 and parts[1].isdigit():
-            results[index] = parts[1]  # e.g. "200", "429"
+# flag -> what its value is (None: takes no value)
+FLAGS = {
+    "--url": "URL", "--rate": "R", "--connections": "C", "--duration": "SEC", "--procs": "P",
+    "--no-keepalive": None, "--think": "SEC", "--timeout": "SEC", "--header": "'Name: value'",
+    "--label": "TEXT", "--tls-resume": None, "--server-pid": "PID", "--json": "PATH", "--csv": "PATH",
+}
+USAGE = "Usage: python load_test.py " + " ".join(
+    f"[{flag} {value}]" if value else f"[{flag}]" for flag, value in FLAGS.items())
+
+def check_args():
+    """Exit with the usage on --help, an unknown flag or a flag missing its value."""
+    args = sys.argv[1:]
+    if "--help" in args or "-h" in args:
+        print(USAGE)
+        sys.exit(0)
+    i = 0
+    while i < len(args):
+        flag = args[i]
+        if flag not in FLAGS:
+            problem = f"unknown argument {flag!r}"
+        elif FLAGS[flag] and (i + 1 == len(args) or args[i + 1] in FLAGS):
+            problem = f"{flag} needs a value ({FLAGS[flag]})"
         else:
-            results[index] = "ERR(bad status)"
-    except Exception as e:
-        results[index] = f"ERR({e})"
+            i += 2 if FLAGS[flag] else 1
+            continue
+        print(f"load_test.py: {problem}\n{USAGE}", file=sys.stderr)
+        sys.exit(2)
+
+SUB_BITS = 8            # 256 sub-buckets per power of two
+
+
+# --- Latency histogram (microseconds) ---
+class Histogram:
+    def __init__(self, counts=None):
+        self.counts = dict(counts or {})     # bucket -> count, sparse
+
+    @staticmethod
+    def bucket(us):
+        shift = max(us.bit_length() - SUB_BITS, 0)
+        return (shift << SUB_BITS) + (us >> shift)
+
+    @staticmethod
+    def value(bucket):
+        """Middle of a bucket's range, in microseconds."""
+        shift, m = bucket >> SUB_BITS, bucket & ((1 << SUB_BITS) - 1)
+        return ((m << shift) + ((m + 1) << shift) - 1) / 2
+
+    def record(self, seconds):
+        b = self.bucket(int(seconds * 1e6))
+        self.counts[b] = self.counts.get(b, 0) + 1
+
+    def merge(self, other):
+        for b, n in other.counts.items():
+            self.counts[b] = self.counts.get(b, 0) + n
+
+    def total(self):
+        return sum(self.counts.values())
+
+    def percentiles(self, ps):
+        """{p: milliseconds} for each percentile p (0-100)."""
+        total = self.total()
+        result = {}
+        if not total:
+            return {p: 0.0 for p in ps}
+        buckets = sorted(self.counts.items())
+        for p in ps:
+            rank = max(1, math.ceil(total * p / 100))
+            seen = 0
+            for b, n in buckets:
+                seen += n
+                if seen >= rank:
+                    result[p] = self.value(b) / 1000
+                    break
+        return result
+
+    def mean(self):
+        total = self.total()
+        return sum(self.value(b) * n for b, n in self.counts.items()) / total / 1000 if total else 0.0
+
+
+# --- One worker process: asyncio connections ---
+class Stats:
+    def __init__(self):
+        self.hist = Histogram()
+        self.statuses = {}
+        self.errors = {}
+        self.timeline = {}      # second since start -> [responses, errors, latency sum]
+        self.last = 0.0         # seconds from start to the last response
+
+    def ok(self, status, sent, done, start):
+        self.hist.record(done - sent)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        row = self.timeline.setdefault(int(done - start), [0, 0, 0.0])
+        row[0] += 1
+        row[2] += done - sent
+        self.last = max(self.last, done - start)
+
+    def error(self, kind, done, start):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+        self.timeline.setdefault(int(done - start), [0, 0, 0.0])[1] += 1
+
+    def export(self):
+        return {"hist": self.hist.counts, "statuses": self.statuses,
+                "errors": self.errors, "timeline": self.timeline, "last": self.last}
+
+
+# --- TLS ---
+class ResumingContext(ssl.SSLContext):
+    """Client context that offers `session` on every new connection (asyncio has no per-connection session argument)."""
+    session = None
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        return super().wrap_bio(incoming, outgoing, server_side, server_hostname, session or self.session)
+
+
+def client_context(resume):
+    ctx = ResumingContext(ssl.PROTOCOL_TLS_CLIENT) if resume else ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE     # the lab servers use self-signed certificates
+    ctx.set_alpn_protocols(["http/1.1"])
+    return ctx
+
 
+def server_cpu(pid):
+    """CPU seconds used so far by process pid and its children (pre-forked workers); Linux /proc."""
+    ticks = os.sysconf("SC_CLK_TCK")
+    total = 0
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        # after the command: state ppid ... utime (12th) stime (13th)
+        if int(entry) == pid or int(fields[1]) == pid:
+            total += int(fields[11]) + int(fields[12])
+    return total / ticks
+
+
+async def read_response(reader):
+    """Read one response, discarding the body. Returns (status, must_close)."""
+    head = await reader.readuntil(b"\r\n\r\n")
+    status, headers = parse_response_head(head[:-4])
+    conn = headers.get("connection")
+    close = "close" in conn.lower() if conn is not None else head.startswith(b"HTTP/1.0")
+    length = headers.get("content-length")
+    length = int(length) if length is not None else None
+    chunked = "chunked" in headers.get("transfer-encoding", "").lower()
+    if chunked:
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            if size == 0:
+                while await reader.readuntil(b"\r\n") != b"\r\n":
+                    pass
+                break
+            await reader.readexactly(size + 2)
+    elif length is not None:
+        while length:
+            data = await reader.read(min(length, 65536))
+            if not data:
+                raise ConnectionError("short body")
+            length -= len(data)
+    else:
+        while await reader.read(65536):
+            pass
+        close = True
+    return status, close
+
+
+class Connections:
+    """Up to `limit` keep-alive connections; open loop requests wait here for one."""
+    def __init__(self, host, port, limit, ssl_context=None):
+        self.host, self.port, self.limit = host, port, limit
+        self.ssl = ssl_context
+        self.idle = []
+        self.count = 0
+        self.freed = asyncio.Condition()
+        self.opened = 0
+        self.connect = {}       # "tcp" / "tls full" / "tls resumed" -> Histogram of connect times
+
+    async def get(self):
+        async with self.freed:
+            while not self.idle and self.count >= self.limit:
+                await self.freed.wait()
+            if self.idle:
+                return self.idle.pop()
+            self.count += 1
+        try:
+            self.opened += 1
+            started = time.monotonic()
+            conn = await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+        except BaseException:
+            await self.put(None)
+            raise
+        kind = "tcp"
+        if self.ssl:
+            kind = "tls resumed" if conn[1].get_extra_info("ssl_object").session_reused else "tls full"
+        self.connect.setdefault(kind, Histogram()).record(time.monotonic() - started)
+        return conn
+
+    def keep_session(self, writer):
+        """--tls-resume: remember the connection's session (its ticket arrives after the handshake)."""
+        if isinstance(self.ssl, ResumingContext):
+            self.ssl.session = writer.get_extra_info("ssl_object").session
+
+    async def put(self, conn):
+        """Give a connection back; None if it was closed."""
+        async with self.freed:
+            if conn is None:
+                self.count -= 1
+            else:
+                self.idle.append(conn)
+            self.freed.notify()
+
+
+async def one_request(conns, request, stats, sent, start, timeout):
+    try:
+        conn = await conns.get()
+    except OSError as e:
+        stats.error(type(e).__name__, time.monotonic(), start)
+        return
+    reader, writer = conn
+    try:
+        writer.write(request)
+        status, close = await asyncio.wait_for(read_response(reader), timeout)
+        stats.ok(status, sent, time.monotonic(), start)
+        conns.keep_session(writer)
+    except asyncio.TimeoutError:
+        stats.error("timeout", time.monotonic(), start)
+        close = True
+    except (OSError, ValueError, BadMessage, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+        stats.error(type(e).__name__, time.monotonic(), start)
+        close = True
+    if close:
+        writer.close()
+        conn = None
+    await conns.put(conn)
+
+
+async def run_engine(cfg, start):
+    stats = Stats()
+    url = urlsplit(cfg["url"])
+    target = (url.path or "/") + (f"?{url.query}" if url.query else "")
+    headers = [f"Host: {url.netloc}", *cfg["headers"]]
+    if not cfg["keepalive"]:
+        headers.append("Connection: close")
+    request = (f"GET {target} HTTP/1.1\r\n" + "".join(f"{h}\r\n" for h in headers) + "\r\n").encode()
+    tls = url.scheme == "https"
+    conns = Connections(url.hostname, url.port or (443 if tls else 80), cfg["connections"],
+                        client_context(cfg["tls_resume"]) if tls else None)
+    end = start + cfg["duration"]
+    await asyncio.sleep(max(0.0, start - time.monotonic()))
+
+    if cfg["rate"]:
+        # open loop: request i is due at start + i / rate, sent or not
+        tasks = set()
+        i = 0
+        while True:
+            due = start + i / cfg["rate"]
+            if due >= end:
+                break
+            await asyncio.sleep(max(0.0, due - time.monotonic()))
+            task = asyncio.ensure_future(one_request(conns, request, stats, due, start, cfg["timeout"]))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            i += 1
+        if tasks:
+            await asyncio.wait(tasks, timeout=cfg["timeout"])
+        for task in list(tasks):
+            task.cancel()
+            stats.error("unfinished", time.monotonic(), start)
+    else:
+        # closed loop: each client waits for its response before the next request
+        async def client():
+            while time.monotonic() < end:
+                await one_request(conns, request, stats, time.monotonic(), start, cfg["timeout"])
+                if cfg["think"]:
+                    await asyncio.sleep(cfg["think"])
+        await asyncio.gather(*(client() for _ in range(cfg["connections"])))
+
+    for reader, writer in conns.idle:
+        writer.close()
+    result = stats.export()
+    result["opened"] = conns.opened
+    result["connect"] = {kind: h.counts for kind, h in conns.connect.items()}
+    return result
+
+
+def worker(job):
+    cfg, start = job
+    return asyncio.run(run_engine(cfg, start))
+
+
+# --- Running and reporting ---
+PERCENTILES = (50, 90, 99, 99.9)
+
+def run(cfg):
+    procs = cfg["procs"]
+    share = dict(cfg, connections=max(1, cfg["connections"] // procs), rate=cfg["rate"] / procs)
+    start = time.monotonic() + 0.5      # every process starts on the same clock tick
+    cpu_before = server_cpu(cfg["server_pid"]) if cfg["server_pid"] else None
+    if procs > 1:
+        with Pool(procs) as pool:
+            parts = pool.map(worker, [(share, start)] * procs)
+    else:
+        parts = [worker((share, start))]
+    cpu = server_cpu(cfg["server_pid"]) - cpu_before if cfg["server_pid"] else None
+
+    hist, statuses, errors, timeline, opened, last = Histogram(), {}, {}, {}, 0, 0.0
+    connect = {}
+    for part in parts:
+        hist.merge(Histogram(part["hist"]))
+        for key, n in part["statuses"].items():
+            statuses[key] = statuses.get(key, 0) + n
+        for key, n in part["errors"].items():
+            errors[key] = errors.get(key, 0) + n
+        for sec, (n, e, lat) in part["timeline"].items():
+            row = timeline.setdefault(sec, [0, 0, 0.0])
+            row[0] += n
+            row[1] += e
+            row[2] += lat
+        opened += part["opened"]
+        for kind, counts in part["connect"].items():
+            connect.setdefault(kind, Histogram()).merge(Histogram(counts))
+        last = max(last, part["last"])
+
+    responses = hist.total()
+    pct = hist.percentiles(PERCENTILES)
+    return {
+        "label": cfg["label"],
+        "url": cfg["url"],
+        "commit": git_commit(),
+        "config": {k: cfg[k] for k in ("mode", "rate", "connections", "duration", "procs", "keepalive", "think",
+                                       "tls_resume")},
+        "responses": responses,
+        "errors": sum(errors.values()),
+        "error_kinds": errors,
+        "statuses": {str(k): v for k, v in sorted(statuses.items())},
+        # responses still arriving after the run (a backlog in open loop) stretch the span
+        "throughput": responses / max(cfg["duration"], last),
+        "connections_opened": opened,
+        "connect_ms": {
+            kind: {"count": h.total(), "mean": h.mean(), **{f"p{p:g}": v for p, v in h.percentiles((50, 99)).items()}}
+            for kind, h in sorted(connect.items())
+        },
+        "server_cpu_s": cpu,
+        "latency_ms": {
+            "min": Histogram.value(min(hist.counts)) / 1000 if hist.counts else 0.0,
+            "mean": hist.mean(),
+            **{f"p{p:g}": pct[p] for p in PERCENTILES},
+            "max": Histogram.value(max(hist.counts)) / 1000 if hist.counts else 0.0,
+        },
+        "timeline": [
+            {"second": sec, "responses": n, "errors": e, "mean_ms": lat / n * 1000 if n else 0.0}
+            for sec, (n, e, lat) in sorted(timeline.items())
+        ],
+        "histogram_us": {f"{Histogram.value(b):.1f}": n for b, n in sorted(hist.counts.items())},
+    }
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5)
+        return out.stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
 
-def run_batch(label, host, port, path="/", n=10):
-    results = [None] * n
-    threads = []
 
-    t0 = time.time()
-    for i in range(n):
-        th = threading.Thread(
-            target=fetch,
-            args=(host, port, path, results, i),
-            daemon=True,
-        )
-        th.start()
-        threads.append(th)
+def report(r):
+    c = r["config"]
+    load = f"rate={c['rate']:g}/s, <= {c['connections']} conns" if c["mode"] == "open" else f"{c['connections']} conns"
+    print(f"\n== {r['label'] or r['url']}: {c['mode']} loop, {load}, {c['duration']:g}s, "
+          f"{c['procs']} proc(s), keep-alive {'on' if c['keepalive'] else 'off'}"
+          + (", TLS resumption" if c["tls_resume"] else ""))
+    print(f"responses {r['responses']}  errors {r['errors']} {r['error_kinds'] or ''}  "
+          f"throughput {r['throughput']:.1f} req/s  connections opened {r['connections_opened']}")
+    print(f"statuses {r['statuses']}")
+    lat = r["latency_ms"]
+    print("latency ms  " + "  ".join(f"{k} {v:.2f}" for k, v in lat.items()))
+    for kind, c in r["connect_ms"].items():
+        print(f"connect ms  {kind}: {c['count']} connections, mean {c['mean']:.2f}  p50 {c['p50']:.2f}  p99 {c['p99']:.2f}")
+    if r["server_cpu_s"] is not None:
+        cpu = r["server_cpu_s"]
+        print(f"server CPU {cpu:.2f}s  = {cpu / max(r['connections_opened'], 1) * 1000:.3f} ms per connection, "
+              f"{cpu / max(r['responses'], 1) * 1000:.3f} ms per response")
+    print("  second  responses  errors  mean ms")
+    for row in r["timeline"]:
+        print(f"  {row['second']:6d}  {row['responses']:9d}  {row['errors']:6d}  {row['mean_ms']:7.2f}")
 
-    for th in threads:
-        th.join()
-    t1 = time.time()
 
-    total_time = t1 - t0
+CSV_FIELDS = ["label", "url", "commit", "mode", "rate", "connections", "duration", "procs", "keepalive", "think",
+              "responses", "errors", "throughput", "min", "mean", "p50", "p90", "p99", "p99.9", "max",
+              "tls_resume", "server_cpu_s"]
 
-    # Print detailed per-request results
-    for idx, status in enumerate(results):
-        print(f"Request {idx:02d}: {status}")
+def append_csv(path, r):
+    new = not os.path.exists(path)
+    with open(path, "a", newline="") as f:
+        w = csv.DictWriter(f, CSV_FIELDS)
+        if new:
+            w.writeheader()
+        w.writerow({**r["config"], **{k: round(v, 3) for k, v in r["latency_ms"].items()},
+                    **{k: r[k] for k in ("label", "url", "commit", "responses", "errors", "server_cpu_s")},
+                    "throughput": round(r["throughput"], 2)})
 
-    print(f"Total time for {n} concurrent requests: {total_time:.2f}s")
 
-    return total_time, results
+def main():
+    check_args()
+    urls = arg_all("--url") or ["http://single:8080/", "http://threaded:8081/"]
+    rate = arg("--rate", 0.0, float)
+    base = {
+        "mode": "open" if rate else "closed",
+        "rate": rate,
+        "connections": arg("--connections", 10),
+        "duration": arg("--duration", 10.0, float),
+        "procs": arg("--procs", 1),
+        "keepalive": "--no-keepalive" not in sys.argv,
+        "think": arg("--think", 0.0, float),
+        "timeout": arg("--timeout", 30.0, float),
+        "headers": arg_all("--header"),
+        "label": arg("--label", "", str),
+        "tls_resume": "--tls-resume" in sys.argv,
+        "server_pid": arg("--server-pid", 0),
+    }
+    results = []
+    for url in urls:
+        r = run(dict(base, url=url))
+        report(r)
+        results.append(r)
+        if "--csv" in sys.argv:
+            append_csv(arg("--csv", "", str), r)
+    if "--json" in sys.argv:
+        with open(arg("--json", "", str), "w") as f:
+            json.dump(results if len(results) > 1 else results[0], f, indent=2)
 
 
 if __name__ == "__main__":
-    path = "/"
-    n = 10
-
-    # Single-threaded server container
-    run_batch(
-        label="single-threaded",
-        host="single",
-        port=8080,
-        path=path,
-        n=n,
-    )
-
-    # Multithreaded server container
-    run_batch(
-        label="multithreaded",
-        host="threaded",
-        port=8081,
-        path=path,
-        n=n,
-    )
+    main()
@@ -0,0 +1,289 @@
+# metrics.py
+# Request metrics for the lab2 servers, served as Prometheus text format
+# (GET /metrics):
+#
+#   http_requests_total{code,path}           responses by status code and path
+#   http_response_bytes_total{code}          bytes sent
+#   http_request_duration_seconds            histogram, accept-to-last-byte
+#   http_request_phase_seconds{phase}        histogram per phase: parse,
+#                                            ratelimit, work (the artificial
+#                                            delay), resolve, read, send
+#   http_rate_limited_total{limiter,rule}    429s by limiter and policy rule
+#   http_connections_active / _total         open and accepted connections
+#   http_connections_dropped_total{reason}   connections refused at accept, or
+#                                            cut off for being too slow / garbage
+#   http_tls_handshakes_total{kind}          full, resumed or failed (with TLS)
+#   http_tls_handshake_seconds{kind}         histogram, blocking modes only
+#   http_file_cache_{hits,misses,evictions,   the hot-file cache (file_cache(),
+#     invalidations,entries,bytes}            summed over workers)
+#   plus gauges the server registers (threads, pool queue depth, ...)
+#
+# Every request takes the lock once, in observe(). With --workers each
+# process keeps its own numbers and writes a snapshot to a shared spool
+# directory every second; whichever worker answers the scrape merges them
+# (counters of workers that died are kept, their gauges are not).
+import bisect, json, os, threading, time
+from collections import defaultdict
+
+PHASES = ("parse", "ratelimit", "work", "resolve", "read", "send")
+HANDSHAKES = ("full", "resumed")    # timed; "failed" is only counted
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MAX_PATHS = 1000        # distinct path labels; later paths are counted as "other"
+# FileCache.stats() fields exposed by file_cache() (the hit ratio is hits / (hits + misses))
+FILE_CACHE_STATS = (
+    ("hits", "Lookups answered from the file cache."),
+    ("misses", "Lookups the file cache could not answer."),
+    ("evictions", "Entries dropped to stay within the cache budget."),
+    ("invalidations", "Entries dropped because the file changed."),
+    ("entries", "Files in the cache."),
+    ("bytes", "Bytes held by the cache."),
+)
+
+
+class Histogram:
+    __slots__ = ("counts", "sum")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)    # last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+
+
+class Timer:
+    """Per-request stopwatch: mark(phase) charges the time since the previous mark to phase."""
+    __slots__ = ("last", "phases")
+
+    def __init__(self, parse_time=0.0):
+        self.last = time.perf_counter()
+        self.phases = {"parse": parse_time} if parse_time else {}
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self.last
+        self.last = now
+
+
+class Metrics:
+    def __init__(self, spool_dir=None):
+        self.lock = threading.Lock()
+        self.requests = defaultdict(int)    # (code, path) -> responses
+        self.bytes = defaultdict(int)       # code -> bytes sent
+        self.limited = defaultdict(int)     # (limiter, rule) -> 429s
+        self.dropped = defaultdict(int)     # reason -> connections refused or cut off
+        self.handshakes = defaultdict(int)  # "full" / "resumed" / "failed" -> TLS handshakes
+        self.handshake_time = {kind: Histogram() for kind in HANDSHAKES}
+        self.duration = Histogram()
+        self.phases = {phase: Histogram() for phase in PHASES}
+        self.active = 0
+        self.connections = 0
+        self.gauges = {}                    # name -> (help, callable), read at scrape time
+        self.spool_dir = spool_dir
+
+    # --- recording ---
+    def opened(self):
+        with self.lock:
+            self.active += 1
+            self.connections += 1
+
+    def closed(self):
+        with self.lock:
+            self.active -= 1
+
+    def observe(self, status, path, sent=0, latency=None, timer=None):
+        """One finished response; status is the status text ("200 OK (cached)")."""
+        code = status[:3]
+        with self.lock:
+            key = (code, path)
+            if key not in self.requests and len(self.requests) >= MAX_PATHS:
+                key = (code, "other")
+            self.requests[key] += 1
+            self.bytes[code] += sent
+            if latency is not None:
+                self.duration.observe(latency)
+            if timer is not None:
+                for phase, seconds in timer.phases.items():
+                    self.phases[phase].observe(seconds)
+
+    def rate_limited(self, limiter, rule):
+        with self.lock:
+            self.limited[(limiter, rule)] += 1
+
+    def connection_dropped(self, reason):
+        with self.lock:
+            self.dropped[reason] += 1
+
+    def tls_handshake(self, kind, seconds=None):
+        with self.lock:
+            self.handshakes[kind] += 1
+            if seconds is not None and kind in self.handshake_time:
+                self.handshake_time[kind].observe(seconds)
+
+    def gauge(self, name, help, fn):
+        self.gauges[name] = (help, fn)
+
+    def file_cache(self, cache):
+        """Expose a FileCache's counters as http_file_cache_* (read at scrape time)."""
+        for field, help in FILE_CACHE_STATS:
+            self.gauge(f"http_file_cache_{field}", help, lambda field=field: cache.stats()[field])
+
+    # --- snapshots (what --workers processes exchange) ---
+    def snapshot(self):
+        with self.lock:
+            snap = {
+                "pid": os.getpid(),
+                "requests": [[code, path, n] for (code, path), n in self.requests.items()],
+                "bytes": dict(self.bytes),
+                "limited": [[limiter, rule, n] for (limiter, rule), n in self.limited.items()],
+                "dropped": dict(self.dropped),
+                "handshakes": dict(self.handshakes),
+                "handshake_time": {k: [h.counts, h.sum] for k, h in self.handshake_time.items()},
+                "duration": [self.duration.counts, self.duration.sum],
+                "phases": {p: [h.counts, h.sum] for p, h in self.phases.items()},
+                "connections": self.connections,
+                "gauges": {"http_connections_active": self.active},
+            }
+        for name, (_, fn) in self.gauges.items():
+            snap["gauges"][name] = fn()
+        return snap
+
+    def spool_every(self, interval=1.0):
+        """Write this process's snapshot to the spool directory every `interval` seconds."""
+        path = os.path.join(self.spool_dir, f"{os.getpid()}.json")
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                tmp = path + ".tmp"
+                with open(tmp, "w") as f:
+                    json.dump(self.snapshot(), f)
+                os.replace(tmp, path)
+        threading.Thread(target=loop, name="metrics-spool", daemon=True).start()
+
+    def _snapshots(self):
+        own = self.snapshot()
+        if not self.spool_dir:
+            return [own]
+        snaps = [own]
+        for name in os.listdir(self.spool_dir):
+            if not name.endswith(".json") or name == f"{own['pid']}.json":
+                continue
+            try:
+                with open(os.path.join(self.spool_dir, name)) as f:
+                    snap = json.load(f)
+            except (OSError, ValueError):
+                continue        # being replaced right now; it is in the next scrape
+            if not alive(snap["pid"]):
+                snap["gauges"] = {}
+            snaps.append(snap)
+        return snaps
+
+    # --- exposition ---
+    def render(self):
+        """Prometheus text format for this process, or all workers with a spool directory."""
+        snaps = self._snapshots()
+        requests, nbytes, limited = defaultdict(int), defaultdict(int), defaultdict(int)
+        dropped, handshakes = defaultdict(int), defaultdict(int)
+        handshake_time = {k: [[0] * (len(BUCKETS) + 1), 0.0] for k in HANDSHAKES}
+        gauges = defaultdict(float)
+        duration = [[0] * (len(BUCKETS) + 1), 0.0]
+        phases = {p: [[0] * (len(BUCKETS) + 1), 0.0] for p in PHASES}
+        connections = 0
+        for snap in snaps:
+            for code, path, n in snap["requests"]:
+                requests[code, path] += n
+            for code, n in snap["bytes"].items():
+                nbytes[code] += n
+            for limiter, rule, n in snap["limited"]:
+                limited[limiter, rule] += n
+            for reason, n in snap["dropped"].items():
+                dropped[reason] += n
+            for kind, n in snap["handshakes"].items():
+                handshakes[kind] += n
+            for kind, h in snap["handshake_time"].items():
+                merge(handshake_time[kind], h)
+            merge(duration, snap["duration"])
+            for p, h in snap["phases"].items():
+                merge(phases[p], h)
+            connections += snap["connections"]
+            for name, value in snap["gauges"].items():
+                gauges[name] += value
+
+        out = []
+        family(out, "http_requests_total", "counter", "Responses by status code and path.")
+        for (code, path), n in sorted(requests.items()):
+            out.append(f'http_requests_total{{code="{code}",path="{escape(path)}"}} {n}')
+        family(out, "http_response_bytes_total", "counter", "Bytes sent, by status code.")
+        for code, n in sorted(nbytes.items()):
+            out.append(f'http_response_bytes_total{{code="{code}"}} {n}')
+        family(out, "http_request_duration_seconds", "histogram", "Time from parsed request to last byte sent.")
+        histogram(out, "http_request_duration_seconds", "", duration)
+        family(out, "http_request_phase_seconds", "histogram", "Time spent in each phase of a request.")
+        for p in PHASES:
+            histogram(out, "http_request_phase_seconds", f'phase="{p}"', phases[p])
+        family(out, "http_rate_limited_total", "counter", "Requests answered 429, by limiter and rule.")
+        for (limiter, rule), n in sorted(limited.items()):
+            out.append(f'http_rate_limited_total{{limiter="{limiter}",rule="{escape(rule)}"}} {n}')
+        family(out, "http_connections_total", "counter", "Connections accepted.")
+        out.append(f"http_connections_total {connections}")
+        family(out, "http_connections_dropped_total", "counter",
+               "Connections refused at accept or cut off for being too slow or malformed, by reason.")
+        for reason, n in sorted(dropped.items()):
+            out.append(f'http_connections_dropped_total{{reason="{reason}"}} {n}')
+        if handshakes:
+            family(out, "http_tls_handshakes_total", "counter", "TLS handshakes: full, resumed or failed.")
+            for kind, n in sorted(handshakes.items()):
+                out.append(f'http_tls_handshakes_total{{kind="{kind}"}} {n}')
+            family(out, "http_tls_handshake_seconds", "histogram", "Server-side TLS handshake time.")
+            for kind in HANDSHAKES:
+                histogram(out, "http_tls_handshake_seconds", f'kind="{kind}"', handshake_time[kind])
+        family(out, "http_workers", "gauge", "Worker processes reporting.")
+        out.append(f"http_workers {sum(1 for s in snaps if s['gauges'])}")
+        helps = {name: help for name, (help, _) in self.gauges.items()}
+        helps["http_connections_active"] = "Connections currently open."
+        for name, value in sorted(gauges.items()):
+            family(out, name, "gauge", helps.get(name, ""))
+            out.append(f"{name} {value:g}")
+        return "\n".join(out) + "\n"
+
+
+def merge(into, hist):
+    counts, total = hist
+    for i, n in enumerate(counts):
+        into[0][i] += n
+    into[1] += total
+
+
+def family(out, name, kind, help):
+    out.append(f"# HELP {name} {help}")
+    out.append(f"# TYPE {name} {kind}")
+
+
+def histogram(out, name, labels, hist):
+    counts, total = hist
+    sep = "," if labels else ""
+    cumulative = 0
+    for bound, n in zip(BUCKETS, counts):
+        cumulative += n
+        out.append(f'{name}_bucket{{{labels}{sep}le="{bound:g}"}} {cumulative}')
+    cumulative += counts[-1]
+    out.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {cumulative}')
+    suffix = f"{{{labels}}}" if labels else ""
+    out.append(f"{name}_sum{suffix} {total:.6f}")
+    out.append(f"{name}_count{suffix} {cumulative}")
+
+
+def escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
@@ -0,0 +1,89 @@
+# mmap_pool.py
+# Read-only memory maps of mid-sized files, shared by every thread (--mmap-mb).
+# A file between min_size and max_size is mapped once and every response
+# sends straight from the mapping: a memoryview handed to sendmsg() next to
+# the response head, so neither a read() into a new bytes object nor a
+# concatenation happens per hit. The pages are the page cache's own, so
+# pre-forked workers share one copy too, where heap bodies would be one copy
+# per process. Smaller files stay as bytes in the file cache (one send);
+# bigger ones keep streaming with sendfile().
+#
+# A mapping is keyed by path and remembers the inode, size and mtime it was
+# made from; a request whose cache entry disagrees gets a fresh mapping. The
+# pool holds at most max_bytes of mappings and drops the least recently used
+# one beyond that. Dropping is not closing: a mapping in the middle of being
+# sent stays valid until its last memoryview goes away.
+#
+# Caveat: a file that is truncated in place while mapped raises SIGBUS on
+# access. Replacing files by rename (what editors and deploy tools do) is
+# safe, since the old inode stays mapped.
+import mmap, os, threading
+from collections import OrderedDict
+
+
+class Mapping:
+    __slots__ = ("view", "ino", "size", "mtime_ns")
+
+    def __init__(self, view, st):
+        self.view = view            # memoryview of the whole mmap
+        self.ino = st.st_ino
+        self.size = st.st_size
+        self.mtime_ns = st.st_mtime_ns
+
+
+class MmapPool:
+    def __init__(self, max_bytes=256 * 2**20, min_size=64 * 1024, max_size=None):
+        self.max_bytes = max_bytes
+        self.min_size = min_size
+        self.max_size = max_size if max_size is not None else max_bytes // 8
+        self.maps = OrderedDict()           # path -> Mapping, least recently used first
+        self.lock = threading.Lock()
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def fits(self, size):
+        return self.min_size < size <= self.max_size
+
+    def get(self, entry):
+        """memoryview of entry's file (a file cache entry), or None if it cannot be mapped."""
+        with self.lock:
+            m = self.maps.get(entry.path)
+            if m is not None:
+                if m.ino == entry.ino and m.size == entry.size and m.mtime_ns == entry.mtime_ns:
+                    self.maps.move_to_end(entry.path)
+                    self.hits += 1
+                    return m.view
+                self.invalidations += 1
+                self._drop(entry.path)
+            self.misses += 1
+        try:
+            with open(entry.path, "rb") as f:
+                st = os.fstat(f.fileno())
+                if (st.st_ino, st.st_size, st.st_mtime_ns) != (entry.ino, entry.size, entry.mtime_ns):
+                    return None     # changed since the entry was made: let the caller stream it
+                # the mapping outlives the descriptor
+                view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        except (OSError, ValueError):
+            return None
+        with self.lock:
+            if entry.path in self.maps:
+                self._drop(entry.path)      # another thread mapped it meanwhile
+            self.maps[entry.path] = Mapping(view, st)
+            self.used += st.st_size
+            while self.used > self.max_bytes:
+                self._drop(next(iter(self.maps)))
+                self.evictions += 1
+        return view
+
+    def _drop(self, path):
+        # no close(): in-flight sends may still hold slices; the unmap follows the last reference
+        self.used -= self.maps.pop(path).size
+
+    def describe(self):
+        with self.lock:
+            return (f"maps={len(self.maps)} {self.used / 2**20:.1f}/{self.max_bytes / 2**20:.0f}MiB "
+                    f"hits={self.hits} misses={self.misses} evictions={self.evictions} "
+                    f"invalidations={self.invalidations}")
@@ -0,0 +1,89 @@
+# precompress.py
+# Writes kernel.html.gz (and kernel.html.br when the brotli module is
+# installed) next to every compressible file under a directory, at the highest
+# level, so the servers can send them with Content-Encoding and no per-request
+# CPU. A sibling gets the source's mtime; editing the source makes it stale and
+# the servers ignore it until this is run again. Siblings that would not save
+# at least 10% are not written.
+#
+#   python precompress.py <directory> [--min-size 256] [--force]
+import gzip, os, sys
+
+from encoding import SUFFIXES, brotli, compressible, content_type
+
+def arg(name, default, cast=int):
+    return cast(sys.argv[sys.argv.index(name) + 1]) if name in sys.argv else default
+
+min_size = arg("--min-size", 256)   # tiny files gain nothing but still cost a stat
+force = "--force" in sys.argv
+
+
+def compress(data, coding):
+    if coding == "br":
+        return brotli.compress(data, quality=11)
+    return gzip.compress(data, 9, mtime=0)
+
+
+def precompress(path, st):
+    """Write the siblings of one file; returns (bytes in, bytes out) for what was written."""
+    data = None
+    saved_in = saved_out = 0
+    for coding, suffix in SUFFIXES.items():
+        if coding == "br" and brotli is None:
+            continue
+        target = path + suffix
+        try:
+            if not force and os.stat(target).st_mtime_ns == st.st_mtime_ns:
+                continue        # already up to date
+        except FileNotFoundError:
+            pass
+        if data is None:
+            with open(path, "rb") as f:
+                data = f.read()
+        out = compress(data, coding)
+        if len(out) > len(data) * 0.9:
+            if os.path.exists(target):
+                os.remove(target)
+            continue
+        tmp = target + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(out)
+        os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(tmp, target)
+        saved_in += len(data)
+        saved_out += len(out)
+    return saved_in, saved_out
+
+
+def main():
+    if len(sys.argv) < 2 or not os.path.isdir(sys.argv[1]):
+        print("Usage: python precompress.py <directory> [--min-size BYTES] [--force]")
+        sys.exit(1)
+    if brotli is None:
+        print("brotli module not installed: writing .gz files only")
+
+    files = total_in = total_out = 0
+    for dirpath, _, names in os.walk(sys.argv[1]):
+        for name in names:
+            if name.endswith(tuple(SUFFIXES.values())) or name.endswith(".tmp"):
+                continue
+            ctype = content_type(name)
+            path = os.path.join(dirpath, name)
+            st = os.stat(path)
+            if not compressible(ctype) or st.st_size < min_size:
+                continue
+            n_in, n_out = precompress(path, st)
+            if n_in:
+                files += 1
+                total_in += n_in
+                total_out += n_out
+                print(f"{path}: {n_in} -> {n_out} bytes")
+
+    if files:
+        print(f"{files} files, {total_in} -> {total_out} bytes ({total_out / total_in:.1%})")
+    else:
+        print("nothing to do")
+
+
+if __name__ == "__main__":
+    main()
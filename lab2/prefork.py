@@ -0,0 +1,75 @@
+# prefork.py
+# Pre-fork helpers: every worker process binds its own listening socket with
+# SO_REUSEPORT (the kernel spreads connections across them) and a small
+# supervisor in the parent restarts workers that die.
+import os, signal, socket, sys, time, traceback
+
+
+def bind_listener(port, backlog, reuse_port=False, host="0.0.0.0"):
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    s.bind((host, port))
+    s.listen(backlog)
+    return s
+
+
+def run_workers(n, target, label="supervisor"):
+    """
+    Fork n processes running target() and keep n alive until SIGINT/SIGTERM.
+    A worker that crashes right after starting is restarted with a short delay
+    so a broken config does not turn into a fork loop.
+    """
+    children = {}       # pid -> (worker index, start time)
+    stopping = False
+
+    def spawn(i):
+        pid = os.fork()
+        if pid == 0:
+            # the parent decides when workers stop; Ctrl-C goes to it
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            code = 0
+            try:
+                target()
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdout.flush()
+                os._exit(code)
+        children[pid] = (i, time.monotonic())
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    for i in range(n):
+        spawn(i)
+    print(f"[{label}] started {n} workers: {sorted(children)}", flush=True)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except KeyboardInterrupt:
+            stop()
+            continue
+        except ChildProcessError:
+            break
+        i, started = children.pop(pid)
+        if stopping:
+            continue
+        code = os.waitstatus_to_exitcode(status)
+        print(f"[{label}] worker {i} (pid {pid}) exited with code {code}, restarting",
+              flush=True)
+        if time.monotonic() - started < 1.0:
+            time.sleep(1.0)
+        spawn(i)
+    print(f"[{label}] all workers stopped", flush=True)
@@ -0,0 +1,125 @@
+# rate_limiter.py
+# Per-client rate limiting.
+#
+# SlidingWindowLimiter is the original design: a deque of request timestamps
+# per IP behind one lock. Memory grows with limit x number of IPs and IPs are
+# never forgotten.
+#
+# GCRALimiter implements the generic cell rate algorithm (a token bucket
+# expressed as a single "theoretical arrival time" per key): `limit` requests
+# per `window` seconds, with bursts of up to `limit`. Keys are spread over
+# striped locks, and a key whose TAT is in the past holds no information (its
+# bucket is full again), so a background sweep deletes it.
+#
+# Policy decides which limit applies: per-client overrides first, then the
+# longest matching path prefix, then the default. A limit of 0 means
+# "unlimited". Requests under different path rules use separate buckets.
+import threading, time
+from collections import defaultdict, deque
+
+
+class Policy:
+    def __init__(self, limit=10, window=1.0, path_limits=None, client_limits=None):
+        self.limit = limit
+        self.window = window
+        # longest prefix first, so the first match is the most specific one
+        self.path_limits = sorted((path_limits or {}).items(), key=lambda kv: -len(kv[0]))
+        self.client_limits = client_limits or {}
+
+    def rule(self, ip, path):
+        """(bucket key, limit) for this request; limit 0 means no limiting."""
+        if ip in self.client_limits:
+            return ip, self.client_limits[ip]
+        for prefix, limit in self.path_limits:
+            if path.startswith(prefix):
+                return f"{ip} {prefix}", limit
+        return ip, self.limit
+
+    def rule_name(self, ip, path):
+        """Which rule rule() applies, for metrics: "client", the path prefix or "default"."""
+        if ip in self.client_limits:
+            return "client"
+        for prefix, _ in self.path_limits:
+            if path.startswith(prefix):
+                return prefix
+        return "default"
+
+
+def gcra(tat, now, interval, tolerance):
+    """One GCRA step. Returns (allowed, new theoretical arrival time)."""
+    tat = max(tat, now)
+    if tat - now > tolerance:
+        return False, tat
+    return True, tat + interval
+
+
+class GCRALimiter:
+    def __init__(self, policy, stripes=64, evict_interval=5.0):
+        self.policy = policy
+        self.stripes = [(threading.Lock(), {}) for _ in range(stripes)]
+        self.evicted = 0
+        if evict_interval:
+            threading.Thread(target=self._evict_loop, args=(evict_interval,),
+                             name="ratelimit-evict", daemon=True).start()
+
+    def too_many_requests(self, ip, path="/"):
+        """True if this request should be rejected (429); otherwise it is counted."""
+        key, limit = self.policy.rule(ip, path)
+        if not limit:
+            return False
+        interval = self.policy.window / limit
+        tolerance = interval * (limit - 1)
+        now = time.monotonic()
+        lock, tats = self.stripes[hash(key) % len(self.stripes)]
+        with lock:
+            allowed, tat = gcra(tats.get(key, now), now, interval, tolerance)
+            if allowed:
+                tats[key] = tat
+        return not allowed
+
+    def evict_idle(self):
+        """Forget keys whose bucket has refilled completely."""
+        now = time.monotonic()
+        removed = 0
+        for lock, tats in self.stripes:
+            with lock:
+                idle = [k for k, tat in tats.items() if tat <= now]
+                for k in idle:
+                    del tats[k]
+            removed += len(idle)
+        self.evicted += removed
+        return removed
+
+    def _evict_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            self.evict_idle()
+
+    def __len__(self):
+        return sum(len(tats) for _, tats in self.stripes)
+
+
+class SlidingWindowLimiter:
+    """The original deque-per-IP limiter, kept for comparison (--limiter window)."""
+    def __init__(self, policy):
+        self.policy = policy
+        self.lock = threading.Lock()
+        self.requests = defaultdict(deque)
+
+    def too_many_requests(self, ip, path="/"):
+        key, limit = self.policy.rule(ip, path)
+        if not limit:
+            return False
+        now = time.time()
+        with self.lock:
+            dq = self.requests[key]
+            # drop old timestamps
+            while dq and now - dq[0] > self.policy.window:
+                dq.popleft()
+            if len(dq) >= limit:
+                return True
+            dq.append(now)
+            return False
+
+    def __len__(self):
+        return len(self.requests)
@@ -1,114 +1,406 @@
 # server_single.py
-import os, sys, socket, urllib.parse, mimetypes, time
-from datetime import datetime
+import os, sys, socket, ssl, urllib.parse, shutil, tempfile, time
 from pathlib import Path
 from collections import defaultdict
 
+import prefork, tls
+from access_log import AccessLog, MeteredSocket
+from byteranges import Partial, requested_ranges, unsatisfiable_headers
+from conn_guard import OFFENCES, ConnectionGuard
+from connection import serve_connection
+from encoding import Encoder, compressible, content_type
+from file_cache import CacheEntry, FileCache
+from listing_cache import ListingCache, page_bounds, page_param
+from metrics import Metrics, Timer
+from mmap_pool import MmapPool
+from filesend import FileResponse, StreamResponse, write_response
+from headers import HeadBuilder
+from shared_state import SharedHitCounter
+from static_index import StaticIndex
+from work import Work
+from validators import CachePolicy, not_modified, validator_headers
+
 # --- Settings from command line ---
 if len(sys.argv) < 2:
-    print("Usage: python server_single.py <directory> [--port PORT]")
+    print("Usage: python server_single.py <directory> [--port PORT] [--workers N] [--keepalive-timeout SEC] [--header-timeout SEC] [--read-timeout SEC] [--write-timeout SEC] [--ban-strikes N] [--cache-control TYPE=VALUE ...] [--access-log PATH] [--log-format text|json] [--metrics-path /metrics] [--static-index [--index-poll SEC]] [--mmap-mb MB] [--work sleep|cpu|io|none|MIX] [--work-time SEC] [--work-dist fixed|uniform|exp|lognormal] [--cpu-procs N] [--tls-cert PEM [--tls-key PEM] | --tls-self-signed] [--tls-tickets N]")
     sys.exit(1)
 
 root = Path(sys.argv[1]).resolve()
 port = int(sys.argv[sys.argv.index("--port") + 1]) if "--port" in sys.argv else 8080
+workers = int(sys.argv[sys.argv.index("--workers") + 1]) if "--workers" in sys.argv else 1
+# one connection at a time: an idle kept-alive client is let go as soon as
+# another connects (serve_connection's yield_to), and after this long otherwise
+keepalive_timeout = float(sys.argv[sys.argv.index("--keepalive-timeout") + 1]) if "--keepalive-timeout" in sys.argv else 1.0
+max_requests = 100
+# ...and the same goes for a client that sends its request (or reads our answer) slowly
+header_timeout = float(sys.argv[sys.argv.index("--header-timeout") + 1]) if "--header-timeout" in sys.argv else 2.0
+read_timeout = float(sys.argv[sys.argv.index("--read-timeout") + 1]) if "--read-timeout" in sys.argv else 1.0
+write_timeout = float(sys.argv[sys.argv.index("--write-timeout") + 1]) if "--write-timeout" in sys.argv else 5.0
+# clients whose connections keep ending that way are refused on accept for a minute
+ban_strikes = int(sys.argv[sys.argv.index("--ban-strikes") + 1]) if "--ban-strikes" in sys.argv else 5
+cache_mb = float(sys.argv[sys.argv.index("--cache-mb") + 1]) if "--cache-mb" in sys.argv else 64
+# mid-sized files (over 64 KiB) sent from shared read-only mappings, this many MB of them (0: off)
+mmap_mb = float(sys.argv[sys.argv.index("--mmap-mb") + 1]) if "--mmap-mb" in sys.argv else 0
+compress_mb = float(sys.argv[sys.argv.index("--compress-cache-mb") + 1]) if "--compress-cache-mb" in sys.argv else 16
+page_size = int(sys.argv[sys.argv.index("--page-size") + 1]) if "--page-size" in sys.argv else 1000
+access_log_path = sys.argv[sys.argv.index("--access-log") + 1] if "--access-log" in sys.argv else None
+log_format = sys.argv[sys.argv.index("--log-format") + 1] if "--log-format" in sys.argv else "text"
+metrics_path = sys.argv[sys.argv.index("--metrics-path") + 1] if "--metrics-path" in sys.argv else "/metrics"
+# simulated work per request (by default the original 1 s sleep); see work.py
+work_spec = sys.argv[sys.argv.index("--work") + 1] if "--work" in sys.argv else "sleep"
+work_time = float(sys.argv[sys.argv.index("--work-time") + 1]) if "--work-time" in sys.argv else 1.0
+work_dist = sys.argv[sys.argv.index("--work-dist") + 1] if "--work-dist" in sys.argv else "fixed"
+# one request at a time, so a CPU pool only moves the spinning out of this process (0: spin here)
+cpu_procs = int(sys.argv[sys.argv.index("--cpu-procs") + 1]) if "--cpu-procs" in sys.argv else 1
+# HTTPS (see tls.py): one context, made before --workers forks so that every worker shares its ticket keys
+tls_cert = sys.argv[sys.argv.index("--tls-cert") + 1] if "--tls-cert" in sys.argv else None
+tls_key = sys.argv[sys.argv.index("--tls-key") + 1] if "--tls-key" in sys.argv else None
+tls_tickets = int(sys.argv[sys.argv.index("--tls-tickets") + 1]) if "--tls-tickets" in sys.argv else 2
+if "--tls-self-signed" in sys.argv:
+    tls_cert, tls_key = tls.self_signed()
+tls_context = tls.server_context(tls_cert, tls_key, tls_tickets) if tls_cert else None
 mime_whitelist = {"text/html", "image/png", "application/pdf"}
+# Cache-Control per MIME type: --cache-control "TYPE=VALUE" (repeatable)
+cache_policy = CachePolicy.parse(v for a, v in zip(sys.argv, sys.argv[1:]) if a == "--cache-control")
 
 # --- Request counter (NAIVE: no locking needed yet, we're single-threaded) ---
 hit_count = defaultdict(int)
+# ...unless we pre-fork: then every worker process must see the same counts
+shared_hits = SharedHitCounter() if workers > 1 else None
+
+def count_hit(key):
+    if shared_hits:
+        shared_hits.incr(key)
+    else:
+        hit_count[key] += 1
+
+def hits_for_many(keys):
+    return shared_hits.get_many(keys) if shared_hits else [hit_count.get(k, 0) for k in keys]
+
+work = Work(work_spec, work_time, work_dist, cpu_procs)
+
+# --- Offenders: one connection at a time, so only bans apply (no connection caps) ---
+guard = ConnectionGuard(strikes=ban_strikes, ban_seconds=60.0)
+
+# --- Hot-file cache: small files stay in memory with their headers prebuilt ---
+file_cache = FileCache(int(cache_mb * 2**20)) if cache_mb > 0 else None
+# sorted directory contents, rescanned only when a directory's mtime changes
+dir_listings = ListingCache()
+# read-only mmaps of mid-sized files (with --workers, one page-cache copy for all of them)
+mmaps = MmapPool(int(mmap_mb * 2**20)) if mmap_mb > 0 else None
+# --static-index: every URL path under the root resolved up front, refreshed when a directory changes
+static_index = StaticIndex(root) if "--static-index" in sys.argv else None
+index_poll = float(sys.argv[sys.argv.index("--index-poll") + 1]) if "--index-poll" in sys.argv else 2.0
 
 # --- Helpers ---
-def response(status, body="", ctype="text/html"):
+def header_block(length, ctype="text/html", extra_headers=()):
+    lines = [f"Content-Type: {ctype}", f"Content-Length: {length}", *extra_headers]
+    return "".join(f"{line}\r\n" for line in lines).encode()
+
+# prebuilt status lines, Date line and connection headers
+heads = HeadBuilder(keepalive_timeout, max_requests)
+finish_head = heads.head
+
+def response_head(status, length, ctype="text/html", keep_alive=False):
+    return finish_head(status, header_block(length, ctype), keep_alive)
+
+def response(status, body="", ctype="text/html", keep_alive=False):
     body_bytes = body.encode() if isinstance(body, str) else body
-    headers = [
-        f"HTTP/1.1 {status}",
-        f"Date: {datetime.utcnow():%a, %d %b %Y %H:%M:%S GMT}",
-        f"Content-Type: {ctype}",
-        f"Content-Length: {len(body_bytes)}",
-        "Connection: close",
-        "", "",
-    ]
-    return "\r\n".join(headers).encode() + body_bytes
-
-def not_found():
-    return response("404 Not Found", "<h1>404 Not Found</h1>")
-
-def listing(path):
-    # build a table like the screenshot, including hit counts
+    return response_head(status, len(body_bytes), ctype, keep_alive) + body_bytes
+
+# gzip/br variants of text files: precompressed siblings or compressed once here
+encoder = Encoder(header_block, int(compress_mb * 2**20)) if compress_mb > 0 else None
+
+def not_found(keep_alive=False):
+    return response("404 Not Found", "<h1>404 Not Found</h1>", keep_alive=keep_alive)
+
+LISTING_BATCH = 256     # listing rows rendered (and hit counts fetched) per chunk
+
+def listing(path, keep_alive=False, page=1, method="GET", chunked=True):
+    """
+    Directory page as a StreamResponse: rows are rendered LISTING_BATCH at a
+    time while it is sent, in writes of filesend.STREAM_BUFFER (a small page
+    leaves in one write, head and terminator included).
+    chunked=False (HTTP/1.0 clients) sends it unframed and closes after it.
+    """
+    block = b"Content-Type: text/html\r\n" + (b"Transfer-Encoding: chunked\r\n" if chunked else b"")
+    head = finish_head("200 OK", block, keep_alive and chunked)
+    if method == "HEAD":
+        return head
+    return StreamResponse(head, listing_body(path, page), chunked)
+
+def listing_body(path, page):
     rel = str(path.relative_to(root)) if path != root else "/"
-    rows = []
-    for entry in sorted(path.iterdir()):
-        name = entry.name + ("/" if entry.is_dir() else "")
-        href = urllib.parse.quote(name)
-        count = hit_count[str(entry.resolve())]
-        rows.append(
-            f'<tr><td><a href="{href}">{name}</a></td><td>{count}</td></tr>'
-        )
-
-    html = (
+    yield (
         "<html><head><title>Directory listing</title></head><body>"
         f"<h1>Directory listing for {rel}</h1>"
         '<table border="1" cellpadding="4" cellspacing="0">'
-        "<tr><th>File / Directory</th><th>Hits</th></tr>"
-        + "\n".join(rows) +
-        "</table></body></html>"
-    )
-    return response("200 OK", html)
-
-def log(addr, method, path, status):
-    now = datetime.now().strftime("%H:%M:%S")
-    print(f"[{now}] {addr[0]} {method} {path} {status}", flush=True)
-
-# --- Server loop (single-threaded) ---
-with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-    s.bind(("0.0.0.0", port))
-    s.listen(1)
-    print(f"[single] Serving {root} on port {port}", flush=True)
-    while True:
-        conn, addr = s.accept()
-        with conn:
-            req = conn.recv(1024).decode(errors="ignore")
-            if not req:
-                continue
-            line = req.split("\r\n")[0]
-            parts = line.split()
-            if len(parts) < 2:
-                conn.sendall(response("400 Bad Request", "<h1>400 Bad Request</h1>"))
-                log(addr, "?", "?", "400 Bad Request")
-                continue
+        "<tr><th>File / Directory</th><th>Hits</th></tr>\n"
+    ).encode()
 
-            method, raw_path = parts[0], parts[1]
-            path = urllib.parse.unquote(raw_path)
+    entries = dir_listings.get(str(path))
+    start, end, page, pages = page_bounds(len(entries), page, page_size)
+    for batch in range(start, end, LISTING_BATCH):
+        shown = entries[batch:min(batch + LISTING_BATCH, end)]
+        # one lock round-trip per batch of rows
+        counts = hits_for_many([key for _, _, key in shown])
+        rows = []
+        for (name, is_dir, _), count in zip(shown, counts):
+            name += "/" if is_dir else ""
+            href = urllib.parse.quote(name)
+            rows.append(
+                f'<tr><td><a href="{href}">{name}</a></td><td>{count}</td></tr>\n'
+            )
+        yield "".join(rows).encode()
 
-            # artificial work delay (~1s) for benchmarking
-            time.sleep(1.0)
+    nav = ""
+    if pages > 1:
+        prev = f'<a href="?page={page - 1}">&laquo; prev</a> ' if page > 1 else ""
+        nxt = f' <a href="?page={page + 1}">next &raquo;</a>' if page < pages else ""
+        nav = f"<p>{prev}entries {start + 1}-{end} of {len(entries)} (page {page}/{pages}){nxt}</p>"
+    yield ("</table>" + nav + "</body></html>").encode()
 
-            if method not in ("GET", "HEAD"):
-                conn.sendall(response("405 Method Not Allowed", "<h1>405</h1>"))
-                log(addr, method, path, "405 Method Not Allowed")
-                continue
+# access log: lines are queued and written in batches by a background thread
+access_log = AccessLog(access_log_path, log_format)
+
+# counts and per-phase latency for /metrics (spooled to a shared directory with --workers)
+metrics = Metrics(tempfile.mkdtemp(prefix="metrics-") if workers > 1 else None)
+
+def log(addr, method, path, status, sent=0, started=None, timer=None):
+    latency = time.monotonic() - started if started else None
+    access_log.log(addr[0], method, path, status, sent, latency)
+    metrics.observe(status, path, sent, latency, timer)
+
+def resolve(key, path):
+    """(resolved path or None if outside the root, "dir" | "file" | None, content type)."""
+    if static_index:
+        # --static-index: a dict lookup, no filesystem calls
+        found = static_index.lookup(path)
+        if found is None:
+            return None, None, None
+        return found.path, "dir" if found.is_dir else "file", found.ctype
+    fs_path = Path(key).resolve()
+    if not str(fs_path).startswith(str(root)):
+        return None, None, None
+    if fs_path.is_dir():
+        return str(fs_path), "dir", None
+    if fs_path.is_file():
+        return str(fs_path), "file", content_type(fs_path.name)
+    return str(fs_path), None, None
+
+# --- Request handling (one connection at a time) ---
+def handle_request(conn, addr, req, keep_alive):
+    started = time.monotonic()
+    conn.sent = 0       # conn is a MeteredSocket: bytes of this response only
+    timer = Timer(req.parse_time)
+    target, _, query = req.target.partition("?")
+    method, path = req.method, urllib.parse.unquote(target)
+
+    if metrics_path and path == metrics_path:
+        conn.sendall(response("200 OK", metrics.render(), "text/plain; version=0.0.4", keep_alive))
+        log(addr, method, path, "200 OK (metrics)", conn.sent, started)
+        return
+
+    # simulated work (--work) for benchmarking; blocks the whole server here
+    work.run()
+    timer.mark("work")
+
+    if method not in ("GET", "HEAD"):
+        conn.sendall(response("405 Method Not Allowed", "<h1>405</h1>", keep_alive=keep_alive))
+        log(addr, method, path, "405 Method Not Allowed", conn.sent, started)
+        return
+
+    # cached files only need a stat() to check they are unchanged
+    key = os.path.join(str(root), path.lstrip("/"))
+    entry = file_cache.get(key) if file_cache else None
+    if entry is not None:
+        count_hit(entry.path)
+        timer.mark("resolve")
+        status = send_file_entry(conn, method, entry, None, keep_alive, req.headers, timer)
+        log(addr, method, path, status + " (cached)", conn.sent, started, timer)
+        return
+
+    fs_path, kind, ctype = resolve(key, path)
+    if fs_path is None:
+        conn.sendall(not_found(keep_alive))
+        log(addr, method, path, "404 Not Found", conn.sent, started)
+        return
+
+    # count hits (safe because single-threaded, shared memory with --workers)
+    count_hit(fs_path)
+
+    if kind == "dir":
+        timer.mark("resolve")
+        page = listing(Path(fs_path), keep_alive, page_param(query), method, req.version == "HTTP/1.1")
+        timer.mark("read")
+        # the rows are generated while they are sent
+        write_response(conn, page)
+        timer.mark("send")
+        log(addr, method, path, "200 OK (directory)", conn.sent, started, timer)
+        if isinstance(page, StreamResponse) and not page.chunked:
+            return False    # HTTP/1.0: the body ends when the connection does
+    elif kind == "file":
+        if ctype not in mime_whitelist:
+            conn.sendall(not_found(keep_alive))
+            log(addr, method, path, "404 Not Found (unsupported type)", conn.sent, started)
+            return
+        try:
+            f = open(fs_path, "rb")
+        except FileNotFoundError:
+            # deleted since the static index was built
+            conn.sendall(not_found(keep_alive))
+            log(addr, method, path, "404 Not Found", conn.sent, started)
+            return
+        st = os.fstat(f.fileno())
+        timer.mark("resolve")
+        keep = file_cache and file_cache.keep_body(st.st_size) and not (mmaps and mmaps.fits(st.st_size))
+        body = f.read() if keep else None
+        validators = validator_headers(st, ctype, cache_policy)
+        if compressible(ctype):
+            validators.append("Vary: Accept-Encoding")
+        entry = CacheEntry(fs_path, st, ctype,
+                           header_block(st.st_size, ctype, [*validators, "Accept-Ranges: bytes"]), body,
+                           "".join(f"{h}\r\n" for h in validators).encode())
+        if file_cache:
+            file_cache.put(key, entry)
+        status = send_file_entry(conn, method, entry, f, keep_alive, req.headers, timer)
+        log(addr, method, path, status, conn.sent, started, timer)
+    else:
+        conn.sendall(not_found(keep_alive))
+        log(addr, method, path, "404 Not Found", conn.sent, started)
+
+def send_file_entry(conn, method, entry, f, keep_alive, headers, timer):
+    """Send a file (or a 304 if the client's copy is current); returns the status."""
+    variant = encoder.negotiate(entry, headers.get("accept-encoding")) if encoder else None
+    timer.mark("read")
+    if variant is not None:
+        # the gzip/br body replaces the file; ranges of it are not offered
+        if f:
+            f.close()
+        entry, f = variant, None
+    if not_modified(headers, entry.etag, entry.mtime_ns):
+        if f:
+            f.close()
+        conn.sendall(finish_head("304 Not Modified", entry.validators, keep_alive))
+        timer.mark("send")
+        return "304 Not Modified"
+    # Range is only defined for GET; HEAD always describes the whole file
+    ranges = None
+    if method == "GET" and entry.coding is None:
+        ranges = requested_ranges(headers, entry.etag, entry.mtime_ns, entry.size)
+    if ranges is not None:
+        status = send_ranges(conn, entry, f, keep_alive, ranges)
+        timer.mark("send")
+        return status
+    head = finish_head("200 OK", entry.headers, keep_alive)
+    if method == "HEAD" or entry.body is not None:
+        if f:
+            f.close()
+        # head and cached body in one sendmsg(), without joining them first
+        write_response(conn, head if method == "HEAD" else [head, entry.body])
+    elif (view := mapped(entry)) is not None:
+        # mid-sized files: head and mapping gathered into one sendmsg()
+        if f:
+            f.close()
+        write_response(conn, [head, view])
+    else:
+        # big files are streamed from disk instead of read into memory
+        write_response(conn, FileResponse(head, f or open(entry.path, "rb")))
+    timer.mark("send")
+    return f"200 OK ({entry.coding})" if entry.coding else "200 OK"
+
+def send_ranges(conn, entry, f, keep_alive, ranges):
+    """206 with the requested byte ranges, or 416 if none exist; returns the status."""
+    if not ranges:
+        if f:
+            f.close()
+        block = header_block(0, extra_headers=unsatisfiable_headers(entry.size))
+        conn.sendall(finish_head("416 Range Not Satisfiable", block, keep_alive))
+        return "416 Range Not Satisfiable"
+    part = Partial(ranges, entry.size, entry.ctype)
+    head = finish_head("206 Partial Content",
+                       header_block(part.length, part.ctype, part.headers) + entry.validators, keep_alive)
+    if entry.body is not None:
+        if f:
+            f.close()
+        write_response(conn, [head, *part.buffers(memoryview(entry.body))])
+    elif (view := mapped(entry)) is not None:
+        if f:
+            f.close()
+        write_response(conn, [head, *part.buffers(view)])
+    else:
+        write_response(conn, FileResponse(head, f or open(entry.path, "rb"), parts=part.parts, tail=part.tail))
+    return "206 Partial Content"
+
+def mapped(entry):
+    """memoryview of a mid-sized file from the mmap pool (--mmap-mb), or None."""
+    if mmaps and entry.body is None and mmaps.fits(entry.size):
+        return mmaps.get(entry)
+    return None
+
+def start_tls(conn):
+    """TLS handshake, bounded by the header timeout like a request (everyone else waits meanwhile)."""
+    try:
+        conn, seconds = tls.handshake(tls_context, conn, header_timeout)
+    except OSError:
+        metrics.tls_handshake("failed")
+        raise
+    metrics.tls_handshake("resumed" if conn.session_reused else "full", seconds)
+    return conn
+
+def handle_client(conn, addr, listener=None):
+    def on_bad_request(err):
+        conn.sent = 0
+        conn.sendall(response("400 Bad Request", "<h1>400 Bad Request</h1>"))
+        log(addr, "?", "?", "400 Bad Request", conn.sent)
+
+    metrics.opened()
+    ended = "closed"
+    try:
+        if tls_context:
+            conn = start_tls(conn)
+        conn = MeteredSocket(conn)
+        with conn:
+            ended = serve_connection(
+                conn, lambda req, keep: handle_request(conn, addr, req, keep),
+                on_bad_request, keepalive_timeout, max_requests,
+                header_timeout=header_timeout, read_timeout=read_timeout, write_timeout=write_timeout,
+                yield_to=listener,
+            )
+    except socket.timeout:
+        ended = "header_timeout"    # stalled in the TLS handshake
+    except (ConnectionError, ssl.SSLError):
+        pass
+    finally:
+        metrics.closed()
+        if ended in OFFENCES:
+            metrics.connection_dropped(ended)
+        if guard.release(addr[0], ended):
+            print(f"[guard] {addr[0]} banned for 60s (last: {ended})", flush=True)
 
-            fs_path = (root / path.lstrip("/")).resolve()
-            if not str(fs_path).startswith(str(root)):
-                conn.sendall(not_found())
-                log(addr, method, path, "404 Not Found")
+# --- Server loop (single-threaded; --workers N runs N copies of it) ---
+def serve():
+    work.start()
+    access_log.start()
+    if file_cache:
+        metrics.file_cache(file_cache)
+    if metrics.spool_dir:
+        metrics.spool_every(1.0)
+    if static_index:
+        static_index.watch(index_poll)
+    with prefork.bind_listener(port, 1, reuse_port=workers > 1) as s:
+        print(f"[single] Serving {root} on port {port}{' (https)' if tls_context else ''}", flush=True)
+        while True:
+            conn, addr = s.accept()
+            if guard.admit(addr[0]):
+                # banned: closed before it can hold up the clients queued behind it
+                metrics.connection_dropped("banned")
+                conn.close()
                 continue
+            handle_client(conn, addr, s)
 
-            # count hits (safe because single-threaded)
-            hit_count[str(fs_path)] += 1
-
-            if fs_path.is_dir():
-                conn.sendall(listing(fs_path))
-                log(addr, method, path, "200 OK (directory)")
-            elif fs_path.is_file():
-                ctype = mimetypes.guess_type(fs_path.name)[0] or "application/octet-stream"
-                if ctype not in mime_whitelist:
-                    conn.sendall(not_found())
-                    log(addr, method, path, "404 Not Found (unsupported type)")
-                    continue
-                with open(fs_path, "rb") as f:
-                    data = f.read()
-                conn.sendall(response("200 OK", b"" if method == "HEAD" else data, ctype))
-                log(addr, method, path, "200 OK")
-            else:
-                conn.sendall(not_found())
-                log(addr, method, path, "404 Not Found")
+if workers > 1:
+    prefork.run_workers(workers, serve)
+    shutil.rmtree(metrics.spool_dir, ignore_errors=True)
+else:
+    serve()
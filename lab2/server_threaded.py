@@ -1,155 +1,696 @@
 # server_threaded.py
-import os, sys, socket, urllib.parse, mimetypes, time, threading, collections
-from datetime import datetime
+import os, sys, socket, ssl, urllib.parse, time, threading
+import asyncio, resource, shutil, signal, tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from collections import defaultdict, deque
+
+import filesend, prefork, tls
+from access_log import AccessLog
+from byteranges import Partial, requested_ranges, unsatisfiable_headers
+from conn_guard import OFFENCES, ConnectionGuard
+from connection import serve_connection, serve_connection_async
+from encoding import Encoder, compressible, content_type
+from file_cache import CacheEntry, FileCache
+from hit_counter import HitLog, LockedCounter, ShardedCounter
+from rate_limiter import Policy
+from listing_cache import ListingCache, page_bounds, page_param
+from metrics import Metrics, Timer
+from mmap_pool import MmapPool
+from filesend import FileResponse, StreamResponse, write_response, write_response_async
+from headers import HeadBuilder
+from state_backend import make_state
+from static_index import StaticIndex
+from validators import CachePolicy, not_modified, validator_headers
+from work import Work
+from worker_pool import WorkerPool
 
 # --- Settings from command line ---
 if len(sys.argv) < 2:
-    print("Usage: python server_threaded.py <directory> [--port PORT]")
+    print("Usage: python server_threaded.py <directory> [--port PORT] [--mode thread|pool|async] [--workers N] [--state memory|shm|kv]")
     sys.exit(1)
 
+def arg(name, default, cast=int):
+    return cast(sys.argv[sys.argv.index(name) + 1]) if name in sys.argv else default
+
+def arg_all(name):
+    """Values of every occurrence of a repeatable option."""
+    return [sys.argv[i + 1] for i, a in enumerate(sys.argv[:-1]) if a == name]
+
+def arg_limits(name):
+    """Every `name KEY=N` pair on the command line, as {KEY: N}."""
+    return {key: int(n) for key, _, n in (v.rpartition("=") for v in arg_all(name))}
+
 root = Path(sys.argv[1]).resolve()
-port = int(sys.argv[sys.argv.index("--port") + 1]) if "--port" in sys.argv else 8080
+port = arg("--port", 8080)
+mode = arg("--mode", "thread", str)      # thread: one thread per connection, pool: fixed workers, async: event loop
+backlog = arg("--backlog", 50)
+io_threads = arg("--io-threads", 16)     # async mode: threads used for filesystem work
+pool_size = arg("--pool-size", 32)       # pool mode: worker threads
+queue_size = arg("--queue-size", 128)    # pool mode: accepted connections waiting for a worker
+retry_after = arg("--retry-after", 1)    # pool mode: seconds advertised in 503 responses
+stats_interval = arg("--stats-interval", 0, float)  # print cache (and pool queue) metrics every N seconds
+workers = arg("--workers", 1)            # >1: pre-fork this many processes sharing the port
+keepalive_timeout = arg("--keepalive-timeout", 5.0, float)  # idle seconds before closing a connection
+max_requests = arg("--max-requests", 100)  # requests per connection (1 = always close)
+header_timeout = arg("--header-timeout", 10.0, float)  # seconds for a started request to arrive in full
+read_timeout = arg("--read-timeout", 5.0, float)    # seconds a started request may stall
+write_timeout = arg("--write-timeout", 30.0, float)  # seconds a client may stall reading a response
+max_conns = arg("--max-conns", 10000 if mode == "async" else 1000)  # open connections per process (0 = no cap)
+max_conns_per_ip = arg("--max-conns-per-ip", 0)    # open connections per client address (0 = no cap)
+ban_strikes = arg("--ban-strikes", 5)    # slow or malformed connections before a client is refused (0 = never)
+ban_seconds = arg("--ban-seconds", 60.0, float)  # ...for this long
+tls_cert = arg("--tls-cert", None, str)  # serve HTTPS with this certificate chain (or --tls-self-signed)
+tls_key = arg("--tls-key", None, str)    # its private key, if not in the same file
+tls_tickets = arg("--tls-tickets", 2)    # TLS 1.3 session tickets per full handshake (0: no resumption)
+filesend.zero_copy = "--no-sendfile" not in sys.argv  # stream files through a buffer instead
+filesend.write_timeout = write_timeout
+cache_mb = arg("--cache-mb", 64, float)  # hot-file cache budget (0 disables it)
+mmap_mb = arg("--mmap-mb", 0, float)     # mid-sized files served from shared read-only mappings (0: off)
+mmap_min_kb = arg("--mmap-min-kb", 64)  # smaller files stay in the file cache as bytes
+compress_mb = arg("--compress-cache-mb", 16, float)  # gzip/br variants kept in memory (0: never compress)
+page_size = arg("--page-size", 1000)     # directory listing rows per page (0: all on one page)
+work_spec = arg("--work", "sleep", str)  # simulated work per request: sleep | cpu | io | none, or a mix "sleep=0.6,cpu=0.4"
+work_time = arg("--work-time", 1.0, float)   # mean seconds of it
+work_dist = arg("--work-dist", "fixed", str)  # fixed | uniform | exp | lognormal
+cpu_procs = arg("--cpu-procs", max(1, (os.cpu_count() or 1) // workers))  # per worker process; 0: cpu work in the handling thread
+index_poll = arg("--index-poll", 2.0, float)  # with --static-index: seconds between checks for changes
+counter_kind = arg("--counter", "sharded", str)  # sharded: per-thread shards, lock: one dict + one lock
+hits_file = arg("--hits-file", None, str)  # append-only log that keeps hit counts across restarts
+hits_flush = arg("--hits-flush", 5.0, float)  # seconds between appends to --hits-file
+access_log_path = arg("--access-log", None, str)  # file for the access log (default: stdout)
+log_format = arg("--log-format", "text", str)       # text | json
+log_max_mb = arg("--log-max-mb", 0, float)          # rotate the access log at this size
+log_rotate_sec = arg("--log-rotate-sec", 0, float)  # ...and/or this often
+log_sample = arg("--log-sample", 1.0, float)        # fraction of 1xx-3xx lines kept (errors always)
+metrics_path = arg("--metrics-path", "/metrics", str)  # Prometheus endpoint ("" turns it off)
 mime_whitelist = {"text/html", "image/png", "application/pdf"}
+# Cache-Control per MIME type, e.g. --cache-control "image/=public, max-age=600" (repeatable)
+cache_policy = CachePolicy.parse(arg_all("--cache-control"))
+
+# HTTPS: one context for every connection, built before --workers forks so
+# that all workers share its session ticket keys
+if "--tls-self-signed" in sys.argv:
+    tls_cert, tls_key = tls.self_signed()
+tls_context = tls.server_context(tls_cert, tls_key, tls_tickets) if tls_cert else None
 
 # --- Shared state (must be protected!) ---
-hit_count = defaultdict(int)         # path -> int
-hit_lock = threading.Lock()
+# path -> int. The sharded counter lets every thread count into its own dict
+# and only sums them on read; --counter lock is the single global hit_lock.
+hits = LockedCounter() if counter_kind == "lock" else ShardedCounter()
+hit_log = HitLog(hits_file) if hits_file else None
 
-# rate limiting: ip -> deque[timestamps_of_requests]
+# rate limiting: by default GCRA, i.e. one timestamp per client (idle clients
+# are evicted in the background); --limiter window is the original deque of
+# request timestamps per IP. Limits can differ per path prefix and per client:
+#   --rate-path /kernel.html=2 --rate-client 10.0.0.5=0   (0 = unlimited)
 rate_window_sec = 1.0
-rate_limit = 10
-rate_lock = threading.Lock()
-ip_requests = defaultdict(lambda: deque())
+rate_limit = arg("--rate-limit", 10)
+rate_policy = Policy(rate_limit, rate_window_sec, arg_limits("--rate-path"), arg_limits("--rate-client"))
+limiter_kind = arg("--limiter", "gcra", str)
 
-def too_many_requests(ip):
+# Where counts and buckets live (state_backend.py). With several worker
+# processes, dicts would silently split per process, so by default they move
+# to shared memory; --state kv shares them between servers through a kv
+# server (kv_server.py) at --state-addr, leasing --state-lease of a limit
+# at a time so most requests are decided without a round trip.
+state_kind = arg("--state", "shm" if workers > 1 else "memory", str)
+state = make_state(state_kind, rate_policy, hits, limiter_kind,
+                   arg("--state-addr", "127.0.0.1:7070", str), arg("--state-lease", 0.1, float))
+limiter = state.limiter
+
+# counts saved by a previous run (loaded before forking, so workers start from them)
+if hit_log:
+    saved = hit_log.load()
+    hits.seed(saved)
+    if state.hits is not hits:
+        state.hits.seed(saved)
+
+def count_hit(key):
+    state.hits.incr(key)
+    if hit_log and state.hits is not hits:
+        # with a shared backend this process-local count only feeds this process's hit log
+        hits.incr(key)
+
+def hits_for_many(keys):
+    # one lock (or kv) round-trip for a whole listing page instead of one per row
+    return state.hits.get_many(keys)
+
+def rate_limited(ip, path, wait=True):
     """
-    Returns True if this request should be rejected (429),
-    and records this attempt if allowed.
+    Whether to answer 429. wait=False (event loop): None if the state
+    backend would first have to ask the kv server.
     """
-    now = time.time()
-    with rate_lock:
-        dq = ip_requests[ip]
-        # drop old timestamps
-        while dq and now - dq[0] > rate_window_sec:
-            dq.popleft()
+    limited = limiter.too_many_requests(ip, path, wait) if state.remote else limiter.too_many_requests(ip, path)
+    if limited:
+        metrics.rate_limited(state.limiter_name, rate_policy.rule_name(ip, path))
+    return limited
 
-        if len(dq) >= rate_limit:
-            # already at or above limit
-            return True
+# connection caps and bans, checked on accept before a thread or coroutine is spent
+guard = ConnectionGuard(max_conns, max_conns_per_ip, ban_strikes, ban_seconds)
 
-        # record this request
-        dq.append(now)
-        return False
+# small hot files are kept in memory, with their headers prebuilt
+file_cache = FileCache(int(cache_mb * 2**20)) if cache_mb > 0 else None
+# read-only mmaps of mid-sized files; bigger ones are streamed with sendfile
+mmaps = MmapPool(int(mmap_mb * 2**20), mmap_min_kb * 1024) if mmap_mb > 0 else None
+# sorted directory contents, rescanned only when a directory's mtime changes
+dir_listings = ListingCache()
+# --static-index: every URL path under the root resolved once at startup (and
+# again when a directory changes), so lookups need no filesystem calls
+static_index = StaticIndex(root) if "--static-index" in sys.argv else None
+# gzip/br variants of text files: precompressed siblings or compressed once here
+encoder = None
 
 # --- Helpers ---
-def response(status, body="", ctype="text/html"):
+def header_block(length, ctype="text/html", extra_headers=()):
+    """Headers that depend only on the body, so they can be cached with it."""
+    lines = [f"Content-Type: {ctype}", f"Content-Length: {length}", *extra_headers]
+    return "".join(f"{line}\r\n" for line in lines).encode()
+
+# status lines, the Date line (once a second) and the connection headers are prebuilt
+heads = HeadBuilder(keepalive_timeout, max_requests)
+finish_head = heads.head    # (status, block, keep_alive): status line + Date + block + connection headers
+
+def response_head(status, length, ctype="text/html", extra_headers=(), keep_alive=False):
+    return finish_head(status, header_block(length, ctype, extra_headers), keep_alive)
+
+def response(status, body="", ctype="text/html", extra_headers=(), keep_alive=False):
     body_bytes = body.encode() if isinstance(body, str) else body
-    headers = [
-        f"HTTP/1.1 {status}",
-        f"Date: {datetime.utcnow():%a, %d %b %Y %H:%M:%S GMT}",
-        f"Content-Type: {ctype}",
-        f"Content-Length: {len(body_bytes)}",
-        "Connection: close",
-        "", "",
-    ]
-    return "\r\n".join(headers).encode() + body_bytes
-
-def not_found():
-    return response("404 Not Found", "<h1>404 Not Found</h1>")
-
-def too_many():
-    return response("429 Too Many Requests", "<h1>429 Too Many Requests</h1>")
-
-def listing(path):
-    rel = str(path.relative_to(root)) if path != root else "/"
-    rows = []
-    for entry in sorted(path.iterdir()):
-        name = entry.name + ("/" if entry.is_dir() else "")
-        href = urllib.parse.quote(name)
-        with hit_lock:
-            count = hit_count[str(entry.resolve())]
-        rows.append(
-            f'<tr><td><a href="{href}">{name}</a></td><td>{count}</td></tr>'
-        )
+    return response_head(status, len(body_bytes), ctype, extra_headers, keep_alive) + body_bytes
+
+if compress_mb > 0:
+    encoder = Encoder(header_block, int(compress_mb * 2**20))
+
+def not_found(keep_alive=False):
+    return response("404 Not Found", "<h1>404 Not Found</h1>", keep_alive=keep_alive)
+
+def too_many(keep_alive=False):
+    return response("429 Too Many Requests", "<h1>429 Too Many Requests</h1>", keep_alive=keep_alive)
+
+def bad_request():
+    return response("400 Bad Request", "<h1>400 Bad Request</h1>")
+
+def unavailable():
+    return response(
+        "503 Service Unavailable", "<h1>503 Service Unavailable</h1>",
+        extra_headers=(f"Retry-After: {retry_after}",),
+    )
+
+LISTING_BATCH = 256     # listing rows rendered (and hit counts fetched) per chunk
+
+def listing(path, keep_alive=False, page=1, method="GET", chunked=True):
+    """
+    Directory page as a StreamResponse: rows are rendered LISTING_BATCH at a
+    time while it is sent, in writes of filesend.STREAM_BUFFER (a small page
+    leaves in one write, head and terminator included).
+    chunked=False (HTTP/1.0 clients) sends it unframed and closes after it.
+    """
+    block = b"Content-Type: text/html\r\n" + (b"Transfer-Encoding: chunked\r\n" if chunked else b"")
+    head = finish_head("200 OK", block, keep_alive and chunked)
+    if method == "HEAD":
+        return head
+    return StreamResponse(head, listing_body(path, page), chunked)
 
-    html = (
+def listing_body(path, page):
+    rel = str(path.relative_to(root)) if path != root else "/"
+    yield (
         "<html><head><title>Directory listing</title></head><body>"
         f"<h1>Directory listing for {rel}</h1>"
         '<table border="1" cellpadding="4" cellspacing="0">'
-        "<tr><th>File / Directory</th><th>Hits</th></tr>"
-        + "\n".join(rows) +
-        "</table></body></html>"
-    )
-    return response("200 OK", html)
+        "<tr><th>File / Directory</th><th>Hits</th></tr>\n"
+    ).encode()
+
+    entries = dir_listings.get(str(path))
+    start, end, page, pages = page_bounds(len(entries), page, page_size)
+    for batch in range(start, end, LISTING_BATCH):
+        shown = entries[batch:min(batch + LISTING_BATCH, end)]
+        # one lock round-trip per batch of rows
+        counts = hits_for_many([key for _, _, key in shown])
+        rows = []
+        for (name, is_dir, _), count in zip(shown, counts):
+            name += "/" if is_dir else ""
+            href = urllib.parse.quote(name)
+            rows.append(
+                f'<tr><td><a href="{href}">{name}</a></td><td>{count}</td></tr>\n'
+            )
+        yield "".join(rows).encode()
+
+    nav = ""
+    if pages > 1:
+        prev = f'<a href="?page={page - 1}">&laquo; prev</a> ' if page > 1 else ""
+        nxt = f' <a href="?page={page + 1}">next &raquo;</a>' if page < pages else ""
+        nav = f"<p>{prev}entries {start + 1}-{end} of {len(entries)} (page {page}/{pages}){nxt}</p>"
+    yield ("</table>" + nav + "</body></html>").encode()
+
+# the stand-in for real application work (by default the original 1 s sleep)
+work = Work(work_spec, work_time, work_dist, cpu_procs)
 
-def log(addr, method, path, status):
-    now = datetime.now().strftime("%H:%M:%S")
-    print(f"[{now}] {addr[0]} {method} {path} {status}", flush=True)
+# access log lines are queued here and written in batches by a background thread
+access_log = AccessLog(access_log_path, log_format, int(log_max_mb * 2**20), log_rotate_sec, sample=log_sample)
+
+# request counts, bytes and per-phase latency for /metrics; with --workers every
+# process spools its numbers to a directory shared by all of them
+metrics = Metrics(tempfile.mkdtemp(prefix="metrics-") if workers > 1 else None)
+
+def log(addr, method, path, status, sent=0, started=None, timer=None):
+    latency = time.monotonic() - started if started else None
+    access_log.log(addr[0], method, path, status, sent, latency)
+    metrics.observe(status, path, sent, latency, timer)
+
+def refusal(addr, reason):
+    """Response for a connection the guard turned away (None: just close it)."""
+    metrics.connection_dropped(reason)
+    if reason == "banned":
+        return None         # an offender gets nothing to work with, and no log line
+    if reason == "server_full":
+        log(addr, "?", "?", "503 Service Unavailable (server full)")
+        return unavailable()
+    log(addr, "?", "?", "429 Too Many Requests (connections per client)")
+    return too_many()
+
+def connection_ended(addr, ended):
+    metrics.closed()
+    if ended in OFFENCES:
+        metrics.connection_dropped(ended)
+    if guard.release(addr[0], ended):
+        print(f"[guard] {addr[0]} banned for {ban_seconds:g}s (last: {ended})", flush=True)
+
+def metrics_response(keep_alive=False):
+    return response("200 OK", metrics.render(), "text/plain; version=0.0.4", keep_alive=keep_alive)
+
+def resolve(key, path):
+    """
+    (resolved path, "dir" | "file" | None, content type) for a request path;
+    the path is None if it lies outside the root. With --static-index this
+    is a dict lookup, otherwise resolve() + is_dir() + is_file() + guess_type().
+    """
+    if static_index:
+        found = static_index.lookup(path)
+        if found is None:
+            return None, None, None
+        return found.path, "dir" if found.is_dir else "file", found.ctype
+    fs_path = Path(key).resolve()
+    if not str(fs_path).startswith(str(root)):
+        return None, None, None
+    if fs_path.is_dir():
+        return str(fs_path), "dir", None
+    if fs_path.is_file():
+        return str(fs_path), "file", content_type(fs_path.name)
+    return str(fs_path), None, None
+
+def serve_path(method, path, keep_alive=False, query="", headers=None, timer=None, chunked=True):
+    """
+    Everything after the rate limit and the simulated work.
+    Returns (response, status_for_log) where response is bytes, buffers, a
+    FileResponse to stream or a StreamResponse to generate while sending.
+    Does blocking filesystem work. `headers` are the request headers,
+    checked for If-None-Match / If-Modified-Since. chunked=False for
+    HTTP/1.0 clients. The path lookup is charged to timer's "resolve" phase.
+    """
+    timer = timer or Timer()
+    if method not in ("GET", "HEAD"):
+        return response("405 Method Not Allowed", "<h1>405</h1>", keep_alive=keep_alive), "405 Method Not Allowed"
+
+    # a cached file needs a single stat() to confirm it has not changed
+    key = os.path.join(str(root), path.lstrip("/"))
+    entry = file_cache.get(key) if file_cache else None
+    if entry is not None:
+        count_hit(entry.path)
+        timer.mark("resolve")
+        return serve_file(method, entry, None, keep_alive, "200 OK (cached)", headers)
+
+    fs_path, kind, ctype = resolve(key, path)
+    if fs_path is None:
+        return not_found(keep_alive), "404 Not Found"
+
+    # increment hit counter (thread-safe, and process-safe with --workers)
+    count_hit(fs_path)
+
+    if kind == "dir":
+        timer.mark("resolve")
+        return listing(Path(fs_path), keep_alive, page_param(query), method, chunked), "200 OK (directory)"
+    elif kind == "file":
+        if ctype not in mime_whitelist:
+            return not_found(keep_alive), "404 Not Found (unsupported type)"
+        try:
+            f = open(fs_path, "rb")
+        except FileNotFoundError:
+            # deleted since the static index was built
+            timer.mark("resolve")
+            return not_found(keep_alive), "404 Not Found"
+        st = os.fstat(f.fileno())
+        timer.mark("resolve")
+        # with --mmap-mb, mid-sized files are sent from a shared mapping instead
+        keep = file_cache and file_cache.keep_body(st.st_size) and not (mmaps and mmaps.fits(st.st_size))
+        body = f.read() if keep else None
+        validators = validator_headers(st, ctype, cache_policy)
+        if compressible(ctype):
+            validators.append("Vary: Accept-Encoding")
+        entry = CacheEntry(fs_path, st, ctype,
+                           header_block(st.st_size, ctype, [*validators, "Accept-Ranges: bytes"]), body,
+                           "".join(f"{h}\r\n" for h in validators).encode())
+        if file_cache:
+            file_cache.put(key, entry)
+        return serve_file(method, entry, f, keep_alive, "200 OK", headers)
+    else:
+        timer.mark("resolve")
+        return not_found(keep_alive), "404 Not Found"
+
+def serve_file(method, entry, f, keep_alive, status, headers=None):
+    """Response for a file entry; f is the already open file, if any."""
+    variant = encoder.negotiate(entry, headers.get("accept-encoding")) if encoder and headers else None
+    if variant is not None:
+        # the gzip/br body replaces the file; ranges of it are not offered
+        if f:
+            f.close()
+        entry, f, status = variant, None, f"{status} ({variant.coding})"
+    if headers and not_modified(headers, entry.etag, entry.mtime_ns):
+        # the client's copy is current: validators and Cache-Control only, no body
+        if f:
+            f.close()
+        return finish_head("304 Not Modified", entry.validators, keep_alive), "304 Not Modified"
+    # Range is only defined for GET; HEAD always describes the whole file
+    ranges = None
+    if method == "GET" and headers and entry.coding is None:
+        ranges = requested_ranges(headers, entry.etag, entry.mtime_ns, entry.size)
+    if ranges is not None:
+        return serve_ranges(entry, f, keep_alive, ranges)
+    head = finish_head("200 OK", entry.headers, keep_alive)
+    if method == "HEAD" or entry.body is not None:
+        if f:
+            f.close()
+        # head and cached body leave in one sendmsg(), without joining them first
+        return (head if method == "HEAD" else [head, entry.body]), status
+    view = mapped(entry)
+    if view is not None:
+        if f:
+            f.close()
+        return [head, view], status
+    # big files are streamed from disk, never held in memory
+    return FileResponse(head, f or open(entry.path, "rb"), 0, entry.size), status
+
+def serve_ranges(entry, f, keep_alive, ranges):
+    """206 with the requested byte ranges (streamed like a full file), or 416."""
+    if not ranges:
+        if f:
+            f.close()
+        block = header_block(0, extra_headers=unsatisfiable_headers(entry.size))
+        return finish_head("416 Range Not Satisfiable", block, keep_alive), "416 Range Not Satisfiable"
+    part = Partial(ranges, entry.size, entry.ctype)
+    head = finish_head("206 Partial Content",
+                       header_block(part.length, part.ctype, part.headers) + entry.validators, keep_alive)
+    status = f"206 Partial Content ({len(ranges)} range{'s' if len(ranges) > 1 else ''})"
+    if entry.body is not None:
+        if f:
+            f.close()
+        return [head, *part.buffers(memoryview(entry.body))], status
+    view = mapped(entry)
+    if view is not None:
+        if f:
+            f.close()
+        return [head, *part.buffers(view)], status
+    return FileResponse(head, f or open(entry.path, "rb"), parts=part.parts, tail=part.tail), status
+
+def mapped(entry):
+    """memoryview of a mid-sized file from the mmap pool (--mmap-mb), or None."""
+    if mmaps and entry.body is None and mmaps.fits(entry.size):
+        return mmaps.get(entry)
+    return None
+
+def handle_request(conn, addr, req, keep_alive):
+    started = time.monotonic()
+    timer = Timer(req.parse_time)
+    target, _, query = req.target.partition("?")
+    method, path = req.method, urllib.parse.unquote(target)
+
+    # metrics are answered before the rate limit and the simulated work
+    if metrics_path and path == metrics_path:
+        sent = write_response(conn, metrics_response(keep_alive))
+        log(addr, method, path, "200 OK (metrics)", sent, started)
+        return
+
+    # rate limit check (every request on a kept-alive connection counts)
+    limited = rate_limited(addr[0], path)
+    timer.mark("ratelimit")
+    if limited:
+        data = too_many(keep_alive)
+        conn.sendall(data)
+        timer.mark("send")
+        log(addr, method, path, "429 Too Many Requests", len(data), started, timer)
+        return
+
+    # simulated work (--work; by default a 1 s sleep)
+    work.run()
+    timer.mark("work")
+
+    data, status = serve_path(method, path, keep_alive, query, req.headers, timer, req.version == "HTTP/1.1")
+    timer.mark("read")
+    sent = write_response(conn, data)
+    timer.mark("send")
+    log(addr, method, path, status, sent, started, timer)
+    if isinstance(data, StreamResponse) and not data.chunked:
+        return False        # the end of the connection is the end of that body
+
+def start_tls(conn):
+    """TLS handshake on the thread that serves the connection, within the header timeout."""
+    try:
+        conn, seconds = tls.handshake(tls_context, conn, header_timeout)
+    except OSError:
+        metrics.tls_handshake("failed")
+        raise
+    metrics.tls_handshake("resumed" if conn.session_reused else "full", seconds)
+    return conn
 
 def handle_client(conn, addr):
-    with conn:
-        req = conn.recv(1024).decode(errors="ignore")
-        if not req:
-            return
-        line = req.split("\r\n")[0]
-        parts = line.split()
-        if len(parts) < 2:
-            conn.sendall(response("400 Bad Request", "<h1>400 Bad Request</h1>"))
-            log(addr, "?", "?", "400 Bad Request")
-            return
-
-        method, raw_path = parts[0], parts[1]
-        path = urllib.parse.unquote(raw_path)
-
-        # rate limit check
-        if too_many_requests(addr[0]):
-            conn.sendall(too_many())
-            log(addr, method, path, "429 Too Many Requests")
-            return
-
-        # artificial work delay (~1s)
-        time.sleep(1.0)
-
-        if method not in ("GET", "HEAD"):
-            conn.sendall(response("405 Method Not Allowed", "<h1>405</h1>"))
-            log(addr, method, path, "405 Method Not Allowed")
-            return
-
-        fs_path = (root / path.lstrip("/")).resolve()
-        if not str(fs_path).startswith(str(root)):
-            conn.sendall(not_found())
-            log(addr, method, path, "404 Not Found")
-            return
-
-        # increment hit counter with lock (thread-safe)
-        with hit_lock:
-            hit_count[str(fs_path)] += 1
-
-        if fs_path.is_dir():
-            conn.sendall(listing(fs_path))
-            log(addr, method, path, "200 OK (directory)")
-        elif fs_path.is_file():
-            ctype = mimetypes.guess_type(fs_path.name)[0] or "application/octet-stream"
-            if ctype not in mime_whitelist:
-                conn.sendall(not_found())
-                log(addr, method, path, "404 Not Found (unsupported type)")
-                return
-            with open(fs_path, "rb") as f:
-                data = f.read()
-            conn.sendall(response("200 OK", b"" if method == "HEAD" else data, ctype))
-            log(addr, method, path, "200 OK")
-        else:
-            conn.sendall(not_found())
-            log(addr, method, path, "404 Not Found")
+    def on_bad_request(err):
+        data = bad_request()
+        conn.sendall(data)
+        log(addr, "?", "?", "400 Bad Request", len(data))
+
+    metrics.opened()
+    ended = "closed"
+    try:
+        if tls_context:
+            conn = start_tls(conn)
+        with conn:
+            ended = serve_connection(
+                conn, lambda req, keep: handle_request(conn, addr, req, keep),
+                on_bad_request, keepalive_timeout, max_requests,
+                header_timeout=header_timeout, read_timeout=read_timeout, write_timeout=write_timeout,
+            )
+    except socket.timeout:
+        ended = "header_timeout"    # the client stalled in the TLS handshake
+    except (ConnectionError, ssl.SSLError):
+        pass
+    finally:
+        connection_ended(addr, ended)
+
+# --- asyncio mode: one event loop, a coroutine per connection ---
+io_pool = ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix="io")
+
+async def handle_request_async(writer, addr, req, keep_alive):
+    started = time.monotonic()
+    timer = Timer(req.parse_time)
+    target, _, query = req.target.partition("?")
+    method, path = req.method, urllib.parse.unquote(target)
+    loop = asyncio.get_running_loop()
+
+    # metrics are answered before the rate limit and the simulated work
+    if metrics_path and path == metrics_path:
+        data = await loop.run_in_executor(io_pool, metrics_response, keep_alive)
+        sent = await write_response_async(writer, data)
+        log(addr, method, path, "200 OK (metrics)", sent, started)
+        return
+
+    # the limiter only holds its lock for a few dict operations, fine on the loop;
+    # a kv round trip (no lease for this client yet) goes to a thread
+    limited = rate_limited(addr[0], path, wait=False)
+    if limited is None:
+        limited = await loop.run_in_executor(io_pool, rate_limited, addr[0], path)
+    timer.mark("ratelimit")
+    if limited:
+        data = too_many(keep_alive)
+        await write_response_async(writer, data)
+        timer.mark("send")
+        log(addr, method, path, "429 Too Many Requests", len(data), started, timer)
+        return
+
+    # simulated work without parking a thread (cpu goes to the process pool, io to io_pool)
+    await work.run_async(io_pool)
+    timer.mark("work")
+
+    # resolve/stat/read off the event loop
+    data, status = await loop.run_in_executor(io_pool, serve_path, method, path, keep_alive, query,
+                                              req.headers, timer, req.version == "HTTP/1.1")
+    timer.mark("read")
+    sent = await write_response_async(writer, data)
+    timer.mark("send")
+    log(addr, method, path, status, sent, started, timer)
+    if isinstance(data, StreamResponse) and not data.chunked:
+        return False        # the end of the connection is the end of that body
+
+async def handle_client_async(reader, writer):
+    addr = writer.get_extra_info("peername")
+    refused = guard.admit(addr[0])
+    if refused:
+        data = refusal(addr, refused)
+        if data:
+            writer.write(data)      # close() still flushes it; nothing here waits on the client
+        writer.close()
+        return
+
+    def on_bad_request(err):
+        data = bad_request()
+        writer.write(data)
+        log(addr, "?", "?", "400 Bad Request", len(data))
+
+    ssl_object = writer.get_extra_info("ssl_object")
+    if ssl_object:
+        # asyncio finished the handshake before calling us (failed ones never get here)
+        metrics.tls_handshake("resumed" if ssl_object.session_reused else "full")
+
+    metrics.opened()
+    ended = "closed"
+    try:
+        ended = await serve_connection_async(
+            reader, writer, lambda req, keep: handle_request_async(writer, addr, req, keep),
+            on_bad_request, keepalive_timeout, max_requests,
+            header_timeout=header_timeout, read_timeout=read_timeout, write_timeout=write_timeout,
+        )
+    except ConnectionError:
+        pass
+    finally:
+        connection_ended(addr, ended)
+        writer.close()
+
+def raise_fd_limit():
+    # every open connection is a file descriptor; 10k clients need more than the usual 1024
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = 65536 if hard == resource.RLIM_INFINITY else hard
+    if soft < target:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        except (ValueError, OSError):
+            pass
+
+async def serve_async():
+    raise_fd_limit()
+    # with TLS, a client gets the header timeout to finish its handshake
+    secure = {"ssl": tls_context, "ssl_handshake_timeout": header_timeout} if tls_context else {}
+    server = await asyncio.start_server(handle_client_async, sock=listener(), **secure)
+    print(f"[async] Serving {root} on port {port}", flush=True)
+    async with server:
+        await server.serve_forever()
+
+def listener():
+    # each pre-forked worker binds its own socket; SO_REUSEPORT lets the kernel balance them
+    return prefork.bind_listener(port, backlog, reuse_port=workers > 1)
 
 # --- Listener thread that spawns worker threads ---
-with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-    s.bind(("0.0.0.0", port))
-    s.listen(50)  # higher backlog since we're concurrent
-    print(f"[threaded] Serving {root} on port {port}", flush=True)
+def serve_threaded():
+    with listener() as s:  # higher backlog since we're concurrent
+        print(f"[threaded] Serving {root} on port {port}", flush=True)
+        while True:
+            conn, addr = s.accept()
+            refused = guard.admit(addr[0])
+            if refused:
+                turn_away(conn, refusal(addr, refused))
+                continue
+            t = threading.Thread(target=handle_client, args=(conn, addr), daemon=True)
+            t.start()
+
+# --- Pool mode: fixed worker threads behind a bounded queue ---
+def turn_away(conn, data):
+    # called on the acceptor thread, so never wait on a slow client here; with
+    # TLS a plain-text answer would be garbage, and a handshake has no place here
+    try:
+        if data and not tls_context:
+            conn.settimeout(0.5)
+            conn.sendall(data)
+            conn.shutdown(socket.SHUT_WR)
+    except OSError:
+        pass
+    finally:
+        conn.close()
+
+def shed(conn, addr):
+    guard.release(addr[0])
+    turn_away(conn, unavailable())
+    log(addr, "?", "?", "503 Service Unavailable (queue full)")
+
+def serve_pool():
+    pool = WorkerPool(handle_client, workers=pool_size, queue_size=queue_size, on_reject=shed)
+    metrics.gauge("http_pool_busy", "Pool workers serving a connection.", lambda: pool.stats()["busy"])
+    metrics.gauge("http_pool_queue_depth", "Connections waiting for a pool worker.", pool.queue.qsize)
+    if stats_interval:
+        pool.report_every(stats_interval)
+    with listener() as s:
+        print(f"[pool] Serving {root} on port {port} "
+              f"({pool_size} workers, queue {queue_size})", flush=True)
+        while True:
+            conn, addr = s.accept()
+            refused = guard.admit(addr[0])
+            if refused:
+                turn_away(conn, refusal(addr, refused))
+                continue
+            pool.submit(conn, addr)
+
+def report_stats():
     while True:
-        conn, addr = s.accept()
-        t = threading.Thread(target=handle_client, args=(conn, addr), daemon=True)
-        t.start()
+        time.sleep(stats_interval)
+        print(f"[cache] {file_cache.describe()}", flush=True)
+        if mmaps:
+            print(f"[mmap] {mmaps.describe()}", flush=True)
+        print(f"[access-log] {access_log.describe()}", flush=True)
+        print(f"[guard] {guard.describe()}", flush=True)
+        print(f"[work] {work.describe()}", flush=True)
+        if static_index:
+            print(f"[index] {static_index.describe()}", flush=True)
+        if encoder:
+            print(f"[encoding] {encoder.describe()}", flush=True)
+        if tls_context:
+            print(f"[tls] {tls.describe(tls_context)}", flush=True)
+        print(f"[state] {state.describe()}", flush=True)
+
+def save_logs_and_exit(signum, frame):
+    if hit_log:
+        hit_log.flush(hits)
+    state.flush()
+    access_log.flush()
+    os._exit(0)
+
+def serve():
+    work.start()
+    state.start()
+    access_log.start()
+    metrics.gauge("http_threads", "Threads in the worker process.", threading.active_count)
+    metrics.gauge("http_banned_clients", "Client addresses currently refused on accept.", guard.banned_count)
+    if file_cache:
+        metrics.file_cache(file_cache)
+    if metrics.spool_dir:
+        metrics.spool_every(1.0)
+    if static_index:
+        static_index.watch(index_poll)
+    signal.signal(signal.SIGTERM, save_logs_and_exit)
+    if hit_log:
+        hit_log.flush_every(hits, hits_flush)
+        if workers == 1:
+            signal.signal(signal.SIGINT, save_logs_and_exit)
+    if stats_interval and file_cache:
+        threading.Thread(target=report_stats, name="cache-stats", daemon=True).start()
+    if state.remote:
+        print(f"[state] {state.describe()}", flush=True)
+    if tls_context:
+        print(f"[tls] HTTPS with {tls_cert}, ALPN {'/'.join(tls.ALPN)}, "
+              f"{tls_tickets} session tickets per full handshake", flush=True)
+    if mode == "async":
+        asyncio.run(serve_async())
+    elif mode == "pool":
+        serve_pool()
+    else:
+        serve_threaded()
+
+if workers > 1:
+    prefork.run_workers(workers, serve)
+    shutil.rmtree(metrics.spool_dir, ignore_errors=True)
+else:
+    serve()
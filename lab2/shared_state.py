@@ -0,0 +1,111 @@
+# shared_state.py
+# Hit counters and rate-limit state that stay correct across forked workers.
+# Both live in an anonymous shared mmap (MAP_SHARED, inherited through fork)
+# laid out as a fixed-size open-addressing hash table, guarded by a
+# multiprocessing.Lock. Everything must be created in the parent BEFORE forking.
+import hashlib, mmap, multiprocessing, struct, time
+
+from rate_limiter import gcra
+
+MAX_PROBE = 32
+
+
+def key_hash(key):
+    """64-bit non-zero hash of a str key (0 marks an empty slot)."""
+    h = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little")
+    return h or 1
+
+
+class SharedTable:
+    """
+    `slots` fixed-size records of `fmt` (first field is the Q key hash).
+    Keys are only ever identified by their 64-bit hash.
+    """
+    def __init__(self, slots, fmt):
+        self.slots = slots
+        self.rec = struct.Struct(fmt)
+        self.buf = mmap.mmap(-1, slots * self.rec.size)   # zero-filled, shared with children
+        self.lock = multiprocessing.Lock()
+
+    def offset(self, i):
+        return i * self.rec.size
+
+    def find(self, h, reusable=None):
+        """
+        Slot index holding hash h, else a free slot to claim (its key is not
+        written yet), else None. `reusable(record)` lets a stale record be
+        recycled. Caller holds self.lock.
+        """
+        start = h % self.slots
+        free = None
+        for n in range(MAX_PROBE):
+            i = (start + n) % self.slots
+            rec = self.rec.unpack_from(self.buf, self.offset(i))
+            if rec[0] == h:
+                return i, rec
+            if rec[0] == 0:
+                # end of the probe chain: the key is not stored anywhere
+                return (free if free is not None else i), None
+            if free is None and reusable is not None and reusable(rec):
+                free = i
+        return free, None
+
+
+class SharedHitCounter:
+    """path -> hit count, shared by every worker process."""
+    def __init__(self, slots=16384):
+        self.table = SharedTable(slots, "QQ")
+
+    def incr(self, key, n=1):
+        h = key_hash(key)
+        t = self.table
+        with t.lock:
+            i, rec = t.find(h)
+            if i is None:
+                return          # table full: drop the count rather than block
+            count = rec[1] if rec else 0
+            t.rec.pack_into(t.buf, t.offset(i), h, count + n)
+
+    def seed(self, counts):
+        for key, n in counts.items():
+            self.incr(key, n)
+
+    def get(self, key):
+        return self.get_many([key])[0]
+
+    def get_many(self, keys):
+        """Counts for several keys under one lock acquisition."""
+        hashes = [key_hash(k) for k in keys]
+        t = self.table
+        with t.lock:
+            return [rec[1] if rec else 0 for _, rec in map(t.find, hashes)]
+
+
+class SharedRateLimiter:
+    """
+    rate_limiter.GCRALimiter with its state in shared memory: one theoretical
+    arrival time per bucket key. A slot whose TAT has passed holds nothing
+    worth keeping, so it is recycled when the table needs room and a scan
+    from many addresses cannot exhaust it.
+    """
+    def __init__(self, policy, slots=65536):
+        self.policy = policy
+        self.table = SharedTable(slots, "Qd")
+
+    def too_many_requests(self, ip, path="/"):
+        """True if this request should get a 429; otherwise records it."""
+        key, limit = self.policy.rule(ip, path)
+        if not limit:
+            return False
+        interval = self.policy.window / limit
+        now = time.monotonic()
+        h = key_hash(key)
+        t = self.table
+        with t.lock:
+            i, rec = t.find(h, reusable=lambda r: r[1] <= now)
+            if i is None:
+                return False    # table full of active clients: fail open
+            allowed, tat = gcra(rec[1] if rec else now, now, interval, interval * (limit - 1))
+            if allowed:
+                t.rec.pack_into(t.buf, t.offset(i), h, tat)
+            return not allowed
@@ -0,0 +1,95 @@
+# state_backend.py
+# Where the threaded server keeps hit counts and rate-limit buckets (--state):
+#
+#   memory  dicts in this process (hit_counter, rate_limiter). With --workers,
+#           every process counts and limits on its own.
+#   shm     shared memory inherited through fork (shared_state): the worker
+#           processes of one server share counts and buckets.
+#   kv      a key-value server over TCP (kv_state; kv_server.py stands in for
+#           Redis): several servers, e.g. behind a load balancer, share them.
+#
+# Every backend has `hits` (incr, get, get_many, seed) and `limiter`
+# (too_many_requests), is created before forking and start()ed in each
+# process after; flush() sends whatever is still buffered before exit.
+# `remote` says the limiter may wait on the network, which callers on an
+# event loop must not do (too_many_requests(..., wait=False)).
+from hit_counter import LockedCounter
+from kv_state import KVClient, LeasedRateLimiter, RemoteHitCounter
+from rate_limiter import GCRALimiter, SlidingWindowLimiter
+from shared_state import SharedHitCounter, SharedRateLimiter
+
+KINDS = ("memory", "shm", "kv")
+
+
+class MemoryState:
+    name = "memory"
+    remote = False
+
+    def __init__(self, policy, hits=None, limiter="gcra"):
+        self.hits = hits if hits is not None else LockedCounter()
+        self.limiter = SlidingWindowLimiter(policy) if limiter == "window" else GCRALimiter(policy)
+        self.limiter_name = limiter
+
+    def start(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def describe(self):
+        return f"{self.name} limiter={self.limiter_name} buckets={len(self.limiter)}"
+
+
+class SharedMemoryState:
+    name = "shm"
+    remote = False
+    limiter_name = "shared"
+
+    def __init__(self, policy):
+        self.hits = SharedHitCounter()
+        self.limiter = SharedRateLimiter(policy)
+
+    def start(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def describe(self):
+        return f"{self.name} slots={self.limiter.table.slots}"
+
+
+class KVState:
+    name = "kv"
+    remote = True
+    limiter_name = "kv"
+
+    def __init__(self, policy, addr, lease=0.1, flush_interval=0.2):
+        self.client = KVClient(addr)
+        self.hits = RemoteHitCounter(self.client, flush_interval)
+        self.limiter = LeasedRateLimiter(self.client, policy, lease)
+
+    def start(self):
+        # connects lazily, so each forked worker gets its own connection
+        self.hits.flush_every()
+        self.limiter.start()
+
+    def flush(self):
+        self.hits.flush()
+
+    def describe(self):
+        c, l = self.client, self.limiter
+        return (f"{self.name} {c.addr[0]}:{c.addr[1]} round_trips={c.round_trips} commands={c.commands} "
+                f"errors={c.errors} leases={len(l)} local={l.local} remote={l.remote} fallback={l.fallbacks} "
+                f"hits_dropped={self.hits.dropped}")
+
+
+def make_state(kind, policy, hits=None, limiter="gcra", addr="127.0.0.1:7070", lease=0.1):
+    """The backend for --state kind; memory counts into `hits` if given."""
+    if kind == "memory":
+        return MemoryState(policy, hits, limiter)
+    if kind == "shm":
+        return SharedMemoryState(policy)
+    if kind == "kv":
+        return KVState(policy, addr, lease)
+    raise ValueError(f"--state must be one of {', '.join(KINDS)}, not {kind!r}")
@@ -0,0 +1,113 @@
+# static_index.py
+# Optional in-memory index of the served root (--static-index). One walk of
+# the tree maps every URL path to what it resolves to: the real path, file or
+# directory, and the content type. A request is then one dict lookup on its
+# path, with no resolve(), is_dir(), is_file() or guess_type(). Only what the
+# walk found by descending from the root is in the index, so "..", or a
+# symlink that leads out of the root, has nothing to match.
+#
+# Keeping it current: adding, removing or renaming an entry changes the mtime
+# of its directory, so a background thread stats the indexed directories
+# every `interval` seconds and, if any changed, walks the tree again and swaps
+# the new index in whole. Until then a new file is a 404 and a deleted one
+# fails to open (also a 404). Edits to a file's contents are not its
+# directory's business; the file cache notices those itself.
+import os, posixpath, threading, time
+
+from encoding import content_type
+
+
+class IndexEntry:
+    __slots__ = ("path", "is_dir", "ctype")
+
+    def __init__(self, path, is_dir, ctype=None):
+        self.path = path            # resolved path (str), the hit counter key
+        self.is_dir = is_dir
+        self.ctype = ctype          # files only
+
+
+def scan(root):
+    """({relative URL path: IndexEntry}, {resolved dir: mtime_ns or None}) for a resolved root."""
+    entries = {"": IndexEntry(root, True)}
+    dirs = {}
+    inside = root.rstrip(os.sep) + os.sep
+    stack = [("", root, (root,))]
+    while stack:
+        rel, real, above = stack.pop()
+        scanned_ns = time.time_ns()
+        try:
+            st = os.stat(real)
+            it = os.scandir(real)
+        except OSError:
+            continue
+        # a change within the same second as the scan might share its mtime: check again next time
+        dirs[real] = st.st_mtime_ns if scanned_ns - st.st_mtime_ns > 1e9 else None
+        with it:
+            for d in it:
+                key = f"{rel}/{d.name}" if rel else d.name
+                try:
+                    if d.is_symlink():
+                        path = os.path.realpath(d.path)
+                        if not path.startswith(inside):
+                            continue
+                        is_dir, is_file = os.path.isdir(path), os.path.isfile(path)
+                    else:
+                        path = d.path
+                        is_dir, is_file = d.is_dir(follow_symlinks=False), d.is_file(follow_symlinks=False)
+                except OSError:
+                    continue
+                if is_dir:
+                    entries[key] = IndexEntry(path, True)
+                    # a symlink back to a directory we are inside would walk forever
+                    if path not in above:
+                        stack.append((key, path, above + (path,)))
+                elif is_file:
+                    ctype = content_type(os.path.basename(path))
+                    entries[key] = IndexEntry(path, False, ctype)
+    return entries, dirs
+
+
+class StaticIndex:
+    def __init__(self, root):
+        self.root = str(root)
+        self.rebuilds = -1
+        self.rebuild()
+
+    def lookup(self, path):
+        """IndexEntry for a decoded URL path, or None if nothing under the root matches it."""
+        entries = self.entries          # one read: a rebuild may swap it meanwhile
+        entry = entries.get(path.strip("/"))
+        if entry is None and ("//" in path or "/." in path):
+            # "/a/../b", "/./b", "//b": normalized against "/" so ".." stops at the root
+            entry = entries.get(posixpath.normpath("/" + path).strip("/"))
+        return entry
+
+    def changed(self):
+        for path, mtime_ns in self.dirs.items():
+            try:
+                if os.stat(path).st_mtime_ns != mtime_ns:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def rebuild(self):
+        t0 = time.perf_counter()
+        entries, dirs = scan(self.root)
+        self.entries, self.dirs = entries, dirs
+        self.rebuilds += 1
+        self.scan_seconds = time.perf_counter() - t0
+
+    def watch(self, interval=2.0):
+        """Poll for changes from a daemon thread (after fork: threads do not survive it)."""
+        def loop():
+            while True:
+                time.sleep(interval)
+                if self.changed():
+                    self.rebuild()
+        threading.Thread(target=loop, name="static-index", daemon=True).start()
+
+    def describe(self):
+        files = sum(1 for e in self.entries.values() if not e.is_dir)
+        return (f"files={files} dirs={len(self.entries) - files} rebuilds={self.rebuilds} "
+                f"last_scan={self.scan_seconds * 1000:.1f}ms")
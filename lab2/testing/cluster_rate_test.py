@@ -0,0 +1,61 @@
+# cluster_rate_test.py
+# One client against several server instances at once, as it would be behind a
+# load balancer: requests go round-robin over --ports at --rate per second.
+# With per-node state every node grants its own limit (N x 10 req/s); with a
+# shared backend (--state kv and kv_server.py) the cluster grants ~10 req/s.
+#
+#   python kv_server.py --port 7070 &
+#   python server_threaded.py content --port 8091 --work none --state kv &
+#   python server_threaded.py content --port 8092 --work none --state kv &
+#   python testing/cluster_rate_test.py [--ports 8091,8092] [--rate 40] [--seconds 5]
+import socket, sys, threading, time
+from collections import Counter
+
+def arg(name, default, cast=int):
+    return cast(sys.argv[sys.argv.index(name) + 1]) if name in sys.argv else default
+
+host = arg("--host", "127.0.0.1", str)
+ports = [int(p) for p in arg("--ports", "8091,8092", str).split(",")]
+rate = arg("--rate", 40.0, float)
+seconds = arg("--seconds", 5.0, float)
+path = arg("--path", "/", str)
+
+
+def fetch(port, results, i):
+    req = f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode()
+    try:
+        with socket.create_connection((host, port), timeout=3) as s:
+            s.sendall(req)
+            status = s.recv(64).split(b"\r\n", 1)[0].split()
+            results[i] = (port, status[1].decode() if len(status) > 1 else "ERR")
+    except OSError as e:
+        results[i] = (port, f"ERR({e.__class__.__name__})")
+
+
+def main():
+    total = int(rate * seconds)
+    results = [None] * total
+    threads = []
+    t0 = time.perf_counter()
+    for i in range(total):
+        # paced against the start, so slow thread starts do not lower the rate
+        delay = t0 + i / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        t = threading.Thread(target=fetch, args=(ports[i % len(ports)], results, i))
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    print(f"{total} requests over {elapsed:.1f}s to ports {','.join(map(str, ports))} ({total / elapsed:.1f}/s)")
+    for port in ports:
+        codes = Counter(code for p, code in results if p == port)
+        print(f"  port {port}: " + "  ".join(f"{code}={n}" for code, n in sorted(codes.items())))
+    ok = sum(1 for _, code in results if code == "200")
+    print(f"  cluster: 200={ok} ({ok / elapsed:.1f}/s admitted)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# counter_bench.py
+# Contention benchmark for the hit counters: N threads increment the SAME path
+# (the race scenario from the report), optionally while one thread keeps
+# rendering "listings" (reading a page of counts). Compares the original
+# single dict + lock with the per-thread sharded counter.
+#
+#   python testing/counter_bench.py [--threads 64] [--incr 20000] [--readers 1]
+import sys, threading, time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from hit_counter import LockedCounter, ShardedCounter
+
+def arg(name, default, cast=int):
+    return cast(sys.argv[sys.argv.index(name) + 1]) if name in sys.argv else default
+
+threads = arg("--threads", 64)
+per_thread = arg("--incr", 20000)
+readers = arg("--readers", 1)
+PATH = "/srv/content/drstone.png"
+PAGE = [f"/srv/content/file{i}.png" for i in range(99)] + [PATH]
+
+
+def run(counter):
+    start = threading.Barrier(threads + readers + 1)
+    stop = threading.Event()
+    reads = [0] * readers
+
+    def writer():
+        start.wait()
+        for _ in range(per_thread):
+            counter.incr(PATH)
+
+    def reader(i):
+        start.wait()
+        while not stop.is_set():
+            counter.get_many(PAGE)
+            reads[i] += 1
+
+    pool = [threading.Thread(target=writer) for _ in range(threads)]
+    rpool = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    for t in pool + rpool:
+        t.start()
+    start.wait()
+    t0 = time.perf_counter()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    for t in rpool:
+        t.join()
+
+    total = threads * per_thread
+    got = counter.get(PATH)
+    print(f"{type(counter).__name__:>15}: {total / elapsed / 1e6:6.2f} M incr/s "
+          f"({elapsed:.2f}s), {sum(reads) / elapsed:8.0f} page reads/s, "
+          f"count {got}/{total} {'ok' if got == total else 'WRONG'}")
+
+
+if __name__ == "__main__":
+    print(f"{threads} threads x {per_thread} increments of one path, {readers} listing reader(s)")
+    print(f"python {sys.version.split()[0]}, GIL {'on' if getattr(sys, '_is_gil_enabled', lambda: True)() else 'off'}")
+    for cls in (LockedCounter, ShardedCounter):
+        run(cls())
@@ -0,0 +1,175 @@
+# header_bench.py
+# Micro-benchmarks for response heads (headers.py) and for how a head and a
+# small body are handed to the kernel.
+#
+# Building a head, per response:
+#   lab2 before  status/Date formatted with datetime.utcnow(), connection headers joined per call
+#   lab1 before  status map rebuilt per call, head grown with += (and no Date)
+#   HeadBuilder  prebuilt status line, cached Date line, prebuilt connection headers
+#
+# Sending head + body over loopback TCP, per response:
+#   two sends    sendall(head); sendall(body)   (lab1's send_response before)
+#   join + send  sendall(head + body)           (copies the body to glue the head on)
+#   sendmsg      sendmsg([head, body])          (write_response with a list)
+# "throughput" streams responses at a reader; "round trip" waits for each
+# response before asking for the next, which is where the second small send of
+# "two sends" can sit behind Nagle until the client's delayed ACK.
+#
+#   python testing/header_bench.py [--responses 100000] [--repeat 5] [--round-trips 200]
+import socket, sys, threading, time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from connection import keep_alive_headers
+from filesend import send_buffers
+from headers import HeadBuilder
+
+def arg(name, default, cast=int):
+    return cast(sys.argv[sys.argv.index(name) + 1]) if name in sys.argv else default
+
+n_responses = arg("--responses", 100000)
+repeat = arg("--repeat", 5)
+round_trips = arg("--round-trips", 200)
+
+BLOCK = (b"Content-Type: text/html\r\nContent-Length: 1024\r\n"
+         b'ETag: "5f2a-400"\r\nLast-Modified: Mon, 01 Jan 2024 00:00:00 GMT\r\n'
+         b"Cache-Control: no-cache\r\nAccept-Ranges: bytes\r\n")
+
+
+def lab2_before(status, block, keep_alive):
+    conn_headers = keep_alive_headers(5.0, 100) if keep_alive else ("Connection: close",)
+    return (
+        f"HTTP/1.1 {status}\r\nDate: {datetime.utcnow():%a, %d %b %Y %H:%M:%S GMT}\r\n".encode()
+        + block
+        + "".join(f"{h}\r\n" for h in conn_headers).encode()
+        + b"\r\n"
+    )
+
+
+def lab1_before(status_code, block, keep_alive):
+    status_messages = {
+        200: 'OK', 206: 'Partial Content', 304: 'Not Modified', 400: 'Bad Request',
+        403: 'Forbidden', 404: 'Not Found', 405: 'Method Not Allowed',
+        416: 'Range Not Satisfiable', 500: 'Internal Server Error'
+    }
+    status_message = status_messages.get(status_code, 'Unknown')
+    response = f"HTTP/1.1 {status_code} {status_message}\r\n".encode('utf-8') + block
+    for header in (keep_alive_headers(2.0, 100) if keep_alive else ["Connection: close"]):
+        response += f"{header}\r\n".encode('utf-8')
+    return response + b"\r\n"
+
+
+def timed(label, n, fn):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    print(f"{label:>28}: {best / n * 1e6:8.3f} us/response  ({n / best / 1e3:7.0f} k/s)")
+    return best / n
+
+
+def build_cases():
+    n = n_responses
+    heads = HeadBuilder(5.0, 100)
+    print(f"building a head ({len(BLOCK)}-byte block), best of {repeat}")
+    before = timed("lab2 before", n, lambda: [lab2_before("200 OK", BLOCK, True) for _ in range(n)])
+    timed("lab1 before", n, lambda: [lab1_before(200, BLOCK, True) for _ in range(n)])
+    after = timed("HeadBuilder", n, lambda: [heads.head("200 OK", BLOCK, True) for _ in range(n)])
+    timed("HeadBuilder (int status)", n, lambda: [heads.head(200, BLOCK, True) for _ in range(n)])
+    print(f"{'':>28}  {before / after:.1f}x less CPU than before")
+
+
+def two_sends(sock, head, body):
+    sock.sendall(head)
+    sock.sendall(body)
+
+
+def join_send(sock, head, body):
+    sock.sendall(head + body)
+
+
+def gathered(sock, head, body):
+    send_buffers(sock, [head, body])
+
+
+SENDERS = (("two sends", two_sends), ("join + send", join_send), ("sendmsg", gathered))
+
+
+def tcp_pair():
+    listener = socket.create_server(("127.0.0.1", 0))
+    client = socket.create_connection(listener.getsockname())
+    server, _ = listener.accept()
+    listener.close()
+    return server, client
+
+
+def drain(sock, total):
+    buf = bytearray(1 << 20)
+    got = 0
+    while got < total:
+        n = sock.recv_into(buf)
+        if not n:
+            break
+        got += n
+
+
+def throughput(label, send, head, body):
+    n = n_responses // 10
+    best = float("inf")
+    for _ in range(repeat):
+        server, client = tcp_pair()
+        reader = threading.Thread(target=drain, args=(client, n * (len(head) + len(body))))
+        reader.start()
+        t0 = time.perf_counter()
+        for _ in range(n):
+            send(server, head, body)
+        reader.join()
+        best = min(best, time.perf_counter() - t0)
+        server.close()
+        client.close()
+    print(f"{label:>28}: {best / n * 1e6:8.2f} us/response")
+
+
+def round_trip(label, send, head, body):
+    server, client = tcp_pair()
+    size = len(head) + len(body)
+
+    def serve():
+        for _ in range(round_trips):
+            server.recv(1)
+            send(server, head, body)
+
+    t = threading.Thread(target=serve)
+    t.start()
+    latencies = []
+    for _ in range(round_trips):
+        t0 = time.perf_counter()
+        client.sendall(b"?")
+        drain(client, size)
+        latencies.append(time.perf_counter() - t0)
+    t.join()
+    server.close()
+    client.close()
+    latencies.sort()
+    print(f"{label:>28}: median {latencies[len(latencies) // 2] * 1e6:8.0f} us, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1e6:8.0f} us")
+
+
+def send_cases():
+    head = HeadBuilder(5.0, 100).head("200 OK", BLOCK, True)
+    for size in (1024, 64 * 1024):
+        body = b"x" * size
+        print(f"\nhead + {size // 1024} KiB body over loopback TCP: throughput, best of {repeat}")
+        for label, send in SENDERS:
+            throughput(label, send, head, body)
+        print(f"head + {size // 1024} KiB body: {round_trips} round trips")
+        for label, send in SENDERS:
+            round_trip(label, send, head, body)
+
+
+if __name__ == "__main__":
+    print(f"{n_responses} responses, python {sys.version.split()[0]}")
+    build_cases()
+    send_cases()
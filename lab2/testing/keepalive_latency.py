@@ -0,0 +1,68 @@
+# keepalive_latency.py
+# Latency of back-to-back requests on ONE kept-alive connection, per path.
+# A response written as several small sends shows up here at ~40 ms (the
+# second send waits for the client's delayed ACK under Nagle) where a
+# response sent in one write takes well under a millisecond on loopback.
+# Exits 1 if any path's median is over --max-p50-ms, so it can gate a change.
+#
+#   python testing/keepalive_latency.py --port 8081 [--path / --path /kernel.html] [--requests 100]
+import socket, sys, time
+
+def arg(name, default, cast=int):
+    return cast(sys.argv[sys.argv.index(name) + 1]) if name in sys.argv else default
+
+def arg_all(name):
+    return [sys.argv[i + 1] for i, a in enumerate(sys.argv[:-1]) if a == name]
+
+host = arg("--host", "127.0.0.1", str)
+port = arg("--port", 8081)
+paths = arg_all("--path") or ["/"]      # "/" is a streamed (chunked) directory listing
+n_requests = arg("--requests", 100)
+max_p50_ms = arg("--max-p50-ms", 10.0, float)
+
+
+def read_response(f):
+    """Read one response off the buffered socket file; returns (status, body bytes)."""
+    status = f.readline().split()[1]
+    length, chunked = None, False
+    while (line := f.readline()) not in (b"\r\n", b""):
+        name, _, value = line.decode("latin-1").partition(":")
+        name = name.strip().lower()
+        if name == "content-length":
+            length = int(value)
+        elif name == "transfer-encoding" and "chunked" in value.lower():
+            chunked = True
+    if not chunked:
+        return status, f.read(length or 0)
+    body = b""
+    while size := int(f.readline().split(b";")[0], 16):
+        body += f.read(size)
+        f.readline()
+    f.readline()            # the blank line after the last chunk
+    return status, body
+
+
+def measure(path):
+    with socket.create_connection((host, port), timeout=5) as s:
+        f = s.makefile("rb")
+        req = f"GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode()
+        latencies, statuses = [], set()
+        for _ in range(n_requests):
+            t0 = time.perf_counter()
+            s.sendall(req)
+            status, _ = read_response(f)
+            latencies.append(time.perf_counter() - t0)
+            statuses.add(status.decode())
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    print(f"{path:>20}: {n_requests} requests, status {','.join(sorted(statuses))}, "
+          f"p50 {p50:.2f} ms, p99 {p99:.2f} ms")
+    return p50
+
+
+if __name__ == "__main__":
+    slow = [p for p in paths if measure(p) > max_p50_ms]
+    if slow:
+        print(f"FAIL: median over {max_p50_ms} ms on {', '.join(slow)}")
+        sys.exit(1)
@@ -0,0 +1,130 @@
+# kv_state_test.py
+# Checks what the kv state backend (kv_state.py) does when the kv server does
+# not give a usable answer:
+#   - every command answered with {"error": ...} (a stub server here)
+#   - the real kv_server.py rejecting a TAKE with limit 0
+#   - nothing listening at all
+# In each case the limiter must decide through its per-process fallback (the
+# 11th request in a second gets a 429, nothing raises) and hit counts must
+# neither raise nor be retried forever. Exits 1 if any check fails.
+#
+#   python testing/kv_state_test.py
+import json, socket, subprocess, sys, threading, time
+from pathlib import Path
+
+LAB2 = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(LAB2))
+from kv_state import KVClient, KVError, LeasedRateLimiter, RemoteHitCounter
+from rate_limiter import Policy
+
+failures = 0
+
+
+def check(what, ok):
+    global failures
+    print(f"{'ok  ' if ok else 'FAIL'} {what}")
+    failures += not ok
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def error_server():
+    """A kv server that answers every command with an error reply; returns its port."""
+    listener = socket.create_server(("127.0.0.1", 0))
+
+    def serve(conn):
+        with conn, conn.makefile("rb") as f:
+            for _ in f:
+                conn.sendall(json.dumps({"error": "not today"}).encode() + b"\n")
+
+    def accept():
+        while True:
+            conn, _ = listener.accept()
+            threading.Thread(target=serve, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def limiter_falls_back(label, addr, policy=Policy(10, 1.0)):
+    client = KVClient(addr)
+    limiter = LeasedRateLimiter(client, policy)
+    try:
+        decisions = [limiter.too_many_requests("10.0.0.1", "/") for _ in range(11)]
+    except Exception as e:
+        check(f"{label}: limiter does not raise ({e!r})", False)
+        return client
+    check(f"{label}: first 10 requests admitted", decisions[:10] == [False] * 10)
+    check(f"{label}: 11th refused by the fallback", decisions[10] is True)
+    check(f"{label}: decided by the fallback", limiter.fallbacks == 11)
+    return client
+
+
+def hits_survive(label, addr):
+    client = KVClient(addr)
+    hits = RemoteHitCounter(client)
+    hits.incr("/a", 3)
+    try:
+        hits.flush()
+        counts = hits.get_many(["/a"])
+    except Exception as e:
+        check(f"{label}: hit counter does not raise ({e!r})", False)
+        return
+    return hits, counts
+
+
+def main():
+    port = error_server()
+    addr = f"127.0.0.1:{port}"
+
+    client = KVClient(addr)
+    try:
+        client.call(["TAKE", "k", 10, 1.0, 1])
+        check("error reply raises KVError", False)
+    except KVError:
+        check("error reply raises KVError", True)
+    check("error reply keeps the connection", client.sock is not None)
+
+    limiter_falls_back("error replies", addr)
+    result = hits_survive("error replies", addr)
+    if result:
+        hits, counts = result
+        check("error replies: rejected increments dropped, not retried", hits.dropped == 3 and not hits.pending)
+        check("error replies: reads fall back to local counts", counts == [0])
+
+    # the real server: a limit of 0 is an error reply, and the connection survives it
+    kv_port = free_port()
+    kv = subprocess.Popen([sys.executable, str(LAB2 / "kv_server.py"), "--port", str(kv_port), "--host", "127.0.0.1"],
+                          stdout=subprocess.DEVNULL)
+    try:
+        time.sleep(0.5)
+        client = KVClient(f"127.0.0.1:{kv_port}")
+        try:
+            client.call(["TAKE", "k", 0, 1.0, 1])
+            check("kv_server: TAKE with limit 0 rejected", False)
+        except KVError:
+            check("kv_server: TAKE with limit 0 rejected", True)
+        check("kv_server: connection still answers", client.call(["INCRBY", "/b", 2]) == [2])
+    finally:
+        kv.terminate()
+        kv.wait()
+
+    # nobody listening
+    closed = f"127.0.0.1:{free_port()}"
+    limiter_falls_back("unreachable", closed)
+    result = hits_survive("unreachable", closed)
+    if result:
+        hits, counts = result
+        check("unreachable: increments kept for the next flush", hits.pending.get("/a") == 3 and not hits.dropped)
+        check("unreachable: reads include pending counts", counts == [3])
+
+    print("all checks passed" if not failures else f"{failures} check(s) failed")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
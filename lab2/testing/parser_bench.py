@@ -0,0 +1,109 @@
+# parser_bench.py
+# Micro-benchmarks for httpparse: cost per request of the shared parser in the
+# situations the servers see (one request per recv, pipelined batches, heads
+# split across reads, trickled byte by byte) next to two references:
+#   naive  the original servers: decode the recv() and keep the first line
+#   eager  the previous parser: decode the whole head and build a header dict
+# "+ lookups" adds what a cached-file response reads: Accept-Encoding, the
+# conditional headers, Range and Connection. Each case runs on a typical
+# browser head and on one carrying a 2 KB cookie and 30 extra headers.
+#
+#   python testing/parser_bench.py [--requests 5000] [--repeat 7]
+import base64, random, sys, time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from httpparse import RequestParser, parse_head
+
+def arg(name, default, cast=int):
+    return cast(sys.argv[sys.argv.index(name) + 1]) if name in sys.argv else default
+
+n_requests = arg("--requests", 5000)
+repeat = arg("--repeat", 7)
+
+BROWSER = (
+    b"GET /content/kernel.html?page=2 HTTP/1.1\r\n"
+    b"Host: localhost:8080\r\n"
+    b"User-Agent: Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 Chrome/120.0 Safari/537.36\r\n"
+    b"Accept: text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8\r\n"
+    b"Accept-Encoding: gzip, deflate, br\r\n"
+    b"Accept-Language: en-US,en;q=0.9\r\n"
+    b"Connection: keep-alive\r\n"
+    + b"".join(b"X-Extra-%d: %s\r\n" % (i, b"v" * 24) for i in range(6))
+    + b"\r\n"
+)
+COOKIES = (
+    BROWSER[:-2]
+    + b"Cookie: session=" + base64.b64encode(random.Random(1).randbytes(1500)) + b"\r\n"
+    + b"".join(b"X-Trace-%d: %s\r\n" % (i, b"t" * 30) for i in range(30))
+    + b"\r\n"
+)
+LOOKUPS = ("accept-encoding", "if-none-match", "if-modified-since", "range")
+
+
+def naive(data):
+    return data.decode().split("\r\n")[0].split()
+
+
+def eager(data):
+    lines = data[:data.find(b"\r\n\r\n")].decode("latin-1").split("\r\n")
+    method, target, version = lines[0].split()
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(":")
+        headers[name.lower()] = value.strip()
+    return method, target, version, headers
+
+
+def timed(label, n, fn):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    print(f"{label:>32}: {best / n * 1e6:8.2f} us/request  ({n / best / 1e3:6.0f} k/s)")
+
+
+def feeds(chunks, n, look=False):
+    """Feed the same chunks n times into one parser (like one long connection)."""
+    def run():
+        parser = RequestParser()
+        for _ in range(n):
+            for chunk in chunks:
+                for req in parser.feed(chunk):
+                    if look:
+                        for name in LOOKUPS:
+                            req.headers.get(name)
+                        req.keep_alive()
+    return run
+
+
+def eager_lookups(head, n):
+    def run():
+        for _ in range(n):
+            headers = eager(head)[3]
+            for name in LOOKUPS:
+                headers.get(name)
+            headers.get("connection")
+    return run
+
+
+def cases(name, head):
+    n = n_requests
+    step = len(head) // 3 + 1
+    print(f"{name}: {len(head)}-byte head, {head.count(b': ')} headers")
+    timed("naive (first line only)", n, lambda: [naive(head) for _ in range(n)])
+    timed("eager (header dict)", n, lambda: [eager(head) for _ in range(n)])
+    timed("parse_head", n, lambda: [parse_head(head[:-4]) for _ in range(n)])
+    timed("RequestParser, 1 per read", n, feeds([head], n))
+    timed("RequestParser, 32 pipelined", n, feeds([head * 32], n // 32))
+    timed("RequestParser, head in 3 reads", n, feeds([head[i:i + step] for i in range(0, len(head), step)], n))
+    timed("RequestParser, 1 byte per read", n // 100, feeds([head[i:i + 1] for i in range(len(head))], n // 100))
+    timed("eager + lookups", n, eager_lookups(head, n))
+    timed("RequestParser, 1 per read + lookups", n, feeds([head], n, look=True))
+
+
+if __name__ == "__main__":
+    print(f"{n_requests} requests, best of {repeat}, python {sys.version.split()[0]}")
+    cases("browser", BROWSER)
+    cases("cookies", COOKIES)
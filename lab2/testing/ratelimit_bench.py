@@ -0,0 +1,60 @@
+# ratelimit_bench.py
+# Rate limiter under a scan from many distinct client addresses: every IP makes
+# `--per-ip` requests, then the limiter is left alone for one window. Compares
+# the original deque-per-IP limiter with the GCRA limiter (time per request,
+# memory held, and how many keys survive an idle sweep). Each limiter runs in a
+# forked child so the RSS figures do not include the other run.
+#
+#   python testing/ratelimit_bench.py [--ips 1000000] [--per-ip 3] [--limit 10]
+import os, sys, time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from rate_limiter import GCRALimiter, Policy, SlidingWindowLimiter
+
+def arg(name, default, cast=int):
+    return cast(sys.argv[sys.argv.index(name) + 1]) if name in sys.argv else default
+
+n_ips = arg("--ips", 1_000_000)
+per_ip = arg("--per-ip", 3)
+limit = arg("--limit", 10)
+WINDOW = 1.0
+
+
+def rss_mib():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def run(name, make):
+    ips = [f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(n_ips)]
+    before = rss_mib()
+    limiter = make(Policy(limit, WINDOW))
+    t0 = time.perf_counter()
+    rejected = 0
+    for _ in range(per_ip):
+        for ip in ips:
+            rejected += limiter.too_many_requests(ip, "/")
+    elapsed = time.perf_counter() - t0
+    held = rss_mib() - before
+
+    time.sleep(WINDOW + 0.1)
+    t0 = time.perf_counter()
+    if hasattr(limiter, "evict_idle"):
+        limiter.evict_idle()
+    sweep = time.perf_counter() - t0
+    total = n_ips * per_ip
+    print(f"{name:>7}: {total / elapsed / 1e6:5.2f} M req/s ({elapsed:.2f}s), "
+          f"{held:7.1f} MiB held, {rejected} rejected, "
+          f"{len(limiter)} keys after idle ({sweep * 1000:.0f} ms sweep)", flush=True)
+
+
+if __name__ == "__main__":
+    print(f"{n_ips} IPs x {per_ip} requests, limit {limit}/{WINDOW:g}s")
+    for name, make in (("window", SlidingWindowLimiter),
+                       ("gcra", lambda p: GCRALimiter(p, evict_interval=0))):
+        pid = os.fork()
+        if pid == 0:
+            run(name, make)
+            os._exit(0)
+        os.waitpid(pid, 0)
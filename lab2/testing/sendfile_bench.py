@@ -0,0 +1,94 @@
+# sendfile_bench.py
+# Throughput and server memory for many concurrent downloads of one big file.
+# Starts server_threaded.py on a temporary directory holding a sparse PDF,
+# downloads it from N client threads at once, and samples the server's RSS.
+# Runs once with sendfile and once with the buffered fallback (--no-sendfile).
+#
+#   python testing/sendfile_bench.py                      # 1 GB x 100 clients
+#   python testing/sendfile_bench.py --size-mb 64 --clients 20 --mode async
+import os, sys, socket, subprocess, tempfile, threading, time
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent.parent
+
+def arg(name, default, cast=int):
+    return cast(sys.argv[sys.argv.index(name) + 1]) if name in sys.argv else default
+
+size_mb = arg("--size-mb", 1024)
+clients = arg("--clients", 100)
+mode = arg("--mode", "thread", str)
+port = arg("--port", 8090)
+
+
+def rss_kb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def download(results, index):
+    buf = bytearray(1 << 20)
+    got = 0
+    first = None
+    with socket.create_connection(("127.0.0.1", port)) as s:
+        s.sendall(b"GET /big.pdf HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n\r\n")
+        while True:
+            n = s.recv_into(buf)
+            if not n:
+                break
+            if first is None:
+                first = time.monotonic()
+            got += n
+    results[index] = (first, time.monotonic(), got)
+
+
+def run(content, extra_args):
+    cmd = [sys.executable, str(HERE / "server_threaded.py"), content, "--port", str(port),
+           "--mode", mode, "--rate-limit", str(clients * 10), "--max-requests", "1",
+           "--backlog", str(clients * 2), "--pool-size", str(clients), *extra_args]
+    server = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+    time.sleep(1.0)
+    idle_rss = rss_kb(server.pid)
+
+    peak = [idle_rss]
+    done = threading.Event()
+    def sample():
+        while not done.is_set():
+            peak[0] = max(peak[0], rss_kb(server.pid))
+            time.sleep(0.05)
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+
+    results = [None] * clients
+    threads = [threading.Thread(target=download, args=(results, i)) for i in range(clients)]
+    t0 = time.monotonic()
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    elapsed = time.monotonic() - t0
+    done.set()
+    sampler.join()
+    server.terminate()
+    server.wait()
+
+    ok = [r for r in results if r and r[0] is not None]
+    total = sum(r[2] for r in ok)
+    # transfer window: first byte anywhere -> last byte anywhere (skips the 1s work delay)
+    window = max(r[1] for r in ok) - min(r[0] for r in ok) if ok else 0
+    label = "sendfile" if not extra_args else "buffered"
+    print(f"{label:>9}: {len(ok)}/{clients} downloads, {total / 2**30:.1f} GiB in {elapsed:.1f}s "
+          f"({total / 2**20 / window if window else 0:.0f} MiB/s while transferring), "
+          f"server RSS idle {idle_rss / 1024:.0f} MiB, peak {peak[0] / 1024:.0f} MiB")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as content:
+        # sparse file: no disk space needed, and reads come from the page cache
+        with open(os.path.join(content, "big.pdf"), "wb") as f:
+            f.truncate(size_mb * 2**20)
+        print(f"{clients} concurrent downloads of a {size_mb} MiB file, mode={mode}")
+        run(content, [])
+        run(content, ["--no-sendfile"])
@@ -0,0 +1,117 @@
+# slowloris.py
+# Slow-client check for the servers' timeouts and connection caps.
+# Opens --slow connections that trickle a request head one header every
+# --interval seconds (never finishing it), while one normal client fetches a
+# page every half second. Prints how the normal client fared and how long
+# the server kept the slow connections around. On one machine, give the slow
+# connections their own loopback address (--slow-from 127.0.0.2) so that
+# per-client caps and bans do not hit the normal client as well.
+#
+#   python testing/slowloris.py --port 8081 --slow 200 --interval 2 --duration 30 --slow-from 127.0.0.2
+import select, socket, sys, threading, time
+from collections import Counter
+
+def arg(name, default, cast=int):
+    return cast(sys.argv[sys.argv.index(name) + 1]) if name in sys.argv else default
+
+host = arg("--host", "127.0.0.1", str)
+port = arg("--port", 8081)
+slow = arg("--slow", 200)
+interval = arg("--interval", 2.0, float)
+duration = arg("--duration", 30.0, float)
+path = arg("--path", "/", str)
+slow_from = arg("--slow-from", "", str)     # source address of the slow connections
+
+lock = threading.Lock()
+lifetimes = []          # seconds each slow connection lasted before the server closed it
+refused = Counter()     # how slow connections were turned away
+
+
+def slow_client(i):
+    t0 = time.monotonic()
+    try:
+        s = socket.create_connection((host, port), timeout=5,
+                                     source_address=(slow_from, 0) if slow_from else None)
+    except OSError as e:
+        with lock:
+            refused[type(e).__name__] += 1
+        return
+    try:
+        s.sendall(f"GET /?slow={i} HTTP/1.1\r\nHost: {host}\r\n".encode())
+        n = 0
+        while time.monotonic() - t0 < duration:
+            if server_closed(s, interval):
+                break
+            s.sendall(f"X-Slow-{n}: {'a' * 10}\r\n".encode())
+            n += 1
+        else:
+            with lock:
+                refused["survived"] += 1
+            return
+    except OSError:
+        pass                # a send failed: closed at least by now
+    finally:
+        s.close()
+    with lock:
+        lifetimes.append(time.monotonic() - t0)
+
+
+def server_closed(s, wait):
+    """
+    Wait up to `wait` seconds between drips, returning True as soon as the
+    server closes the connection (EOF or reset), so the lifetime is measured
+    when that happens rather than at the next send that fails. Anything the
+    server says first (a 408, say) is read and ignored.
+    """
+    end = time.monotonic() + wait
+    while (left := end - time.monotonic()) > 0:
+        if not select.select([s], [], [], left)[0]:
+            return False
+        try:
+            if not s.recv(4096):
+                return True
+        except OSError:
+            return True
+    return False
+
+
+def normal_client(results):
+    req = f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode()
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        t0 = time.monotonic()
+        try:
+            with socket.create_connection((host, port), timeout=10) as s:
+                s.sendall(req)
+                data = b""
+                while chunk := s.recv(65536):
+                    data += chunk
+            status = data.split(b" ", 2)[1].decode() if data else "empty"
+        except OSError as e:
+            status = type(e).__name__
+        results.append((status, time.monotonic() - t0))
+        time.sleep(0.5)
+
+
+if __name__ == "__main__":
+    print(f"{slow} slow connections to {host}:{port}, one header line every {interval:g}s, for {duration:g}s")
+    threads = [threading.Thread(target=slow_client, args=(i,), daemon=True) for i in range(slow)]
+    for t in threads:
+        t.start()
+    results = []
+    normal = threading.Thread(target=normal_client, args=(results,))
+    normal.start()
+    normal.join()
+    for t in threads:
+        t.join(interval + 1)
+
+    statuses = Counter(status for status, _ in results)
+    latencies = sorted(t for _, t in results)
+    print(f"normal client: {len(results)} requests {dict(statuses)}")
+    if latencies:
+        print(f"  latency median {latencies[len(latencies) // 2] * 1000:.0f}ms, max {latencies[-1] * 1000:.0f}ms")
+    if lifetimes:
+        lifetimes.sort()
+        print(f"slow connections dropped by the server: {len(lifetimes)}, "
+              f"after median {lifetimes[len(lifetimes) // 2]:.1f}s, max {lifetimes[-1]:.1f}s")
+    print(f"slow connections otherwise: {dict(refused)}")
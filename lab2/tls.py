@@ -0,0 +1,72 @@
+# tls.py
+# Optional HTTPS for the lab servers (--tls-cert/--tls-key, or --tls-self-signed
+# for local testing). One server SSLContext is built at startup and used for
+# every connection; it is created before --workers forks, so all worker
+# processes hold the same session ticket keys and a ticket issued by one
+# worker resumes on any other.
+#
+# Resumption: TLS 1.3 clients get `tickets` session tickets after a full
+# handshake and can come back with one, skipping the certificate signature
+# and key exchange that make a full handshake expensive. TLS 1.2 clients
+# resume with RFC 5077 tickets or OpenSSL's per-process session cache.
+# ALPN offers http/1.1 only (no h2 here).
+#
+# The blocking servers run the handshake in the thread that serves the
+# connection, bounded by the header timeout, so a client that opens a
+# connection and never says hello is dropped like one that never sends a
+# request. In async mode asyncio does the same (ssl_handshake_timeout).
+import os, socket, ssl, subprocess, tempfile, time
+
+ALPN = ("http/1.1",)
+
+
+def self_signed(directory=None, host="localhost"):
+    """(cert, key) of a self-signed certificate for host and 127.0.0.1, made once with the openssl CLI."""
+    directory = directory or os.path.join(tempfile.gettempdir(), "lab2-tls")
+    cert, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    if not (os.path.exists(cert) and os.path.exists(key)):
+        os.makedirs(directory, exist_ok=True)
+        # P-256: the signature in every full handshake is much cheaper than with RSA-2048
+        subprocess.run(
+            ["openssl", "req", "-x509", "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1",
+             "-nodes", "-days", "365", "-subj", f"/CN={host}",
+             "-addext", f"subjectAltName=DNS:{host},IP:127.0.0.1",
+             "-keyout", key, "-out", cert],
+            check=True, capture_output=True,
+        )
+    return cert, key
+
+
+def server_context(cert, key, tickets=2):
+    """The shared server context; tickets=0 issues no session tickets (full handshakes only, TLS 1.3)."""
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.minimum_version = ssl.TLSVersion.TLSv1_2
+    ctx.load_cert_chain(cert, key)
+    ctx.set_alpn_protocols(list(ALPN))
+    ctx.num_tickets = tickets
+    if not tickets:
+        ctx.options |= ssl.OP_NO_TICKET
+    return ctx
+
+
+def handshake(ctx, conn, timeout):
+    """
+    Server side of the handshake on an accepted socket, within timeout seconds.
+    Returns (SSLSocket, seconds it took). The plain socket is taken over by the
+    SSLSocket, which is closed if the handshake fails (ssl.SSLError, or
+    socket.timeout for a client that stalls).
+    """
+    conn.settimeout(timeout)
+    # a response leaves as several TLS records, one send() each: without this the
+    # last one waits for the client's delayed ACK (Nagle), ~40 ms per response
+    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    started = time.perf_counter()
+    tls = ctx.wrap_socket(conn, server_side=True)
+    return tls, time.perf_counter() - started
+
+
+def describe(ctx):
+    stats = ctx.session_stats()
+    # "hits" counts every resumption, by ticket or by cached session id
+    return (f"tickets={ctx.num_tickets} resumed={stats['hits']} resume_failed={stats['misses']} "
+            f"cached_sessions={stats['number']}")
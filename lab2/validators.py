@@ -0,0 +1,77 @@
+# validators.py
+# Conditional GET support for static files. Validators come from stat() data
+# only, never from hashing the contents:
+#   ETag           "<size hex>-<mtime_ns hex>", changes whenever the file is rewritten
+#   Last-Modified  mtime, to the second
+# A request whose If-None-Match (or, without it, If-Modified-Since) matches
+# gets a bodiless 304 carrying the same validators and Cache-Control.
+#
+# CachePolicy picks the Cache-Control value by MIME type: an exact type wins,
+# then a "major/" prefix such as "image/", then the default.
+import email.utils
+from datetime import timezone
+
+DEFAULT_CACHE_CONTROL = {
+    "image/": "public, max-age=86400",
+    "application/pdf": "public, max-age=3600",
+    "text/html": "no-cache",                # always revalidate, a 304 is cheap
+}
+
+
+def entity_tag(size, mtime_ns):
+    return f'"{size:x}-{mtime_ns:x}"'
+
+
+def http_date(ts):
+    return email.utils.formatdate(ts, usegmt=True)
+
+
+class CachePolicy:
+    def __init__(self, rules=None, default="no-cache"):
+        self.rules = dict(DEFAULT_CACHE_CONTROL if rules is None else rules)
+        self.default = default
+
+    @classmethod
+    def parse(cls, specs, default="no-cache"):
+        """Defaults overridden by "TYPE=VALUE" strings, e.g. "image/=public, max-age=600"."""
+        rules = dict(DEFAULT_CACHE_CONTROL)
+        for spec in specs:
+            ctype, sep, value = spec.partition("=")
+            if sep:
+                rules[ctype.strip().removesuffix("*")] = value.strip()
+        return cls(rules, default)
+
+    def for_type(self, ctype):
+        if ctype in self.rules:
+            return self.rules[ctype]
+        return self.rules.get(ctype.split("/", 1)[0] + "/", self.default)
+
+
+def validator_headers(st, ctype, policy):
+    """ETag, Last-Modified and Cache-Control lines for a file (sent with 200 and 304)."""
+    return [
+        f"ETag: {entity_tag(st.st_size, st.st_mtime_ns)}",
+        f"Last-Modified: {http_date(st.st_mtime)}",
+        f"Cache-Control: {policy.for_type(ctype)}",
+    ]
+
+
+def not_modified(headers, etag, mtime_ns):
+    """True if the request's conditional headers show the client's copy is current."""
+    # If-None-Match takes precedence; weak comparison, as allowed for GET/HEAD
+    tags = headers.get("if-none-match")
+    if tags is not None:
+        if tags.strip() == "*":
+            return True
+        return any(t.strip().removeprefix("W/") == etag for t in tags.split(","))
+
+    since = headers.get("if-modified-since")
+    if not since:
+        return False
+    try:
+        dt = email.utils.parsedate_to_datetime(since)
+    except (TypeError, ValueError):
+        return False            # unparsable dates are ignored, as RFC 9110 says
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return mtime_ns // 10**9 <= dt.timestamp()
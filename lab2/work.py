@@ -0,0 +1,148 @@
+# work.py
+# The simulated "application work" each request does before the file is
+# served, so the concurrency models can be compared under different loads:
+#
+#   sleep  waiting that costs nothing (the original time.sleep(1.0))
+#   cpu    pure-Python number crunching for that many CPU seconds. With
+#          cpu_procs > 0 it runs in a process pool, outside this process's
+#          GIL; with 0 it runs in the handling thread (in async mode, on the
+#          event loop itself), which is what a naive server would do
+#   io     blocking disk I/O: 4 KiB writes, each forced out with fdatasync(),
+#          until the time is up. The GIL is released while waiting. (On
+#          tmpfs the sync returns immediately and this turns into CPU work.)
+#   none   no delay at all
+#
+# A mix such as "sleep=0.6,cpu=0.3,io=0.1" picks a kind per request by weight.
+# Durations are drawn around `mean` seconds from a distribution:
+#   fixed      always mean
+#   uniform    0 .. 2 x mean
+#   exp        exponential (many short, a few long)
+#   lognormal  heavy tail, sigma 1
+# and capped at MAX_FACTOR x mean.
+import asyncio, math, os, random, tempfile, threading, time
+from concurrent.futures import ProcessPoolExecutor
+
+KINDS = ("sleep", "cpu", "io", "none")
+DISTRIBUTIONS = ("fixed", "uniform", "exp", "lognormal")
+MAX_FACTOR = 20
+
+
+def parse_mix(spec):
+    """Kinds and weights of a spec such as "cpu" or "sleep=0.6,cpu=0.4"."""
+    kinds, weights = [], []
+    for part in spec.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in KINDS:
+            raise ValueError(f"unknown work kind {kind!r} (expected one of {', '.join(KINDS)})")
+        kinds.append(kind)
+        weights.append(float(weight) if weight else 1.0)
+    return kinds, weights
+
+
+def burn(seconds):
+    """Spin for `seconds` of this thread's CPU time; returns a meaningless number."""
+    end = time.thread_time() + seconds
+    n = 1
+    while time.thread_time() < end:
+        for _ in range(2000):
+            n = (n * 1103515245 + 12345) & 0x7FFFFFFF
+    return n
+
+
+def disk_wait(fd, seconds):
+    """Synchronous 4 KiB writes to fd until `seconds` have passed."""
+    end = time.monotonic() + seconds
+    block = bytes(4096)
+    i = 0
+    while time.monotonic() < end:
+        os.pwrite(fd, block, (i % 256) * 4096)
+        os.fdatasync(fd)
+        i += 1
+
+
+class Work:
+    def __init__(self, spec="sleep", mean=1.0, dist="fixed", cpu_procs=0):
+        if dist not in DISTRIBUTIONS:
+            raise ValueError(f"unknown distribution {dist!r} (expected one of {', '.join(DISTRIBUTIONS)})")
+        self.kinds, self.weights = parse_mix(spec)
+        self.mean = mean
+        self.dist = dist
+        self.cpu_procs = cpu_procs
+        self.procs = None           # ProcessPoolExecutor for cpu work, made by start()
+        self.fd = None              # scratch file for io work, made by start()
+        self.lock = threading.Lock()
+        self.count = dict.fromkeys(self.kinds, 0)
+        self.seconds = dict.fromkeys(self.kinds, 0.0)   # wall time spent, per kind
+
+    def start(self):
+        """Per process (after fork): the CPU pool and the scratch file, if this mix needs them."""
+        if "cpu" in self.kinds and self.cpu_procs and self.procs is None:
+            self.procs = ProcessPoolExecutor(self.cpu_procs)
+            # fork the pool now, before more threads exist, not on the first request
+            self.procs.submit(burn, 0).result()
+        if "io" in self.kinds and self.fd is None:
+            fd, path = tempfile.mkstemp(prefix="work-io-")
+            os.unlink(path)
+            self.fd = fd
+
+    def draw(self):
+        """(kind, seconds) for one request."""
+        kind = self.kinds[0] if len(self.kinds) == 1 else random.choices(self.kinds, self.weights)[0]
+        mean = self.mean
+        if kind == "none":
+            return kind, 0.0
+        if self.dist == "fixed":
+            seconds = mean
+        elif self.dist == "uniform":
+            seconds = random.uniform(0.0, 2 * mean)
+        elif self.dist == "exp":
+            seconds = random.expovariate(1 / mean) if mean > 0 else 0.0
+        else:
+            # mu chosen so that the mean of the distribution is `mean`
+            seconds = random.lognormvariate(math.log(mean) - 0.5, 1.0) if mean > 0 else 0.0
+        return kind, min(seconds, MAX_FACTOR * mean)
+
+    def run(self):
+        """Do one request's work, blocking the calling thread. Returns the kind."""
+        kind, seconds = self.draw()
+        started = time.monotonic()
+        if kind == "sleep":
+            time.sleep(seconds)
+        elif kind == "cpu":
+            if self.procs:
+                self.procs.submit(burn, seconds).result()
+            else:
+                burn(seconds)
+        elif kind == "io":
+            disk_wait(self.fd, seconds)
+        self._count(kind, started)
+        return kind
+
+    async def run_async(self, io_pool=None):
+        """Do one request's work without blocking the event loop (except cpu with no pool)."""
+        kind, seconds = self.draw()
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        if kind == "sleep":
+            await asyncio.sleep(seconds)
+        elif kind == "cpu":
+            if self.procs:
+                await loop.run_in_executor(self.procs, burn, seconds)
+            else:
+                burn(seconds)
+        elif kind == "io":
+            await loop.run_in_executor(io_pool, disk_wait, self.fd, seconds)
+        self._count(kind, started)
+        return kind
+
+    def _count(self, kind, started):
+        with self.lock:
+            self.count[kind] += 1
+            self.seconds[kind] += time.monotonic() - started
+
+    def describe(self):
+        with self.lock:
+            parts = [f"{kind}={n} avg={self.seconds[kind] / n * 1000:.0f}ms" if n else f"{kind}=0"
+                     for kind, n in self.count.items()]
+        return f"dist={self.dist} mean={self.mean * 1000:.0f}ms " + " ".join(parts)
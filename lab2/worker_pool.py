@@ -0,0 +1,92 @@
+# worker_pool.py
+# Fixed-size thread pool fed by a bounded accept queue.
+# The acceptor never blocks on a full queue: it hands the connection to
+# on_reject (the server sends a quick 503) and moves on.
+import queue, threading, time
+
+
+class WorkerPool:
+    def __init__(self, handler, workers=32, queue_size=128, on_reject=None):
+        self.handler = handler                  # handler(conn, addr), runs on a worker
+        self.on_reject = on_reject              # on_reject(conn, addr), runs on the acceptor
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+
+        # metrics (guarded by stats_lock)
+        self.stats_lock = threading.Lock()
+        self.accepted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.busy = 0
+        self.max_depth = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+        for i in range(workers):
+            threading.Thread(target=self._worker, name=f"worker-{i}", daemon=True).start()
+
+    def submit(self, conn, addr):
+        """Queue a connection. Returns False (after calling on_reject) if the queue is full."""
+        try:
+            self.queue.put_nowait((conn, addr, time.monotonic()))
+        except queue.Full:
+            with self.stats_lock:
+                self.rejected += 1
+            if self.on_reject:
+                self.on_reject(conn, addr)
+            else:
+                conn.close()
+            return False
+        depth = self.queue.qsize()
+        with self.stats_lock:
+            self.accepted += 1
+            self.max_depth = max(self.max_depth, depth)
+        return True
+
+    def _worker(self):
+        while True:
+            conn, addr, queued_at = self.queue.get()
+            waited = time.monotonic() - queued_at
+            with self.stats_lock:
+                self.busy += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+            try:
+                self.handler(conn, addr)
+            except Exception as e:
+                print(f"[pool] error handling {addr[0]}: {e}", flush=True)
+            finally:
+                with self.stats_lock:
+                    self.busy -= 1
+                    self.completed += 1
+
+    def stats(self):
+        with self.stats_lock:
+            started = self.completed + self.busy
+            return {
+                "workers": self.workers,
+                "busy": self.busy,
+                "queue_depth": self.queue.qsize(),
+                "queue_capacity": self.queue.maxsize,
+                "max_queue_depth": self.max_depth,
+                "accepted": self.accepted,
+                "rejected": self.rejected,
+                "completed": self.completed,
+                "avg_wait_ms": 1000 * self.wait_total / started if started else 0.0,
+                "max_wait_ms": 1000 * self.wait_max,
+            }
+
+    def report_every(self, interval, label="pool"):
+        """Print a stats line every `interval` seconds from a daemon thread."""
+        def loop():
+            while True:
+                time.sleep(interval)
+                st = self.stats()
+                print(
+                    f"[{label}] busy={st['busy']}/{st['workers']} "
+                    f"queue={st['queue_depth']}/{st['queue_capacity']} (max {st['max_queue_depth']}) "
+                    f"wait avg={st['avg_wait_ms']:.1f}ms max={st['max_wait_ms']:.1f}ms "
+                    f"accepted={st['accepted']} rejected={st['rejected']}",
+                    flush=True,
+                )
+        threading.Thread(target=loop, name=f"{label}-stats", daemon=True).start()